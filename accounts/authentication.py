@@ -0,0 +1,112 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+
+from rokaf_crawler.cache import TTLCache
+
+# 요청마다 authtoken_token을 조회하지 않도록 token -> (user, token)을 캐시한다.
+# 프로세스 안의 LRU(짧은 TTL) -> 공유 cache(settings.TOKEN_AUTH_CACHE['alias']) -> DB 순서로 찾는다.
+# 로그아웃(LogoutView)과 사용자 정보 변경(accounts.signals)에서 invalidate_token으로 바로 지운다.
+# 다른 프로세스의 LRU는 지울 수 없으므로 local_ttl을 짧게 둔다.
+# 공유 cache는 Redis처럼 모든 worker가 보는 backend일 때만 쓴다. LocMem을 쓰면 로그아웃한 token이
+# 다른 worker의 LocMem에 shared_ttl 동안 남아 계속 인증되므로, 그런 backend면 공유 cache 단계를 건너뛴다.
+# 캐시에는 model instance 대신 필드 값만 두고 요청마다 새 instance를 만든다.
+# 한 요청에서 request.user를 바꿔도 다른 요청에 섞이지 않고, 비밀번호 hash는 캐시에 남기지 않는다.
+
+config = {'alias': None, 'local_maxsize': 10000, 'local_ttl': 30.0, 'shared_ttl': 600.0,
+          **getattr(settings, 'TOKEN_AUTH_CACHE', {})}
+
+local_cache = TTLCache(maxsize=config['local_maxsize'], ttl=config['local_ttl'])
+
+# 캐시하지 않는 사용자 필드 (필요하면 instance에서 지연 로딩된다)
+UNCACHED_USER_FIELDS = ('password', 'last_login')
+
+
+def get_cache_key(key: str) -> str:
+    # 캐시 값 형식을 바꾸면 version을 올려 이전 형식의 값을 읽지 않게 한다.
+    return f'auth-token:v2:{key}'
+
+
+# 프로세스마다 따로 저장하는 backend
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def get_shared_cache():
+    """
+    token 인증에 쓸 공유 cache. 설정하지 않았거나 프로세스별 backend면 None
+    """
+    alias = config['alias']
+    if not alias or alias not in settings.CACHES:
+        return None
+    if settings.CACHES[alias].get('BACKEND') in PROCESS_LOCAL_CACHE_BACKENDS:
+        return None
+    return caches[alias]
+
+
+def invalidate_token(key: str) -> None:
+    local_cache.invalidate(key)
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        shared_cache.delete(get_cache_key(key))
+
+
+def get_cached_user_fields() -> list:
+    return [field.attname for field in get_user_model()._meta.concrete_fields
+            if field.name not in UNCACHED_USER_FIELDS]
+
+
+def to_cached(user, token) -> tuple:
+    """
+    (user, token) -> 캐시에 넣을 (user 필드 값, token 필드 값)
+    """
+    return ({field: getattr(user, field) for field in get_cached_user_fields()},
+            {'key': token.key, 'user_id': token.user_id, 'created': token.created})
+
+
+def from_cached(cached: tuple) -> tuple:
+    """
+    캐시한 필드 값으로 요청마다 새 (user, token) instance를 만든다.
+    """
+    user_values, token_values = cached
+    user = get_user_model().from_db(DEFAULT_DB_ALIAS, list(user_values), list(user_values.values()))
+    token = Token.from_db(DEFAULT_DB_ALIAS, list(token_values), list(token_values.values()))
+    token.user = user
+    return user, token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        cached = local_cache.get(key)
+        if cached is None:
+            shared_cache = get_shared_cache()
+            if shared_cache is not None:
+                cached = shared_cache.get(get_cache_key(key))
+            if cached is None:
+                cached = to_cached(*super().authenticate_credentials(key))
+                if shared_cache is not None:
+                    shared_cache.set(get_cache_key(key), cached, config['shared_ttl'])
+            local_cache.set(key, cached)
+
+        if not cached[0]['is_active']:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return from_cached(cached)
+
+    async def aauthenticate(self, request):
+        """
+        async view용 authenticate
+        프로세스 안의 LRU에 있으면 바로 반환하고, 없을 때만 thread에서 공유 cache/DB를 조회한다.
+        """
+        auth = get_authorization_header(request).split()
+        if len(auth) == 2 and auth[0].lower() == self.keyword.lower().encode():
+            cached = local_cache.get(auth[1].decode('utf-8', errors='ignore'))
+            if cached is not None and cached[0]['is_active']:
+                return from_cached(cached)
+        return await sync_to_async(self.authenticate)(request)
@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from accounts.authentication import UNCACHED_USER_FIELDS, invalidate_token
+from api.models import User
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, update_fields=None, **kwargs):
+    # 캐시된 user 정보가 바뀌었으므로 해당 사용자의 token 캐시를 지운다.
+    # 새 사용자는 token이 없고, 캐시하지 않는 필드만 저장한 경우(로그인 시 last_login 등)는 지울 필요가 없다.
+    if created or (update_fields is not None and set(update_fields) <= set(UNCACHED_USER_FIELDS)):
+        return
+    for key in Token.objects.filter(user=instance).values_list('key', flat=True):
+        invalidate_token(key)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_token(instance.key)
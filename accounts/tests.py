@@ -1,3 +1,125 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import update_last_login
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
+
+from accounts.authentication import CachedTokenAuthentication, config, get_cache_key, get_shared_cache, local_cache
+from api.models import User
+
+
+class CachedTokenAuthenticationTest(TestCase):
+    """
+    공유 cache는 여러 프로세스가 함께 보는 FileBasedCache로 대신한다.
+    """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cache_dir = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        cls.enterClassContext(override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'shared': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir},
+        }))
+        cls.enterClassContext(mock.patch.dict(config, {'alias': 'shared'}))
+
+    def setUp(self):
+        local_cache.clear()
+        get_shared_cache().clear()
+        self.user = User.objects.create_user(email='user@example.com', password='password', name='홍길동')
+        self.token = Token.objects.create(user=self.user)
+        self.authentication = CachedTokenAuthentication()
+
+    def test_returns_fresh_instances(self):
+        user, token = self.authentication.authenticate_credentials(self.token.key)
+        user.name = '바뀐 이름'
+
+        with self.assertNumQueries(0):
+            cached_user, cached_token = self.authentication.authenticate_credentials(self.token.key)
+        self.assertIsNot(cached_user, user)
+        self.assertEqual(cached_user.name, '홍길동')
+        self.assertEqual(cached_user.pk, self.user.pk)
+        self.assertIs(cached_token.user, cached_user)
+        self.assertEqual(cached_token.key, self.token.key)
+
+    def test_password_is_not_cached(self):
+        self.authentication.authenticate_credentials(self.token.key)
+
+        for cached in (local_cache.get(self.token.key), get_shared_cache().get(get_cache_key(self.token.key))):
+            self.assertNotIn('password', cached[0])
+            self.assertNotIn('last_login', cached[0])
+
+        user, _ = self.authentication.authenticate_credentials(self.token.key)
+        # 필요하면 DB에서 지연 로딩한다.
+        with self.assertNumQueries(1):
+            self.assertTrue(user.check_password('password'))
+
+    def test_shared_cache_is_used_across_processes(self):
+        self.authentication.authenticate_credentials(self.token.key)
+        local_cache.clear()
+
+        with self.assertNumQueries(0):
+            user, _ = self.authentication.authenticate_credentials(self.token.key)
+        self.assertEqual(user.email, 'user@example.com')
+
+    def test_process_local_cache_is_not_shared(self):
+        # LocMem은 worker마다 따로이므로 공유 cache로 쓰지 않고, 설정이 없으면 공유 cache 단계를 건너뛴다.
+        for alias in ('default', None):
+            with self.subTest(alias=alias), mock.patch.dict(config, {'alias': alias}):
+                self.assertIsNone(get_shared_cache())
+                self.authentication.authenticate_credentials(self.token.key)
+                local_cache.clear()
+                with self.assertNumQueries(1):
+                    self.authentication.authenticate_credentials(self.token.key)
+                local_cache.clear()
+
+    def test_logout_invalidates_shared_cache(self):
+        self.authentication.authenticate_credentials(self.token.key)
+        key = self.token.key
+
+        self.token.delete()
+        self.assertIsNone(get_shared_cache().get(get_cache_key(key)))
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authentication.authenticate_credentials(key)
+
+    def test_login_does_not_invalidate(self):
+        self.authentication.authenticate_credentials(self.token.key)
+
+        # auth.login()이 호출하는 last_login 갱신 (save(update_fields=['last_login']))
+        update_last_login(None, self.user)
+        self.assertIsNotNone(local_cache.get(self.token.key))
+
+        self.user.set_password('new password')
+        self.user.save(update_fields=['password'])
+        self.assertIsNotNone(local_cache.get(self.token.key))
+
+    def test_profile_change_invalidates(self):
+        self.authentication.authenticate_credentials(self.token.key)
+
+        self.user.name = '김철수'
+        self.user.save()
+        self.assertIsNone(local_cache.get(self.token.key))
+        self.assertIsNone(get_shared_cache().get(get_cache_key(self.token.key)))
+
+        user, _ = self.authentication.authenticate_credentials(self.token.key)
+        self.assertEqual(user.name, '김철수')
+
+    def test_inactive_user(self):
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.token.key)
+
+    async def test_aauthenticate_returns_fresh_instances(self):
+        request = AsyncRequestFactory().get('/', headers={'Authorization': f'Token {self.token.key}'})
+
+        user, _ = await self.authentication.aauthenticate(request)
+        user.name = '바뀐 이름'
+        cached_user, _ = await self.authentication.aauthenticate(request)
+
+        self.assertIsNot(cached_user, user)
+        self.assertEqual(cached_user.name, '홍길동')
@@ -7,3 +7,5 @@ admin.site.register(Letter)
 admin.site.register(Trainee)
 admin.site.register(User)
 admin.site.register(TraineeToUser)
+admin.site.register(DeliveryJob)
+admin.site.register(LetterListWatermark)
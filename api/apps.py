@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        import rokaf_crawler
+        rokaf_crawler.sessions.configure(**getattr(settings, 'ROKAF_CRAWLER_HTTP', {}))
+        rokaf_crawler.throttling.configure(**getattr(settings, 'ROKAF_CRAWLER_THROTTLE', {}))
+        rokaf_crawler.parsers.set_parser(getattr(settings, 'ROKAF_CRAWLER_PARSER', None))
+        rokaf_crawler.cache.search_cache.configure(**getattr(settings, 'ROKAF_CRAWLER_SEARCH_CACHE', {}))
+        # crawler 단계별 소요 시간 histogram (GET metrics/crawler/)
+        self.crawler_metrics = rokaf_crawler.instrumentation.add_sink(rokaf_crawler.instrumentation.PrometheusSink())
+
+        from api.gpt import draft_cache
+        draft_cache.configure(**getattr(settings, 'GPT_DRAFT_CACHE', {}))
@@ -0,0 +1,181 @@
+"""
+OpenAI chat completions API를 흉내 내는 로컬 서버
+
+GPT 편지 초안 생성(gpt/draft/stream/) 부하 테스트에 실제 API를 쓸 수 없으므로
+POST /v1/chat/completions 에 OpenAI와 같은 형태로 응답한다.
+    - stream=true: token마다 "data: {chat.completion.chunk}" SSE를 보내고 "data: [DONE]"으로 끝낸다.
+    - stream=false: chat.completion JSON 하나
+
+    python -m api.fake_completion_server --port 8082 --first-token-latency 0.3 --token-latency 0.02
+Django에서 이 서버를 사용하려면 OPENAI_BASE_URL 환경변수를 http://127.0.0.1:8082/v1 로 설정한다.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+DEFAULT_CONTENT = ("사랑하는 훈련병에게, 매일 힘든 훈련 받느라 정말 고생 많지? "
+                   "밥 잘 챙겨 먹고 동기들과 서로 의지하면서 건강하게 지내길 바랄게. "
+                   "수료하는 날 웃으면서 만나자! 항상 응원할게.")
+
+
+class FakeCompletionConfig(BaseModel):
+    host: str = '127.0.0.1'
+    port: int = 8082
+    # 첫 token까지 걸리는 시간과 이후 token 사이 간격(초)
+    first_token_latency: float = 0.3
+    token_latency: float = 0.02
+    error_rate: float = 0.0
+    content: str = DEFAULT_CONTENT
+    seed: Optional[int] = None
+
+
+def split_tokens(content: str) -> List[str]:
+    # 실제 tokenizer 대신 공백 단위로 나눈다.
+    words = content.split(' ')
+    return [word if i == 0 else ' ' + word for i, word in enumerate(words)]
+
+
+class FakeCompletionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def config(self) -> FakeCompletionConfig:
+        return self.server.config
+
+    def send_json(self, status: int, data: dict) -> None:
+        content = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_json(404, {'error': {'message': 'not found', 'type': 'invalid_request_error'}})
+            return
+
+        with self.server.lock:
+            self.server.request_count += 1
+            failed = self.server.random.random() < self.config.error_rate
+        if failed:
+            self.send_json(503, {'error': {'message': 'fake server error', 'type': 'server_error'}})
+            return
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = body.get('model', 'gpt-3.5-turbo')
+        time.sleep(self.config.first_token_latency)
+
+        if not body.get('stream'):
+            tokens = split_tokens(self.config.content)
+            time.sleep(self.config.token_latency * (len(tokens) - 1))
+            self.send_json(200, {
+                'id': completion_id, 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': i, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': self.config.content}}
+                            for i in range(body.get('n', 1))],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': len(tokens), 'total_tokens': len(tokens)},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        def chunk(delta: dict, finish_reason: Optional[str] = None) -> bytes:
+            data = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                    'model': model, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+
+        try:
+            self.wfile.write(chunk({'role': 'assistant', 'content': ''}))
+            for i, token in enumerate(split_tokens(self.config.content)):
+                if i:
+                    time.sleep(self.config.token_latency)
+                self.wfile.write(chunk({'content': token}))
+                self.wfile.flush()
+            self.wfile.write(chunk({}, 'stop'))
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # client가 중간에 연결을 끊은 경우
+            pass
+        self.close_connection = True
+
+    def log_message(self, format, *args) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class FakeCompletionServer(ThreadingHTTPServer):
+    """
+        with FakeCompletionServer(FakeCompletionConfig(port=0)) as server:
+            settings.OPENAI_BASE_URL = server.url
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, config: Optional[FakeCompletionConfig] = None, verbose: bool = False):
+        self.config = config or FakeCompletionConfig()
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.random = random.Random(self.config.seed)
+        self.request_count = 0
+        self.thread = None
+        super().__init__((self.config.host, self.config.port), FakeCompletionHandler)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> 'FakeCompletionServer':
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> 'FakeCompletionServer':
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8082)
+    arg_parser.add_argument('--first-token-latency', type=float, default=0.3)
+    arg_parser.add_argument('--token-latency', type=float, default=0.02)
+    arg_parser.add_argument('--error-rate', type=float, default=0.0)
+    arg_parser.add_argument('--seed', type=int)
+    arg_parser.add_argument('-v', '--verbose', action='store_true')
+    args = vars(arg_parser.parse_args())
+    verbose = args.pop('verbose')
+
+    server = FakeCompletionServer(FakeCompletionConfig(**args), verbose=verbose)
+    print(f"fake OpenAI API: {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
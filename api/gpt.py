@@ -0,0 +1,306 @@
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, List, Optional, Union
+
+from django.conf import settings
+
+from rokaf_crawler.cache import TTLCache
+from rokaf_crawler.throttling import TokenBucket
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI, RateLimitError
+
+# GPT 편지 초안 생성
+# AsyncOpenAI client(내부 httpx connection pool)는 event loop마다 하나만 만들어 재사용한다.
+# openai는 import 비용이 크므로(web worker, management command 시작 시간) client를 처음 만들 때 불러온다.
+# 같은 prompt(대부분 GptPromptSerializer 기본값)에 대한 응답은 DraftCache에 모아 두고 재사용한다.
+
+_client = None
+_client_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_client() -> 'OpenAI':
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
+                _client = OpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL,
+                                 timeout=settings.GPT_TIMEOUT, max_retries=0)
+    return _client
+
+
+def get_async_client() -> 'AsyncOpenAI':
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        from openai import AsyncOpenAI
+        client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL,
+                             timeout=settings.GPT_TIMEOUT, max_retries=0)
+        _async_clients[loop] = client
+    return client
+
+
+def get_messages(role: str, query_text: str) -> List[dict]:
+    return [
+        {'role': 'system', 'content': role},
+        {'role': 'user', 'content': query_text},
+    ]
+
+
+class SingleFlight:
+    """
+    같은 key로 동시에 들어온 호출은 먼저 들어온 호출 하나만 실행하고, 나머지는 그 결과를 기다려 함께 받는다.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn: Callable):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def ado(self, key, fn: Callable[[], Awaitable]):
+        """
+        do의 async 버전. fn은 coroutine 함수이며, sync 호출(do)과 같은 key를 공유한다.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class DraftCache(TTLCache):
+    """
+    prompt별 GPT 응답 캐시
+    key는 (model, 공백을 정리한 role/query_text)의 hash이고, 값은 응답(variant) 목록이다.
+    prompt마다 variants개의 서로 다른 응답을 모아 두고, 다 모이면 그중 하나를 무작위로 돌려준다.
+    """
+    def __init__(self, maxsize: int = 256, ttl: float = 3600.0, variants: int = 1, **kwargs):
+        super().__init__(maxsize=maxsize, ttl=ttl, **kwargs)
+        self.variants = variants
+        self.single_flight = SingleFlight()
+
+    def configure(self, maxsize: int = None, ttl: float = None, variants: int = None) -> None:
+        if maxsize is not None:
+            self.maxsize = maxsize
+        if ttl is not None:
+            self.ttl = ttl
+        if variants is not None:
+            self.variants = variants
+        self.clear()
+
+    @staticmethod
+    def get_key(model: str, role: str, query_text: str) -> str:
+        prompt = [model, " ".join(role.split()), " ".join(query_text.split())]
+        return hashlib.sha256(json.dumps(prompt, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def get_draft(self, key: str) -> Optional[str]:
+        """
+        variant가 다 모인 prompt면 그중 하나를, 아니면 None을 반환한다.
+        """
+        drafts = self.get(key)
+        if drafts is None or len(drafts) < self.variants:
+            return None
+        return random.choice(drafts)
+
+    def add_drafts(self, key: str, drafts: List[str]) -> None:
+        with self._lock:
+            item = self._data.get(key)
+            current = list(item[1]) if item is not None and item[0] > self.clock() else []
+        # 같은 내용의 응답이 와도 variant 하나로 센다. (temperature가 낮으면 응답이 거의 같을 수 있으므로 중복은 확인하지 않는다.)
+        self.set(key, (current + drafts)[:self.variants])
+
+
+draft_cache = DraftCache()
+
+
+def get_draft(role: str, query_text: str) -> str:
+    """
+    캐시된 응답이 있으면 바로 반환하고, 없으면 completion을 요청한다.
+    같은 prompt의 동시 요청은 upstream 요청 하나를 공유하며, 부족한 variant는 n 옵션으로 한 번에 채운다.
+    """
+    key = draft_cache.get_key(settings.GPT_MODEL, role, query_text)
+    draft = draft_cache.get_draft(key)
+    if draft is not None:
+        return draft
+
+    def create() -> List[str]:
+        drafts = draft_cache.get(key) or []
+        query = get_client().chat.completions.create(
+            model=settings.GPT_MODEL,
+            messages=get_messages(role, query_text),
+            n=max(1, draft_cache.variants - len(drafts)),
+        )
+        new_drafts = [choice.message.content for choice in query.choices]
+        draft_cache.add_drafts(key, new_drafts)
+        return new_drafts
+
+    return random.choice(draft_cache.single_flight.do(key, create))
+
+
+async def aget_draft(role: str, query_text: str) -> str:
+    """
+    get_draft의 async 버전 (event loop 공용 AsyncOpenAI client 사용)
+    """
+    key = draft_cache.get_key(settings.GPT_MODEL, role, query_text)
+    draft = draft_cache.get_draft(key)
+    if draft is not None:
+        return draft
+
+    async def create() -> List[str]:
+        drafts = draft_cache.get(key) or []
+        query = await get_async_client().chat.completions.create(
+            model=settings.GPT_MODEL,
+            messages=get_messages(role, query_text),
+            n=max(1, draft_cache.variants - len(drafts)),
+        )
+        new_drafts = [choice.message.content for choice in query.choices]
+        draft_cache.add_drafts(key, new_drafts)
+        return new_drafts
+
+    return random.choice(await draft_cache.single_flight.ado(key, create))
+
+
+async def stream_draft(role: str, query_text: str) -> AsyncIterator[str]:
+    """
+    completion을 stream으로 요청하고, token(조각)이 도착하는 대로 반환한다.
+    캐시된 응답이 있으면 upstream 요청 없이 한 번에 반환하고, 새로 받은 응답은 캐시에 추가한다.
+    """
+    key = draft_cache.get_key(settings.GPT_MODEL, role, query_text)
+    draft = draft_cache.get_draft(key)
+    if draft is not None:
+        yield draft
+        return
+
+    stream = await get_async_client().chat.completions.create(
+        model=settings.GPT_MODEL,
+        messages=get_messages(role, query_text),
+        stream=True,
+    )
+    contents = []
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                contents.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+    finally:
+        # client가 연결을 끊으면 upstream 요청도 바로 닫는다.
+        await stream.close()
+    draft_cache.add_drafts(key, ["".join(contents)])
+
+
+# 여러 훈련병에게 보낼 초안을 한 번에 생성
+# 훈련병마다 prompt가 다르므로 DraftCache는 거치지 않고, 동시 요청 수(concurrency)와 초당 요청 수(rate)를 제한한다.
+# 429(rate limit)를 받으면 Retry-After 동안 batch 전체의 요청을 멈춘 뒤 다시 시도한다.
+
+RATE_LIMIT_BACKOFF_BASE = 1.0
+RATE_LIMIT_BACKOFF_MAX = 60.0
+
+
+def get_personalized_query(query_text: str, trainee_name: str, relationship: str) -> str:
+    relationship = relationship or "친구/지인"
+    return f"{query_text.strip()}\n받는 사람: {trainee_name} 훈련병\n받는 사람과 나의 관계: {relationship}"
+
+
+def get_retry_after(exception: 'RateLimitError', attempt: int) -> float:
+    try:
+        return min(RATE_LIMIT_BACKOFF_MAX, float(exception.response.headers.get('retry-after')))
+    except (TypeError, ValueError):
+        return min(RATE_LIMIT_BACKOFF_MAX, RATE_LIMIT_BACKOFF_BASE * 2 ** attempt)
+
+
+class DraftRateLimiter:
+    """
+    batch 하나가 공유하는 limiter
+    token bucket으로 초당 요청 수를 맞추고, rate limit 응답을 받으면 pause()로 모든 요청을 잠시 멈춘다.
+    """
+    def __init__(self, rate: float, burst: int, clock=time.monotonic):
+        self.bucket = TokenBucket(rate, burst, clock=clock)
+        self.clock = clock
+        self.resume_at = 0.0
+
+    def pause(self, seconds: float) -> None:
+        self.resume_at = max(self.resume_at, self.clock() + seconds)
+
+    async def acquire(self) -> None:
+        while self.resume_at > self.clock():
+            await asyncio.sleep(self.resume_at - self.clock())
+        await self.bucket.acquire_async()
+
+
+async def create_draft(client: 'AsyncOpenAI', limiter: DraftRateLimiter, role: str, query_text: str,
+                       max_retries: int) -> str:
+    from openai import RateLimitError
+
+    for attempt in range(max_retries + 1):
+        await limiter.acquire()
+        try:
+            completion = await client.chat.completions.create(
+                model=settings.GPT_MODEL,
+                messages=get_messages(role, query_text),
+            )
+            return completion.choices[0].message.content
+        except RateLimitError as e:
+            if attempt == max_retries:
+                raise
+            limiter.pause(get_retry_after(e, attempt))
+
+
+async def create_drafts(role: str, queries: List[str], concurrency: int = None, rate: float = None,
+                        burst: int = None, max_retries: int = None) -> List[Union[str, Exception]]:
+    """
+    여러 초안을 동시에 생성한다.
+    결과는 입력 순서대로 초안 또는 발생한 예외(openai.OpenAIError 등)이다.
+    """
+    concurrency = concurrency or settings.GPT_BATCH_DRAFT_CONCURRENCY
+    limiter = DraftRateLimiter(rate or settings.GPT_BATCH_DRAFT_RATE, burst or settings.GPT_BATCH_DRAFT_BURST)
+    max_retries = settings.GPT_RATE_LIMIT_RETRIES if max_retries is None else max_retries
+    semaphore = asyncio.Semaphore(concurrency)
+
+    from openai import AsyncOpenAI
+    async with AsyncOpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL,
+                           timeout=settings.GPT_TIMEOUT, max_retries=0) as client:
+        async def run(query_text):
+            async with semaphore:
+                return await create_draft(client, limiter, role, query_text, max_retries)
+
+        # 한 건의 실패가 나머지 초안 생성을 중단시키지 않도록 예외도 결과로 반환한다.
+        return await asyncio.gather(*(run(query_text) for query_text in queries), return_exceptions=True)
@@ -0,0 +1,91 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django import db
+from django.core.management.base import BaseCommand, CommandError
+from api.services import *
+
+
+class Command(BaseCommand):
+    help = '편지 전송 작업 큐(DeliveryJob)를 처리합니다.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='한 프로세스에서 작업을 처리할 thread 수')
+        parser.add_argument('--batch-size', type=int, default=10,
+                            help='worker가 한 번에 가져올 작업 수')
+        parser.add_argument('--poll-interval', type=float, default=5.0,
+                            help='가져올 작업이 없을 때 기다리는 시간(초)')
+        parser.add_argument('--group-by', choices=['trainee', 'agency'], default='trainee',
+                            help='한 번에 가져온 작업을 upstream 세션 하나로 묶어 보낼 단위')
+        parser.add_argument('--requeue-interval', type=float, default=60.0,
+                            help='worker가 죽어서 RUNNING으로 남은 작업을 다시 큐에 넣는 주기(초)')
+        parser.add_argument('--once', action='store_true',
+                            help='지금 처리할 수 있는 작업이 없으면 종료')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        batch_size = options['batch_size']
+        if workers < 1 or batch_size < 1:
+            raise CommandError('--workers, --batch-size는 1 이상이어야 합니다.')
+
+        # 다른 worker 프로세스가 죽으면서 남긴 작업도 가져갈 수 있도록 실행 중에도 주기적으로 정리한다.
+        self.requeue_interval = options['requeue_interval']
+        self.requeue_lock = threading.Lock()
+        self.next_requeue_at = 0.0
+
+        self.stop_event = threading.Event()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self.work, batch_size, options['poll_interval'], options['once'],
+                                       options['group_by'])
+                       for _ in range(workers)]
+            try:
+                results = [future.result() for future in futures]
+            except KeyboardInterrupt:
+                self.stop_event.set()
+                results = [future.result() for future in futures]
+
+        succeeded = sum(result[0] for result in results)
+        failed = sum(result[1] for result in results)
+        self.stdout.write(self.style.SUCCESS(f'processed jobs - succeeded: {succeeded}, failed: {failed}'))
+
+    def work(self, batch_size: int, poll_interval: float, once: bool, group_by: str) -> tuple:
+        worker_id = deliveryQueue.get_worker_id()
+        succeeded = failed = 0
+        try:
+            while not self.stop_event.is_set():
+                self.requeue_stale()
+                jobs = deliveryQueue.claim(batch_size, worker_id)
+                if not jobs:
+                    if once:
+                        break
+                    self.stop_event.wait(poll_interval)
+                    continue
+
+                # 한 번에 가져온 작업은 묶어서 전송한다. (같은 훈련병에게 가는 편지는 세션 하나로)
+                for job, success in zip(jobs, deliveryQueue.process_batch(jobs, group_by)):
+                    if success:
+                        succeeded += 1
+                        self.stdout.write(f'인편 전송 완료: {job.letter} (job={job.id})')
+                    else:
+                        failed += 1
+                        self.stderr.write(f'인편 전송 실패: {job.letter} (job={job.id}, '
+                                          f'attempts={job.attempts}) - {job.last_error}')
+        finally:
+            # thread마다 열린 DB 연결을 닫는다.
+            db.connection.close()
+        return succeeded, failed
+
+    def requeue_stale(self) -> None:
+        """
+        requeue_interval마다 한 thread만 requeue_stale을 실행한다.
+        """
+        with self.requeue_lock:
+            now = time.monotonic()
+            if now < self.next_requeue_at:
+                return
+            self.next_requeue_at = now + self.requeue_interval
+        requeued = deliveryQueue.requeue_stale()
+        if requeued:
+            self.stdout.write(self.style.WARNING(f'requeued stale jobs - counts: {requeued}'))
@@ -0,0 +1,127 @@
+import os
+import subprocess
+import sys
+from dataclasses import dataclass
+from typing import Dict, List
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# 시작 시 import 시간 측정
+# 이미 import된 module의 영향을 받지 않도록 대상마다 새 python 프로세스를 `-X importtime`으로 실행한다.
+
+TARGETS = {
+    # django.setup()까지 (모든 manage.py 명령이 공통으로 거치는 단계)
+    'setup': "import django; django.setup()",
+    'wsgi': "import rokafLetter.wsgi",
+    'asgi': "import rokafLetter.asgi",
+    # URLconf(views)까지 (manage.py check, 첫 요청)
+    'urls': "import django; django.setup(); from django.urls import get_resolver; get_resolver().url_patterns",
+}
+
+# 시작할 때 불러오지 않고 처음 사용할 때 불러와야 하는 module
+DEFERRED_MODULES = ['openai', 'httpx', 'bs4', 'lxml', 'selectolax', 'rokaf_crawler.crawlers',
+                    'rokaf_crawler.async_crawlers']
+
+
+@dataclass
+class ImportRecord:
+    name: str
+    # 초 단위
+    self_time: float
+    cumulative_time: float
+    depth: int
+
+
+def get_command_code(command_name: str) -> str:
+    return ("import django; django.setup(); "
+            "from django.core.management import get_commands, load_command_class; "
+            f"load_command_class(get_commands()[{command_name!r}], {command_name!r})")
+
+
+def get_target_code(target: str) -> str:
+    if target.startswith('command:'):
+        return get_command_code(target[len('command:'):])
+    if target not in TARGETS:
+        raise ValueError(f"알 수 없는 대상입니다: {target} (사용 가능: {', '.join(TARGETS)}, command:<name>)")
+    return TARGETS[target]
+
+
+def parse_importtime(output: str) -> List[ImportRecord]:
+    """
+    "import time: self [us] | cumulative | imported package" 형식의 출력을 읽는다.
+    """
+    records = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_time, cumulative_time, name = line[len('import time:'):].split('|')
+        if not self_time.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        records.append(ImportRecord(name.strip(), int(self_time) / 1e6, int(cumulative_time) / 1e6, depth))
+    return records
+
+
+def profile_imports(*targets: str) -> List[ImportRecord]:
+    """
+    대상을 여러 개 넘기면 한 프로세스에서 차례로 불러온다.
+    뒤의 대상은 앞에서 불러온 module을 다시 측정하지 않으므로, 대상별 시간이 아니라 불러온 module 전체를 확인할 때 쓴다.
+    """
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'rokafLetter.settings')
+    code = "\n".join(get_target_code(target) for target in targets)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{', '.join(targets)} import에 실패했습니다.\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def get_total_time(records: List[ImportRecord]) -> float:
+    return sum(record.self_time for record in records)
+
+
+def get_deferred_imports(records: List[ImportRecord]) -> List[str]:
+    names = {record.name for record in records}
+    return [module for module in DEFERRED_MODULES if module in names]
+
+
+class Command(BaseCommand):
+    help = 'web/management 프로세스 시작 시 import 시간을 측정합니다.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='*',
+                            help=f"측정 대상 ({', '.join(TARGETS)}, command:<name>), 생략하면 "
+                                 f"{', '.join(TARGETS)}, command:regulardelivery")
+        parser.add_argument('--top', type=int, default=15,
+                            help='import 시간이 긴 순서로 보여 줄 module 수')
+        parser.add_argument('--budget', type=float, default=None,
+                            help='대상별 import 시간 예산(초), 기본값은 STARTUP_IMPORT_BUDGET')
+
+    def handle(self, *args, **options):
+        targets = options['targets'] or [*TARGETS, 'command:regulardelivery']
+        budget = options['budget'] if options['budget'] is not None else settings.STARTUP_IMPORT_BUDGET
+
+        over_budget: Dict[str, float] = {}
+        for target in targets:
+            try:
+                records = profile_imports(target)
+            except (ValueError, RuntimeError) as e:
+                raise CommandError(str(e))
+
+            total = get_total_time(records)
+            deferred = get_deferred_imports(records)
+            style = self.style.SUCCESS if total <= budget and not deferred else self.style.WARNING
+            self.stdout.write(style(f'{target} - modules: {len(records)}, import time: {total:.3f}s '
+                                    f'(budget: {budget:.3f}s)'))
+            # 다른 module을 제외한 module 자체의 import 시간이 긴 순서
+            for record in sorted(records, key=lambda record: record.self_time, reverse=True)[:options['top']]:
+                self.stdout.write(f'  {record.self_time * 1000:8.1f}ms  {record.name}')
+            if deferred:
+                self.stdout.write(self.style.WARNING(f"  시작 시 불러온 지연 대상 module: {', '.join(deferred)}"))
+            if total > budget or deferred:
+                over_budget[target] = total
+
+        if over_budget:
+            raise CommandError(f"시작 시간 예산을 넘었습니다: {', '.join(over_budget)}")
@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from typing import List
+
+from django import db
+from django.core.management.base import BaseCommand, CommandError
+from api.models import Letter, LetterStatus
+from api.services import *
+from rokaf_crawler.exceptions import CrawlerException
+
+
+class Command(BaseCommand):
+    help = '인편 사이트 편지 목록과 비교해 전송 중(SENDING)인 편지를 수신 완료(RECEIVED)로 바꿉니다.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='동시에 확인할 훈련병 수')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers는 1 이상이어야 합니다.')
+
+        sending_letters = Letter.objects.filter(status=LetterStatus.SENDING.value) \
+            .exclude(receiver__member_seq='').select_related('receiver').order_by('receiver_id', 'id')
+        # 훈련병마다 목록 페이지는 한 번만 읽는다.
+        groups = [list(letters) for _, letters in groupby(sending_letters, key=lambda letter: letter.receiver_id)]
+        self.stdout.write(self.style.SUCCESS(f'loaded all sending letters - trainees: {len(groups)}'))
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            results = list(executor.map(self.reconcile, groups))
+
+        received = sum(count for count in results if count is not None)
+        failed = sum(1 for count in results if count is None)
+        self.stdout.write(self.style.SUCCESS(f'received: {received}, failed trainees: {failed}'))
+
+    def reconcile(self, letters: List[Letter]):
+        trainee = letters[0].receiver
+        try:
+            received = letterService.reconcile_trainee(trainee, letters)
+            return len(received)
+        except CrawlerException as e:
+            self.stderr.write(f'편지 목록 확인 실패: {trainee} (id={trainee.id}) - {e}')
+        except Exception as e:
+            self.stderr.write(f'편지 목록 확인 실패: {trainee} (id={trainee.id}) - {e!r}')
+        finally:
+            db.connection.close()
+        return None
@@ -1,14 +1,132 @@
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator, List
+
+from django import db
 from django.core.management.base import BaseCommand, CommandError
-from api.models import Letter, LetterStatus
+from api.models import Letter
 from api.services import *
+from rokaf_crawler.exceptions import CrawlerException
+from rokaf_crawler.instrumentation import HistogramSink
 
 class Command(BaseCommand):
+    help = '예약된 편지를 전송합니다.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', '--concurrency', dest='workers', type=int, default=1,
+                            help='동시에 전송할 편지 수')
+        parser.add_argument('--agency-concurrency', type=int, default=4,
+                            help='교육기관별로 동시에 전송할 최대 편지 수')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='DB에서 한 번에 읽어 올 편지 수')
+        parser.add_argument('--enqueue', action='store_true',
+                            help='직접 전송하지 않고 전송 작업 큐에 넣습니다. (deliveryworker 참고)')
 
     def handle(self, *args, **options):
-        reserved_letters = Letter.objects.filter(status=LetterStatus.RESERVED.value)
-        self.stdout.write(
-            self.style.SUCCESS(f'loaded all reserved letters - counts: {reserved_letters.count()}')
-        )
-        for letter in reserved_letters:
-            print(f'인편 제목: {letter}\n전송을 시작합니다.')
+        workers = options['workers']
+        agency_concurrency = options['agency_concurrency']
+        chunk_size = options['chunk_size']
+        if workers < 1 or agency_concurrency < 1 or chunk_size < 1:
+            raise CommandError('--workers, --agency-concurrency, --chunk-size는 1 이상이어야 합니다.')
+
+        # 예약 날짜가 된 편지만 chunk_size개씩 읽어 온다. (backlog가 많아도 메모리를 일정하게 유지)
+        chunks = letterService.iter_due_letters(chunk_size)
+
+        if options['enqueue']:
+            enqueued = sum(deliveryQueue.enqueue_many(chunk) for chunk in chunks)
+            self.stdout.write(self.style.SUCCESS(f'enqueued delivery jobs - counts: {enqueued}'))
+            return
+
+        started_at = time.perf_counter()
+        results = self.send_letters(chunks, workers, agency_concurrency, chunk_size)
+        elapsed = time.perf_counter() - started_at
+
+        self.write_summary(results, elapsed)
+
+    def send_letters(self, chunks: Iterator[List[Letter]], workers: int, agency_concurrency: int,
+                     chunk_size: int) -> list:
+        """
+        교육기관별 대기열에 편지를 나눠 두고, 동시 전송 수가 agency_concurrency보다 적은 교육기관의 편지만 pool에 넣는다.
+        worker thread가 다른 교육기관 차례를 기다리며 묶이지 않으므로, 편지가 몰린 교육기관이 나머지 교육기관의 전송을 막지 않는다.
+        대기 중인 편지가 chunk_size보다 적어지면 다음 chunk를 읽는다.
+        """
+        queues = defaultdict(deque)
+        running = Counter()
+        futures = {}
+        results = []
+        queued = 0
+        exhausted = False
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                while not exhausted and queued < chunk_size:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        exhausted = True
+                        break
+                    for letter in chunk:
+                        queues[letter.receiver.agency_id].append(letter)
+                    queued += len(chunk)
+
+                # 교육기관을 돌아가며 한 통씩 넣는다.
+                submitted = True
+                while submitted and len(futures) < workers:
+                    submitted = False
+                    for agency_id, queue in list(queues.items()):
+                        if len(futures) >= workers:
+                            break
+                        if running[agency_id] >= agency_concurrency:
+                            continue
+                        futures[executor.submit(self.send_letter, queue.popleft())] = agency_id
+                        running[agency_id] += 1
+                        queued -= 1
+                        submitted = True
+                        if not queue:
+                            del queues[agency_id]
+
+                # 전송 중인 편지가 없으면 대기열도 비어 있다.
+                if not futures:
+                    break
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running[futures.pop(future)] -= 1
+                    results.append(future.result())
+        return results
+
+    def send_letter(self, letter: Letter) -> tuple:
+        """
+        편지 한 통을 전송하고 (소요 시간, 실패 사유)를 반환한다.
+        한 편지의 실패가 나머지 편지 전송을 중단시키지 않도록 예외는 결과로 기록한다.
+        """
+        started_at = time.perf_counter()
+        error = None
+        try:
             letterService.send_letter(letter)
+            self.stdout.write(f'인편 전송 완료: {letter} (id={letter.id})')
+        except CrawlerException as e:
+            error = type(e).__name__
+            self.stderr.write(f'인편 전송 실패: {letter} (id={letter.id}) - {e}')
+        except Exception as e:
+            error = type(e).__name__
+            self.stderr.write(f'인편 전송 실패: {letter} (id={letter.id}) - {e!r}')
+        finally:
+            db.close_old_connections()
+        return time.perf_counter() - started_at, error
+
+    def write_summary(self, results: list, elapsed: float) -> None:
+        failures = Counter(error for _, error in results if error is not None)
+        sent = len(results) - sum(failures.values())
+        throughput = len(results) / elapsed if elapsed > 0 else 0.0
+
+        self.stdout.write(self.style.SUCCESS(
+            f'sent: {sent}, failed: {sum(failures.values())}, '
+            f'elapsed: {elapsed:.2f}s, throughput: {throughput:.2f} letters/s'
+        ))
+        if results:
+            latencies = sorted(latency for latency, _ in results)
+            self.stdout.write(
+                f'latency - p50: {HistogramSink.percentile(latencies, 50):.2f}s, '
+                f'p95: {HistogramSink.percentile(latencies, 95):.2f}s, max: {latencies[-1]:.2f}s'
+            )
+        for error, count in failures.most_common():
+            self.stdout.write(self.style.WARNING(f'failure - {error}: {count}'))
@@ -0,0 +1,87 @@
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from django import db
+from django.core.management.base import BaseCommand, CommandError
+from api.models import DeliveryJob, Letter, LetterStatus
+from api.scheduler import ReservationScheduler
+from api.services import *
+
+
+class Command(BaseCommand):
+    help = '예약된 편지를 예약 날짜가 되는 즉시 전송하는 상주 scheduler를 실행합니다.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='동시에 전송할 편지 수')
+        parser.add_argument('--refresh-interval', type=float, default=5.0,
+                            help='새로 예약되거나 수정된 편지를 다시 읽어 오는 주기(초)')
+        parser.add_argument('--retry-delay', type=float, default=60.0,
+                            help='전송에 실패한 편지를 다시 보내기까지 기다리는 시간(초)')
+        parser.add_argument('--enqueue', action='store_true',
+                            help='전송 작업 큐에 넣기만 하고 전송은 deliveryworker에 맡깁니다.')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['refresh_interval'] <= 0:
+            raise CommandError('--workers는 1 이상, --refresh-interval은 0보다 커야 합니다.')
+
+        self.enqueue = options['enqueue']
+        self.executor = ThreadPoolExecutor(max_workers=options['workers'])
+        self.scheduler = ReservationScheduler(self.dispatch, refresh_interval=options['refresh_interval'],
+                                              retry_delay=options['retry_delay'])
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: self.scheduler.stop())
+
+        self.scheduler.refresh()
+        self.stdout.write(self.style.SUCCESS(f'loaded all reserved letters - counts: {len(self.scheduler)}'))
+        try:
+            self.scheduler.run()
+        finally:
+            self.executor.shutdown(wait=True)
+        self.stdout.write(self.style.SUCCESS('scheduler stopped'))
+
+    def dispatch(self, letter_ids: List[int]) -> None:
+        # 예약 시각 이후에 수정/전송된 편지는 건너뛴다.
+        letters = list(Letter.objects.filter(id__in=letter_ids, status=LetterStatus.RESERVED.value)
+                       .select_related('receiver'))
+        skipped = set(letter_ids) - {letter.id for letter in letters}
+        for letter_id in skipped:
+            self.scheduler.complete(letter_id, True)
+
+        # 전송 작업을 만들어 두고(이미 있으면 그대로 둔다) 가져온(claim) 작업만 보낸다.
+        # deliveryworker나 LetterSendView가 같은 편지를 처리 중이면 claim에 실패하므로 두 번 보내지 않는다.
+        enqueued = deliveryQueue.enqueue_many(letters)
+        if self.enqueue:
+            for letter in letters:
+                self.scheduler.complete(letter.id, True)
+            self.stdout.write(f'enqueued delivery jobs - counts: {enqueued}')
+            return
+
+        letters_by_id = {letter.id: letter for letter in letters}
+        for job in DeliveryJob.objects.filter(letter__in=letters):
+            job.letter = letters_by_id[job.letter_id]
+            self.executor.submit(self.process_job, job)
+
+    def process_job(self, job: DeliveryJob) -> None:
+        letter = job.letter
+        success = True
+        try:
+            if not deliveryQueue.claim_job(job):
+                # 다른 worker가 처리 중이거나 이미 끝난(DONE/DEAD) 작업
+                self.stdout.write(f'인편 전송 건너뜀: {letter} (id={letter.id}) - 이미 처리 중이거나 끝난 작업')
+                return
+            success = deliveryQueue.process(job)
+            if success:
+                self.stdout.write(f'인편 전송 완료: {letter} (id={letter.id})')
+            else:
+                # 실패 사유와 재시도 시각은 작업에 남는다. (영구 실패나 재시도 초과면 DEAD)
+                self.stderr.write(f'인편 전송 실패: {letter} (id={letter.id}) - {job.last_error}')
+        except Exception as e:
+            success = False
+            self.stderr.write(f'인편 전송 실패: {letter} (id={letter.id}) - {e!r}')
+        finally:
+            self.scheduler.complete(letter.id, success)
+            db.close_old_connections()
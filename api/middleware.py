@@ -0,0 +1,122 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+re_accepts_brotli = _lazy_re_compile(r"\bbr\b")
+
+
+def compress_sequence_brotli(sequence, quality: int):
+    compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=quality)
+    for item in sequence:
+        data = compressor.process(item)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+async def acompress_sequence_brotli(sequence, quality: int):
+    """
+    compress_sequence_brotli의 async 버전 (ASGI에서 async iterator로 흘려보내는 응답)
+    """
+    compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=quality)
+    async for item in sequence:
+        data = compressor.process(item)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Accept-Encoding에 따라 brotli 또는 gzip으로 응답을 압축한다. (streaming 응답 포함)
+    brotli를 지원하지 않는 client는 GZipMiddleware와 똑같이 동작한다.
+
+    BREACH: 압축된 응답 크기로 본문의 secret(CSRF token 등)을 알아내려면 공격자가 피해자의 브라우저로
+    인증된 요청을 보내게 해야 한다. API는 Authorization header의 token으로 인증하므로 브라우저가 자동으로
+    붙여 주지 않지만, session/CSRF cookie가 있는 요청(admin, browsable API)은 그렇지 않다.
+    이런 요청은 brotli 대신 GZipMiddleware(Heal-The-BREACH, max_random_bytes)로 압축한다.
+    """
+    # 이보다 짧은 응답은 압축하지 않는다. (GZipMiddleware와 같은 기준)
+    min_length = 200
+    # 긴 한글 JSON에서 brotli가 gzip보다 작지만, 압축에 드는 시간을 줄이기 위해 quality를 낮춘다.
+    brotli_quality = 5
+
+    def process_response(self, request, response):
+        # server-sent events는 압축하면 버퍼링되어 token이 바로 전달되지 않는다.
+        if response.get("Content-Type", "").startswith("text/event-stream"):
+            return response
+
+        ae = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        if brotli is None or not re_accepts_brotli.search(ae) or self.has_auth_cookie(request):
+            return super().process_response(request, response)
+
+        if not response.streaming and len(response.content) < self.min_length:
+            return response
+        if response.has_header("Content-Encoding"):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = acompress_sequence_brotli(response.streaming_content,
+                                                                       self.brotli_quality)
+            else:
+                response.streaming_content = compress_sequence_brotli(response.streaming_content,
+                                                                      self.brotli_quality)
+            del response.headers["Content-Length"]
+        else:
+            compressed_content = brotli.compress(response.content, mode=brotli.MODE_TEXT,
+                                                 quality=self.brotli_quality)
+            if len(compressed_content) >= len(response.content):
+                return response
+            response.content = compressed_content
+            response.headers["Content-Length"] = str(len(response.content))
+
+        # 압축된 응답은 원본과 byte 단위로 같지 않으므로 weak ETag로 바꾼다.
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = "br"
+        return response
+
+    @staticmethod
+    def has_auth_cookie(request) -> bool:
+        return settings.SESSION_COOKIE_NAME in request.COOKIES or settings.CSRF_COOKIE_NAME in request.COOKIES
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    ASGI에서도 사용할 수 있는 WhiteNoiseMiddleware
+    WhiteNoiseMiddleware는 sync 전용이라 ASGI에서는 그 뒤의 middleware와 async view가 모두 thread에서 실행되고,
+    upstream을 기다리는 요청 수만큼 thread가 묶인다. 정적 파일 조회는 event loop에서 하고 파일 응답만 thread에서 만든다.
+    """
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:13
+
+import api.models
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_alter_user_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', api.models.IntEnumField(default=0, enum=api.models.DeliveryJobStatus)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=5)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_by', models.CharField(blank=True, max_length=200)),
+                ('locked_at', models.DateTimeField(null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('letter', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='delivery_job', to='api.letter')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'available_at'], name='delivery_job_claim_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_deliveryjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='letter',
+            index=models.Index(fields=['status', 'sent_date'], name='letter_status_sent_date_idx'),
+        ),
+    ]
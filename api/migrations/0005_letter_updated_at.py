@@ -0,0 +1,22 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_letter_status_sent_date_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='letter',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='letter',
+            index=models.Index(fields=['updated_at'], name='letter_updated_at_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_letter_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LetterListWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_number', models.PositiveIntegerField(default=0)),
+                ('checked_at', models.DateTimeField(auto_now=True)),
+                ('trainee', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='letter_list_watermark', to='api.trainee')),
+            ],
+        ),
+    ]
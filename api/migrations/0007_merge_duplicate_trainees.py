@@ -0,0 +1,65 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:26
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicates(apps, schema_editor):
+    """
+    unique constraint를 추가하기 전에 중복 행을 합친다. (0008_hot_query_indexes)
+    같은 훈련병이 여러 행으로 저장되어 있으면 가장 먼저 만든 행만 남기고 참조를 옮긴다.
+    """
+    Trainee = apps.get_model('api', 'Trainee')
+    TraineeToUser = apps.get_model('api', 'TraineeToUser')
+    Letter = apps.get_model('api', 'Letter')
+    User = apps.get_model('api', 'User')
+    LetterListWatermark = apps.get_model('api', 'LetterListWatermark')
+
+    identity = ['name', 'birthday', 'member_seq', 'agency_id']
+    duplicates = Trainee.objects.values(*identity).annotate(keep_id=Min('id'), count=Count('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        keep_id = duplicate['keep_id']
+        other_ids = list(Trainee.objects.filter(**{field: duplicate[field] for field in identity})
+                         .exclude(id=keep_id).values_list('id', flat=True))
+        Letter.objects.filter(receiver_id__in=other_ids).update(receiver_id=keep_id)
+        merge_trainee_users(User, keep_id, other_ids)
+        LetterListWatermark.objects.filter(trainee_id__in=other_ids).delete()
+        for relation in TraineeToUser.objects.filter(trainee_id__in=other_ids):
+            if TraineeToUser.objects.filter(user_id=relation.user_id, trainee_id=keep_id).exists():
+                relation.delete()
+            else:
+                relation.trainee_id = keep_id
+                relation.save()
+        Trainee.objects.filter(id__in=other_ids).delete()
+
+    duplicates = TraineeToUser.objects.values('user_id', 'trainee_id') \
+        .annotate(keep_id=Min('id'), count=Count('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        TraineeToUser.objects.filter(user_id=duplicate['user_id'], trainee_id=duplicate['trainee_id']) \
+            .exclude(id=duplicate['keep_id']).delete()
+
+
+def merge_trainee_users(User, keep_id, other_ids):
+    """
+    User.as_trainee는 OneToOne이므로 합친 훈련병에는 훈련병 계정 하나만 남긴다.
+    이미 남길 훈련병에 연결된 계정이 있으면 그 계정을, 없으면 id가 가장 작은 계정을 남기고
+    나머지 계정은 훈련병 연결을 끊는다.
+    """
+    users = User.objects.filter(as_trainee_id__in=[keep_id, *other_ids])
+    user_ids = list(users.order_by('id').values_list('id', flat=True))
+    if not user_ids:
+        return
+    keep_user_id = users.filter(as_trainee_id=keep_id).values_list('id', flat=True).first() or user_ids[0]
+    users.exclude(id=keep_user_id).update(as_trainee_id=None, is_trainee=False)
+    User.objects.filter(id=keep_user_id).update(as_trainee_id=keep_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_letterlistwatermark'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_merge_duplicate_trainees'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='letter',
+            index=models.Index(fields=['sender', 'receiver'], name='letter_sender_receiver_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='letter',
+            index=models.Index(fields=['receiver', 'status'], name='letter_receiver_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='trainee',
+            constraint=models.UniqueConstraint(fields=('name', 'birthday', 'member_seq', 'agency_id'), name='unique_trainee_identity'),
+        ),
+        migrations.AddConstraint(
+            model_name='traineetouser',
+            constraint=models.UniqueConstraint(fields=('user', 'trainee'), name='unique_trainee_to_user'),
+        ),
+    ]
@@ -5,6 +5,7 @@ from enum import Enum
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.hashers import make_password
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 from rokaf_crawler.models import AgencyIndex
 
@@ -54,6 +55,13 @@ class Trainee(models.Model):
     member_seq = models.CharField(max_length=100)
     agency_id = IntEnumField(AgencyIndex, default=AgencyIndex.기본군사훈련단.value)
 
+    class Meta:
+        constraints = [
+            # TraineeSerializer.create의 get_or_create 조회 조건과 같다.
+            models.UniqueConstraint(fields=['name', 'birthday', 'member_seq', 'agency_id'],
+                                    name='unique_trainee_identity'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -128,6 +136,19 @@ class Letter(models.Model):
 
     sent_date = models.DateField(null=True)
     status = IntEnumField(enum=LetterStatus, default=LetterStatus.EDITING.value)
+    # 예약 scheduler가 바뀐 편지만 다시 읽어 오는 데 사용한다. (api.scheduler 참고)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # 예약 전송 대상 조회 (status=RESERVED, sent_date <= 오늘)
+            models.Index(fields=['status', 'sent_date'], name='letter_status_sent_date_idx'),
+            models.Index(fields=['updated_at'], name='letter_updated_at_idx'),
+            # letters/sent?receiver_id=
+            models.Index(fields=['sender', 'receiver'], name='letter_sender_receiver_idx'),
+            # 훈련병이 받은 편지, 상태별 조회
+            models.Index(fields=['receiver', 'status'], name='letter_receiver_status_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -138,5 +159,58 @@ class TraineeToUser(models.Model):
     trainee = models.ForeignKey(Trainee, on_delete=models.CASCADE)
     relationship = models.CharField(max_length=100, blank=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'trainee'], name='unique_trainee_to_user'),
+        ]
+
     def __str__(self):
         return self.trainee.name + " TO " + self.user.email
+
+
+class LetterListWatermark(models.Model):
+    """
+    훈련병 편지 목록 페이지에서 마지막으로 확인한 편지 번호 (api.services.LetterService.reconcile_trainee 참고)
+    """
+    trainee = models.OneToOneField(Trainee, on_delete=models.CASCADE, related_name='letter_list_watermark')
+    last_number = models.PositiveIntegerField(default=0)
+    checked_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.trainee} ({self.last_number})"
+
+
+class DeliveryJobStatus(Enum):
+    PENDING = 0
+    RUNNING = 1
+    DONE = 2
+    DEAD = 3
+
+
+class DeliveryJob(models.Model):
+    """
+    편지 전송 작업 (api.services.DeliveryQueue 참고)
+    여러 worker 프로세스가 SELECT ... FOR UPDATE SKIP LOCKED로 작업을 나눠 가져가고,
+    실패한 작업은 exponential backoff로 재시도하다가 max_attempts를 넘으면 DEAD 상태가 된다.
+    """
+    letter = models.OneToOneField(Letter, on_delete=models.CASCADE, related_name='delivery_job')
+    status = IntEnumField(enum=DeliveryJobStatus, default=DeliveryJobStatus.PENDING.value)
+
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    available_at = models.DateTimeField(default=timezone.now)
+
+    locked_by = models.CharField(max_length=200, blank=True)
+    locked_at = models.DateTimeField(null=True)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='delivery_job_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.letter} ({DeliveryJobStatus(self.status).name})"
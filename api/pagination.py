@@ -0,0 +1,13 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class LetterCursorPagination(CursorPagination):
+    """
+    편지 목록 cursor pagination (최신 편지부터)
+    offset 대신 마지막으로 본 id 이후만 읽으므로 편지가 많아도 페이지마다 걸리는 시간이 일정하다.
+    """
+    ordering = '-id'
+    page_size = settings.LETTER_LIST_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.LETTER_LIST_MAX_PAGE_SIZE
@@ -0,0 +1,18 @@
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+from api.renderers import loads
+
+
+class FastJSONParser(JSONParser):
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            content = stream.read() if stream is not None else b''
+            if encoding.lower().replace('-', '') != 'utf8':
+                content = content.decode(encoding)
+            return loads(content)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,84 @@
+import json
+from itertools import islice
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# 편지 본문은 긴 한글이므로 인코딩 속도와 크기를 줄이기 위해 orjson을 사용한다.
+# orjson이 없으면 표준 json으로 같은 결과(UTF-8, \u escape 없음)를 만든다.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = JSONEncoder()
+
+
+def dumps(data) -> bytes:
+    if orjson is not None:
+        # Decimal, lazy string 등 orjson이 모르는 타입은 DRF encoder로 변환한다.
+        return orjson.dumps(data, default=_encoder.default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def loads(content):
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # browsable API 등에서 indent를 요청하면 기본 renderer를 사용한다.
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
+
+
+def encode_json_list_chunk(chunk: list, serializer_class, context: dict = None) -> bytes:
+    # "[...]"에서 괄호를 뗀 부분
+    return dumps(serializer_class(chunk, many=True, context=context).data)[1:-1]
+
+
+def stream_json_list(items: Iterable, serializer_class, context: dict = None,
+                     chunk_size: int = 500) -> Iterator[bytes]:
+    """
+    목록 전체를 메모리에 올리지 않고 chunk_size개씩 직렬화해 JSON 배열로 흘려보낸다.
+        StreamingHttpResponse(stream_json_list(queryset.iterator(), LetterListSerializer), ...)
+    """
+    items = iter(items)
+    yield b'['
+    first = True
+    for chunk in iter(lambda: list(islice(items, chunk_size)), []):
+        if not first:
+            yield b','
+        yield encode_json_list_chunk(chunk, serializer_class, context)
+        first = False
+    yield b']'
+
+
+async def astream_json_list(items: AsyncIterable, serializer_class, context: dict = None,
+                            chunk_size: int = 500) -> AsyncIterator[bytes]:
+    """
+    stream_json_list의 async 버전 (ASGI)
+    ASGI는 sync iterator를 전부 읽은 뒤에 보내므로 async iterator를 넘겨야 chunk마다 바로 전송된다.
+        StreamingHttpResponse(astream_json_list(queryset.aiterator(), LetterListSerializer), ...)
+    serializer는 DB를 조회하지 않아야 한다. (pk만 쓰는 related field 등)
+    """
+    yield b'['
+    first = True
+    chunk = []
+    async for item in items:
+        chunk.append(item)
+        if len(chunk) < chunk_size:
+            continue
+        yield (b'' if first else b',') + encode_json_list_chunk(chunk, serializer_class, context)
+        first = False
+        chunk = []
+    if chunk:
+        yield (b'' if first else b',') + encode_json_list_chunk(chunk, serializer_class, context)
+    yield b']'
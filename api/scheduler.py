@@ -0,0 +1,139 @@
+import heapq
+import threading
+import time
+from datetime import date, datetime, timedelta
+from datetime import time as dtime
+from typing import Callable, Dict, List, Optional, Set
+
+from django.utils import timezone
+
+from api.models import Letter, LetterStatus
+
+# 예약 편지 scheduler
+# 예약 날짜(sent_date)가 된 편지를 cron 주기를 기다리지 않고 바로 전송하기 위해, 상주 프로세스에서
+# 예약 편지를 (예약 시각, 편지 id) heap으로 들고 있다가 시각이 되면 dispatch한다.
+# 편지가 새로 예약되거나 수정되면 updated_at이 바뀌므로, 바뀐 편지만 주기적으로 다시 읽어 heap을 갱신한다.
+
+
+def get_due_timestamp(sent_date: date) -> float:
+    """
+    예약 날짜 0시 (regulardelivery와 같이 서버 local time 기준)
+    """
+    return datetime.combine(sent_date, dtime.min).timestamp()
+
+
+class ReservationScheduler:
+    """
+        scheduler = ReservationScheduler(dispatch)
+        scheduler.run()  # 다른 thread에서 scheduler.stop()을 호출할 때까지
+    dispatch(letter_ids)는 예약 시각이 된 편지 id 목록을 받아 전송을 시작한다.
+    전송이 끝나면 complete(letter_id, success)를 호출해야 하며, 실패한 편지는 retry_delay 뒤에 다시 dispatch된다.
+    """
+    def __init__(self, dispatch: Callable[[List[int]], None], refresh_interval: float = 5.0,
+                 retry_delay: float = 60.0, clock=time.time):
+        self.dispatch = dispatch
+        self.refresh_interval = refresh_interval
+        self.retry_delay = retry_delay
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        # (예약 시각, 편지 id, 예약 날짜)
+        self._heap = []
+        # 편지 id -> 예약 날짜. heap에 남아 있는 오래된 항목은 pop할 때 이 값과 비교해 버린다.
+        self._scheduled: Dict[int, date] = {}
+        # 전송 중인 편지
+        self._in_flight: Set[int] = set()
+        self._watermark: Optional[datetime] = None
+
+    def __len__(self):
+        return len(self._scheduled)
+
+    def schedule(self, letter_id: int, sent_date: date, due: Optional[float] = None) -> None:
+        with self._lock:
+            self._schedule(letter_id, sent_date, due)
+        self._wakeup.set()
+
+    def _schedule(self, letter_id: int, sent_date: date, due: Optional[float] = None) -> None:
+        if letter_id in self._in_flight or self._scheduled.get(letter_id) == sent_date and due is None:
+            return
+        self._scheduled[letter_id] = sent_date
+        heapq.heappush(self._heap, (get_due_timestamp(sent_date) if due is None else due, letter_id, sent_date))
+
+    def unschedule(self, letter_id: int) -> None:
+        with self._lock:
+            self._scheduled.pop(letter_id, None)
+
+    def refresh(self) -> int:
+        """
+        마지막 refresh 이후 바뀐 편지만 다시 읽어 heap을 갱신하고, 읽은 편지 수를 반환한다.
+        처음 호출하면 예약된 편지 전체를 읽는다.
+        """
+        with self._lock:
+            queryset = Letter.objects.all()
+            if self._watermark is None:
+                self._watermark = timezone.now()
+                queryset = queryset.filter(status=LetterStatus.RESERVED.value)
+            else:
+                # commit 순서와 updated_at 순서가 다를 수 있으므로 조금 겹쳐서 읽는다.
+                queryset = queryset.filter(updated_at__gt=self._watermark - timedelta(seconds=self.refresh_interval))
+            rows = list(queryset.values_list('id', 'status', 'sent_date', 'updated_at'))
+
+            for letter_id, status, sent_date, updated_at in rows:
+                if status == LetterStatus.RESERVED.value and sent_date is not None:
+                    self._schedule(letter_id, sent_date)
+                else:
+                    self._scheduled.pop(letter_id, None)
+                self._watermark = max(self._watermark, updated_at)
+        return len(rows)
+
+    def pop_due(self) -> List[int]:
+        now = self.clock()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, letter_id, sent_date = heapq.heappop(self._heap)
+                if self._scheduled.get(letter_id) != sent_date:
+                    continue
+                del self._scheduled[letter_id]
+                self._in_flight.add(letter_id)
+                due.append(letter_id)
+        return due
+
+    def complete(self, letter_id: int, success: bool) -> None:
+        with self._lock:
+            self._in_flight.discard(letter_id)
+            if not success:
+                # 예약 상태 그대로 남은 편지는 updated_at이 바뀌지 않으므로 직접 다시 넣는다.
+                sent_date = Letter.objects.filter(id=letter_id, status=LetterStatus.RESERVED.value) \
+                    .values_list('sent_date', flat=True).first()
+                if sent_date is not None:
+                    self._schedule(letter_id, sent_date, due=self.clock() + self.retry_delay)
+
+    def get_timeout(self) -> float:
+        """
+        다음 예약 시각과 다음 refresh 중 빠른 쪽까지 기다릴 시간
+        """
+        with self._lock:
+            if not self._heap:
+                return self.refresh_interval
+            return max(0.0, min(self.refresh_interval, self._heap[0][0] - self.clock()))
+
+    def run(self) -> None:
+        next_refresh = 0.0
+        while not self._stopped.is_set():
+            if self.clock() >= next_refresh:
+                self.refresh()
+                next_refresh = self.clock() + self.refresh_interval
+
+            due = self.pop_due()
+            if due:
+                self.dispatch(due)
+
+            self._wakeup.wait(min(self.get_timeout(), max(0.0, next_refresh - self.clock())))
+            self._wakeup.clear()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
@@ -1,4 +1,6 @@
 from datetime import date
+from django.conf import settings
+from django.db.models.functions import Substr
 from rest_framework import serializers
 from api.models import *
 import re
@@ -11,6 +13,14 @@ class GptPromptSerializer(serializers.Serializer):
         매일 고생하며 훈련받는 공군 훈련병들을 위한 편지를 적어줘!
         """)
 
+class GptBatchDraftSerializer(GptPromptSerializer):
+    # 비워 두면 내가 추가한 훈련병(like_trainees) 전체
+    receivers = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=100)
+    # true면 초안을 작성 중(EDITING) 편지로 바로 저장한다.
+    save = serializers.BooleanField(default=False)
+    title = serializers.CharField(max_length=100, required=False)
+    password = serializers.CharField(max_length=100, required=False)
+
 class TraineeSearchSerializer(serializers.ModelSerializer):
     class Meta:
         model = Trainee
@@ -22,6 +32,11 @@ class TraineeSearchSerializer(serializers.ModelSerializer):
         return ret
 
 
+class TraineeBatchSearchSerializer(serializers.Serializer):
+    # 각 항목은 TraineeSearchSerializer로 따로 검증해 항목별로 에러를 돌려준다.
+    trainees = serializers.ListField(child=serializers.DictField(), allow_empty=False, max_length=100)
+
+
 # TODO: trainee 추가 시 user와의 관계 설정도 가능하도록 serializer, view 변경
 class TraineeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -41,9 +56,62 @@ class LetterListSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'contents', 'sender', 'status']
 
 
+class LetterSummarySerializer(serializers.ModelSerializer):
+    """
+    편지 목록 요약 (?view=summary)
+    """
+    # 본문 전체 대신 DB에서 잘라 온 앞부분만 보낸다. (with_preview 참고)
+    preview = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = Letter
+        fields = ['id', 'title', 'preview', 'sender', 'receiver', 'status', 'sent_date']
+
+    @staticmethod
+    def with_preview(queryset):
+        return queryset.only('id', 'title', 'sender_id', 'receiver_id', 'status', 'sent_date') \
+            .annotate(preview=Substr('contents', 1, settings.LETTER_PREVIEW_LENGTH))
+
+
+class DeliveryJobSerializer(serializers.ModelSerializer):
+    status = serializers.SerializerMethodField()
+    letter_status = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DeliveryJob
+        fields = ['id', 'letter', 'status', 'letter_status', 'attempts', 'max_attempts', 'available_at',
+                  'last_error', 'updated_at']
+
+    def get_status(self, obj):
+        return DeliveryJobStatus(obj.status).name
+
+    def get_letter_status(self, obj):
+        return LetterStatus(obj.letter.status).name
+
+
 def removeEscapedBlanks(s: str):
     return re.sub(r"([\n\r\t\\])", " ", s).strip()
 
+
+def set_relationship(validated_data: dict, sender_relationship: str) -> None:
+    if validated_data.get('relationship') == "":
+        validated_data['relationship'] = sender_relationship if sender_relationship != "" else "친구/지인"
+
+
+def set_sender_fields(validated_data: dict, sender: User) -> None:
+    sender_default_values = {'zipcode': '52364',
+                      'addr1': '경상남도 진주시 금산면 송백로 46',
+                      'addr2': '사서함',
+                      'name': 'ㅇㅇ'}
+
+    for field in sender_default_values.keys():
+        curr_value = validated_data.get('sender' + field.title())
+        sender_value = getattr(sender, field)
+        default_value = sender_default_values.get(field)
+
+        if curr_value == "":
+            validated_data['sender' + field.title()] = sender_value if sender_value != "" else default_value
+
 class LetterDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = Letter
@@ -57,26 +125,13 @@ class LetterDetailSerializer(serializers.ModelSerializer):
 
         # set relationship field
         try:
-            curr_relationship = validated_data.get('relationship')
             sender_relationship = TraineeToUser.objects.get(user=sender.id, trainee=receiver.id).relationship
-            if curr_relationship == "":
-                validated_data['relationship'] = sender_relationship if sender_relationship != "" else "친구/지인"
+            set_relationship(validated_data, sender_relationship)
         except TraineeToUser.DoesNotExist:
             raise AssertionError('내가 추가한 훈련병에게만 편지를 보낼 수 있습니다.')
 
         # set fields about sender
-        sender_default_values = {'zipcode': '52364',
-                          'addr1': '경상남도 진주시 금산면 송백로 46',
-                          'addr2': '사서함',
-                          'name': 'ㅇㅇ'}
-
-        for field in sender_default_values.keys():
-            curr_value = validated_data.get('sender' + field.title())
-            sender_value = getattr(sender, field)
-            default_value = sender_default_values.get(field)
-
-            if curr_value == "":
-                validated_data['sender' + field.title()] = sender_value if sender_value != "" else default_value
+        set_sender_fields(validated_data, sender)
 
 
         status = validated_data.get('status')
@@ -117,3 +172,59 @@ class LetterDetailSerializer(serializers.ModelSerializer):
         validated_data['contents'] = removeEscapedBlanks(validated_data['contents'])
         instance = super().update(instance, validated_data)
         return instance
+
+
+class LetterBroadcastSerializer(serializers.ModelSerializer):
+    """
+    같은 편지를 여러 훈련병에게 보낼 때 사용한다.
+    관계 확인은 query 한 번으로 하고, 편지는 bulk_create로 한 번에 만든다.
+    send_now가 true면 만든 편지를 전송 작업 큐에 한 번에 넣는다.
+    """
+    # 훈련병 존재 여부도 TraineeToUser 조회 한 번으로 같이 확인한다.
+    receivers = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=100)
+    send_now = serializers.BooleanField(default=False, write_only=True)
+
+    class Meta:
+        model = Letter
+        fields = ['receivers', 'senderZipcode', 'senderAddr1', 'senderAddr2', 'senderName', 'relationship',
+                  'title', 'contents', 'password', 'sent_date', 'status', 'send_now']
+
+    def create(self, validated_data):
+        sender = self.context['request'].user
+        receivers = list(dict.fromkeys(validated_data.pop('receivers')))
+        send_now = validated_data.pop('send_now')
+
+        status = validated_data.get('status', LetterStatus.EDITING.value)
+        assert status in [LetterStatus.EDITING.value, LetterStatus.RESERVED.value], (
+            '여러 명에게 보내는 편지는 작성 중 또는 예약 상태로만 만들 수 있습니다.'
+        )
+        if send_now:
+            assert status == LetterStatus.EDITING.value, (
+                '예약 편지는 바로 전송할 수 없습니다.'
+            )
+        if status == LetterStatus.RESERVED.value:
+            assert validated_data.get('sent_date') is not None, (
+                '예약 발송 날짜를 입력해주세요.'
+            )
+            assert validated_data['sent_date'] > date.today(), (
+                '예약 발송은 내일 이후의 날짜로만 가능합니다.'
+            )
+
+        relationships = dict(TraineeToUser.objects.filter(user=sender, trainee_id__in=receivers)
+                             .values_list('trainee_id', 'relationship'))
+        assert len(relationships) == len(receivers), (
+            '내가 추가한 훈련병에게만 편지를 보낼 수 있습니다.'
+        )
+
+        set_sender_fields(validated_data, sender)
+        if status == LetterStatus.EDITING.value:
+            validated_data['sent_date'] = None
+        validated_data['sender'] = sender
+        validated_data['contents'] = removeEscapedBlanks(validated_data['contents'])
+
+        letters = []
+        for receiver_id in receivers:
+            letter_data = dict(validated_data, receiver_id=receiver_id)
+            set_relationship(letter_data, relationships[receiver_id])
+            letters.append(Letter(**letter_data))
+        return Letter.objects.bulk_create(letters)
@@ -1,32 +1,431 @@
-from datetime import date
-from api.models import Letter, LetterStatus
+import os
+import random
+import socket
+import threading
+from collections import defaultdict, deque
+from datetime import date, timedelta
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django import db
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from api.models import DeliveryJob, DeliveryJobStatus, Letter, LetterListWatermark, LetterStatus, Trainee
 import rokaf_crawler
 
+
+class LetterNotRecordedError(Exception):
+    """
+    upstream에는 전송됐지만 전송 결과(SENDING)를 DB에 기록하지 못했다.
+    다시 전송하면 같은 편지가 두 번 가므로 재시도하면 안 된다.
+    """
+    def __init__(self, letter: Letter):
+        super().__init__(f'편지(id={letter.id})는 전송됐지만 전송 결과를 저장하지 못했습니다.')
+        self.letter = letter
+
+
 class LetterService:
     @staticmethod
-    def send_letter(letter: Letter) -> Letter:
-        letter_pydantic = rokaf_crawler.models.Letter(senderZipcode=letter.senderZipcode,
-                                                      senderAddr1=letter.senderAddr1,
-                                                      senderAddr2=letter.senderAddr2,
-                                                      senderName=letter.senderName,
-                                                      relationship=letter.relationship,
-                                                      title=letter.title,
-                                                      contents=letter.contents,
-                                                      password=letter.password)
-
-        receiver = letter.receiver
-        receiver_pydantic = rokaf_crawler.models.Trainee(name=receiver.name,
-                                                         birthday=receiver.birthday.strftime('%Y%m%d'),
-                                                         member_seq=receiver.member_seq,
-                                                         agency_id=receiver.agency_id)
+    def to_crawler_letter(letter: Letter) -> rokaf_crawler.models.Letter:
+        return rokaf_crawler.models.Letter(senderZipcode=letter.senderZipcode,
+                                           senderAddr1=letter.senderAddr1,
+                                           senderAddr2=letter.senderAddr2,
+                                           senderName=letter.senderName,
+                                           relationship=letter.relationship,
+                                           title=letter.title,
+                                           contents=letter.contents,
+                                           password=letter.password)
 
-        rokaf_crawler.crawlers.LetterSender(receiver_pydantic, letter_pydantic).send_letter()
+    @staticmethod
+    def to_crawler_receiver(receiver: Trainee) -> rokaf_crawler.models.Trainee:
+        return rokaf_crawler.models.Trainee(name=receiver.name,
+                                            birthday=receiver.birthday.strftime('%Y%m%d'),
+                                            member_seq=receiver.member_seq,
+                                            agency_id=receiver.agency_id)
+
+    @classmethod
+    def to_crawler_trainee(cls, letter: Letter) -> rokaf_crawler.models.Trainee:
+        return cls.to_crawler_receiver(letter.receiver)
 
+    @staticmethod
+    def mark_sent(letter: Letter) -> Letter:
         letter.sent_date = date.today()
         letter.status = LetterStatus.SENDING.value
         letter.save()
-
         return letter
 
+    def record_sent(self, letter: Letter) -> Letter:
+        """
+        upstream 전송이 끝난 편지를 기록한다.
+        끊긴 DB 연결일 수 있으므로 연결을 정리하고 한 번 더 시도하며, 그래도 실패하면 LetterNotRecordedError
+        """
+        try:
+            return self.mark_sent(letter)
+        except Exception:
+            db.close_old_connections()
+        try:
+            return self.mark_sent(letter)
+        except Exception as e:
+            raise LetterNotRecordedError(letter) from e
+
+    @staticmethod
+    def get_due_letters(today: Optional[date] = None):
+        """
+        예약 날짜가 된(sent_date <= 오늘) 예약 편지 queryset
+        (status, sent_date) index를 사용한다.
+        """
+        return Letter.objects.filter(status=LetterStatus.RESERVED.value, sent_date__lte=today or date.today()) \
+            .select_related('receiver').order_by('sent_date', 'id')
+
+    def iter_due_letters(self, chunk_size: int = 500, today: Optional[date] = None) -> Iterator[List[Letter]]:
+        """
+        예약 날짜가 된 편지를 chunk_size개씩 나눠 반환한다.
+        (sent_date, id) 기준 keyset pagination으로 매 chunk를 새 query로 읽기 때문에,
+        cursor를 열어 둔 채 전송 결과를 저장하지 않아도 되고(SQLite lock) backlog가 커도 메모리가 일정하다.
+        """
+        queryset = self.get_due_letters(today)
+        last_key = None
+        while True:
+            chunk_queryset = queryset
+            if last_key is not None:
+                last_sent_date, last_id = last_key
+                chunk_queryset = queryset.filter(Q(sent_date__gt=last_sent_date) |
+                                                 Q(sent_date=last_sent_date, id__gt=last_id))
+            chunk = list(chunk_queryset[:chunk_size])
+            if not chunk:
+                return
+            # 전송하면서 sent_date가 바뀌므로 yield 전에 기록해 둔다.
+            last_key = (chunk[-1].sent_date, chunk[-1].id)
+            yield chunk
+
+    def send_letter(self, letter: Letter) -> Letter:
+        letter_pydantic = self.to_crawler_letter(letter)
+        receiver_pydantic = self.to_crawler_trainee(letter)
+
+        rokaf_crawler.crawlers.LetterSender(receiver_pydantic, letter_pydantic).send_letter()
+
+        return self.record_sent(letter)
+
+    async def asend_letter(self, letter: Letter) -> Letter:
+        """
+        send_letter의 async 버전 (ASGI view)
+        upstream 요청은 event loop 공용 httpx client로 보내고, 전송 결과 저장만 thread에서 한다.
+        letter.receiver는 미리 select_related로 읽어 두어야 한다.
+        """
+        letter_pydantic = self.to_crawler_letter(letter)
+        receiver_pydantic = self.to_crawler_trainee(letter)
+
+        await rokaf_crawler.async_crawlers.AsyncLetterSender(receiver_pydantic, letter_pydantic).send_letter()
+
+        return await sync_to_async(self.record_sent)(letter)
+
+    def send_letters(self, letters: Iterable[Letter], group_by: str = 'trainee') -> List[Tuple[Letter, Exception]]:
+        """
+        여러 편지를 훈련병(또는 교육기관)별로 묶어 전송한다. (rokaf_crawler.crawlers.LetterBatchSender 참고)
+        (편지, 예외) 목록을 반환하며, 전송에 성공한 편지의 예외는 None이다.
+        전송은 됐지만 기록하지 못한 편지는 LetterNotRecordedError이며, 나머지 편지 결과에는 영향을 주지 않는다.
+        """
+        letters = list(letters)
+        pairs = [(self.to_crawler_trainee(letter), self.to_crawler_letter(letter)) for letter in letters]
+        results = rokaf_crawler.crawlers.LetterBatchSender(pairs, group_by).send_letters()
+
+        for index, (letter, exception) in enumerate(zip(letters, results)):
+            if exception is None:
+                try:
+                    self.record_sent(letter)
+                except LetterNotRecordedError as e:
+                    results[index] = e
+        return list(zip(letters, results))
+
+    @staticmethod
+    def get_match_key(title: str, sender_name: str) -> tuple:
+        return " ".join(title.split()), " ".join(sender_name.split())
+
+    @staticmethod
+    def get_watermark_number(trainee: Trainee) -> int:
+        return LetterListWatermark.objects.filter(trainee=trainee).values_list('last_number', flat=True).first() or 0
+
+    def match_delivered(self, letter: Letter, entries: Iterable[rokaf_crawler.models.LetterListEntry]) -> bool:
+        """
+        watermark 이후 목록에 올라온 같은 제목/작성자의 편지가, 아직 RECEIVED로 바뀌지 않은
+        같은 제목/작성자의 SENDING 편지 수보다 많으면 이 편지도 전송된 것으로 본다.
+        """
+        key = self.get_match_key(letter.title, letter.senderName)
+        uploaded = sum(1 for entry in entries if self.get_match_key(entry.title, entry.sender_name) == key)
+        if not uploaded:
+            return False
+        sending = Letter.objects.filter(receiver=letter.receiver_id, status=LetterStatus.SENDING.value) \
+            .exclude(id=letter.id).only('title', 'senderName')
+        return uploaded > sum(1 for other in sending if self.get_match_key(other.title, other.senderName) == key)
+
+    def is_delivered(self, letter: Letter) -> bool:
+        """
+        이전 전송 시도가 upstream에 도달했는지 편지 목록 페이지로 확인한다. (재시도 전 중복 전송 방지)
+        검색되지 않은 훈련병에게는 전송될 수 없으므로 upstream에 묻지 않는다.
+        """
+        if not letter.receiver.member_seq:
+            return False
+        entries = rokaf_crawler.crawlers.LetterListPageGetter(self.to_crawler_trainee(letter)) \
+            .get_letter_list(since=self.get_watermark_number(letter.receiver))
+        return self.match_delivered(letter, entries)
+
+    async def ais_delivered(self, letter: Letter) -> bool:
+        """
+        is_delivered의 async 버전 (ASGI view)
+        """
+        if not letter.receiver.member_seq:
+            return False
+        since = await sync_to_async(self.get_watermark_number)(letter.receiver)
+        entries = await rokaf_crawler.async_crawlers.AsyncLetterListPageGetter(self.to_crawler_trainee(letter)) \
+            .get_letter_list(since=since)
+        return await sync_to_async(self.match_delivered)(letter, entries)
+
+    def reconcile_trainee(self, trainee: Trainee, letters: Iterable[Letter]) -> List[Letter]:
+        """
+        훈련병의 편지 목록 페이지를 한 번 읽어, 목록에 올라온 SENDING 편지를 RECEIVED로 바꾼다.
+        마지막으로 확인한 편지 번호(LetterListWatermark) 이후의 항목만 비교하고, 바뀐 편지 목록을 반환한다.
+        """
+        watermark, _ = LetterListWatermark.objects.get_or_create(trainee=trainee)
+        entries = rokaf_crawler.crawlers.LetterListPageGetter(self.to_crawler_receiver(trainee)) \
+            .get_letter_list(since=watermark.last_number)
+
+        # 같은 제목/작성자의 편지가 여러 통이면 먼저 보낸 편지부터 짝을 짓는다.
+        pending = defaultdict(deque)
+        for letter in sorted(letters, key=lambda letter: (letter.sent_date or date.min, letter.id)):
+            pending[self.get_match_key(letter.title, letter.senderName)].append(letter)
+
+        received = []
+        for entry in sorted(entries, key=lambda entry: entry.number):
+            candidates = pending.get(self.get_match_key(entry.title, entry.sender_name))
+            if candidates:
+                received.append(candidates.popleft())
+
+        with transaction.atomic():
+            if received:
+                Letter.objects.filter(id__in=[letter.id for letter in received]) \
+                    .update(status=LetterStatus.RECEIVED.value, updated_at=timezone.now())
+            if entries:
+                watermark.last_number = max(entry.number for entry in entries)
+            watermark.save()
+
+        for letter in received:
+            letter.status = LetterStatus.RECEIVED.value
+        return received
+
+
+letterService = LetterService()
+
+
+class DeliveryQueue:
+    """
+    DB 기반 편지 전송 작업 큐
+    - claim: SELECT ... FOR UPDATE SKIP LOCKED로 여러 worker가 같은 작업을 가져가지 않도록 한다.
+      SKIP LOCKED를 지원하지 않는 DB(SQLite 등)에서는 프로세스 내 lock과 조건부 UPDATE로 대신한다.
+    - fail: exponential backoff로 재시도하고, max_attempts를 넘거나 재시도해도 소용없는 에러면 DEAD로 둔다.
+    - 실패했거나 중단된 적이 있는 작업(last_error)은 다시 보내기 전에 편지 목록 페이지에서 이미 전송됐는지 확인한다.
+      전송 요청이 upstream에 도달한 뒤 응답을 받지 못한 경우 같은 편지가 두 번 가지 않도록 하기 위해서다.
+    """
+    BACKOFF_BASE = timedelta(seconds=30)
+    BACKOFF_MAX = timedelta(hours=1)
+    # worker가 죽어서 RUNNING 상태로 남은 작업을 다시 PENDING으로 돌리는 기준
+    LOCK_TIMEOUT = timedelta(minutes=10)
+    STALE_ERROR = 'LockTimeout: worker가 작업을 끝내지 못했습니다.'
+    # 다시 시도해도 결과가 같은 에러, 또는 다시 시도하면 안 되는 에러(이미 전송된 편지)
+    PERMANENT_ERRORS = (rokaf_crawler.exceptions.TraineeNotFoundException,
+                        rokaf_crawler.exceptions.TraineeNotSearchedException,
+                        LetterNotRecordedError)
+
+    _local_lock = threading.Lock()
+
+    @staticmethod
+    def get_worker_id() -> str:
+        return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+    def enqueue(self, letter: Letter, run_at=None) -> DeliveryJob:
+        job, created = DeliveryJob.objects.get_or_create(letter=letter, defaults={
+            'available_at': run_at or timezone.now(),
+        })
+        if not created and job.status != DeliveryJobStatus.RUNNING.value:
+            # last_error는 남겨 두어 다시 보내기 전에 전송 여부를 확인하게 한다.
+            job.status = DeliveryJobStatus.PENDING.value
+            job.attempts = 0
+            job.available_at = run_at or timezone.now()
+            job.save()
+        # 이미 있던 작업은 letter를 불러오지 않으므로, async view(aprocess)에서 DB를 다시 읽지 않도록 넘겨받은 편지를 쓴다.
+        job.letter = letter
+        return job
+
+    def enqueue_many(self, letters: Iterable[Letter]) -> int:
+        letters = list(letters)
+        # 이미 작업이 있는 편지는 건너뛴다.
+        existing = set(DeliveryJob.objects.filter(letter__in=letters).values_list('letter_id', flat=True))
+        jobs = [DeliveryJob(letter=letter) for letter in letters if letter.id not in existing]
+        return len(DeliveryJob.objects.bulk_create(jobs, ignore_conflicts=True))
+
+    def claim(self, batch_size: int = 1, worker_id: Optional[str] = None) -> List[DeliveryJob]:
+        worker_id = worker_id or self.get_worker_id()
+        if connection.features.has_select_for_update_skip_locked:
+            return self._claim(batch_size, worker_id, skip_locked=True)
+        with self._local_lock:
+            return self._claim(batch_size, worker_id, skip_locked=False)
+
+    def _claim(self, batch_size: int, worker_id: str, skip_locked: bool) -> List[DeliveryJob]:
+        now = timezone.now()
+        with transaction.atomic():
+            queryset = DeliveryJob.objects.filter(status=DeliveryJobStatus.PENDING.value, available_at__lte=now) \
+                .order_by('available_at')
+            if skip_locked:
+                queryset = queryset.select_for_update(skip_locked=True)
+            candidate_ids = list(queryset.values_list('id', flat=True)[:batch_size])
+
+            claimed_ids = []
+            for job_id in candidate_ids:
+                # 다른 프로세스가 먼저 가져간 작업은 조건부 UPDATE에서 걸러진다.
+                updated = DeliveryJob.objects.filter(id=job_id, status=DeliveryJobStatus.PENDING.value).update(
+                    status=DeliveryJobStatus.RUNNING.value, attempts=F('attempts') + 1,
+                    locked_by=worker_id, locked_at=now, updated_at=now
+                )
+                if updated:
+                    claimed_ids.append(job_id)
+
+        return list(DeliveryJob.objects.filter(id__in=claimed_ids).select_related('letter__receiver')
+                    .order_by('available_at'))
+
+    def claim_job(self, job: DeliveryJob, worker_id: Optional[str] = None) -> bool:
+        """
+        작업 하나를 지정해서 가져온다. 다른 worker가 먼저 가져갔으면 False
+        """
+        now = timezone.now()
+        updated = DeliveryJob.objects.filter(id=job.id, status=DeliveryJobStatus.PENDING.value).update(
+            status=DeliveryJobStatus.RUNNING.value, attempts=F('attempts') + 1,
+            locked_by=worker_id or self.get_worker_id(), locked_at=now, updated_at=now
+        )
+        if updated:
+            job.refresh_from_db(fields=['status', 'attempts', 'locked_by', 'locked_at', 'updated_at'])
+        return bool(updated)
+
+    def complete(self, job: DeliveryJob) -> None:
+        job.status = DeliveryJobStatus.DONE.value
+        job.locked_by = ''
+        job.locked_at = None
+        job.last_error = ''
+        job.save(update_fields=['status', 'locked_by', 'locked_at', 'last_error', 'updated_at'])
+
+    def get_backoff(self, attempts: int) -> timedelta:
+        backoff = min(self.BACKOFF_MAX, self.BACKOFF_BASE * (2 ** max(attempts - 1, 0)))
+        # 여러 작업이 같은 시각에 몰리지 않도록 jitter를 준다.
+        return backoff * random.uniform(0.8, 1.2)
+
+    def fail(self, job: DeliveryJob, exception: BaseException) -> None:
+        job.last_error = f"{type(exception).__name__}: {exception}"
+        job.locked_by = ''
+        job.locked_at = None
+        if isinstance(exception, self.PERMANENT_ERRORS) or job.attempts >= job.max_attempts:
+            job.status = DeliveryJobStatus.DEAD.value
+        else:
+            job.status = DeliveryJobStatus.PENDING.value
+            job.available_at = timezone.now() + self.get_backoff(job.attempts)
+        job.save(update_fields=['status', 'available_at', 'locked_by', 'locked_at', 'last_error', 'updated_at'])
+
+    def requeue_stale(self) -> int:
+        """
+        LOCK_TIMEOUT이 지나도 RUNNING인 작업을 정리하고, 다시 PENDING으로 돌린 작업 수를 반환한다.
+        편지가 이미 전송 상태면 DONE으로 끝내고, 아니면 STALE_ERROR를 남겨 재시도 전에 전송 여부를 확인하게 한다.
+        """
+        if connection.features.has_select_for_update_skip_locked:
+            return self._requeue_stale()
+        # claim과 같은 이유로 SKIP LOCKED가 없는 DB에서는 프로세스 내 lock으로 순서를 맞춘다.
+        with self._local_lock:
+            return self._requeue_stale()
+
+    def _requeue_stale(self) -> int:
+        now = timezone.now()
+        stale = DeliveryJob.objects.filter(status=DeliveryJobStatus.RUNNING.value,
+                                           locked_at__lt=now - self.LOCK_TIMEOUT)
+        sendable_statuses = [LetterStatus.RESERVED.value, LetterStatus.EDITING.value]
+        with transaction.atomic():
+            stale.exclude(letter__status__in=sendable_statuses) \
+                .update(status=DeliveryJobStatus.DONE.value, locked_by='', locked_at=None, last_error='',
+                        updated_at=now)
+            return stale.update(status=DeliveryJobStatus.PENDING.value, locked_by='', locked_at=None,
+                                available_at=now, last_error=self.STALE_ERROR, updated_at=now)
+
+    @staticmethod
+    def needs_verification(job: DeliveryJob) -> bool:
+        return bool(job.last_error)
+
+    def process(self, job: DeliveryJob) -> bool:
+        """
+        작업 하나를 처리한다. 성공하면 True
+        """
+        letter = job.letter
+        # 이미 전송된 편지는 다시 보내지 않는다.
+        if letter.status not in (LetterStatus.RESERVED.value, LetterStatus.EDITING.value):
+            self.complete(job)
+            return True
+        try:
+            if self.needs_verification(job) and letterService.is_delivered(letter):
+                letterService.record_sent(letter)
+            else:
+                letterService.send_letter(letter)
+        except Exception as e:
+            self.fail(job, e)
+            return False
+        self.complete(job)
+        return True
+
+    async def aprocess(self, job: DeliveryJob) -> bool:
+        """
+        process의 async 버전. 성공하면 True
+        """
+        letter = job.letter
+        # 이미 전송된 편지는 다시 보내지 않는다.
+        if letter.status not in (LetterStatus.RESERVED.value, LetterStatus.EDITING.value):
+            await sync_to_async(self.complete)(job)
+            return True
+        try:
+            if self.needs_verification(job) and await letterService.ais_delivered(letter):
+                await sync_to_async(letterService.record_sent)(letter)
+            else:
+                await letterService.asend_letter(letter)
+        except BaseException as e:
+            # client가 연결을 끊어 취소(CancelledError)되어도 작업이 RUNNING으로 남지 않게 한다.
+            await sync_to_async(self.fail)(job, e)
+            if not isinstance(e, Exception):
+                raise
+            return False
+        await sync_to_async(self.complete)(job)
+        return True
+
+    def process_batch(self, jobs: List[DeliveryJob], group_by: str = 'trainee') -> List[bool]:
+        """
+        여러 작업을 한 번에 처리한다. 전송할 편지는 LetterService.send_letters로 묶어 보내므로
+        같은 훈련병(또는 교육기관)에게 가는 편지는 upstream 세션 하나로 전송된다.
+        """
+        results = {}
+        sendable = []
+        for job in jobs:
+            # 이미 전송된 편지는 다시 보내지 않는다.
+            if job.letter.status not in (LetterStatus.RESERVED.value, LetterStatus.EDITING.value):
+                self.complete(job)
+                results[job.id] = True
+            elif self.needs_verification(job):
+                # 재시도하는 편지는 한 통씩 전송 여부를 확인한다.
+                results[job.id] = self.process(job)
+            else:
+                sendable.append(job)
+
+        # 편지마다 결과를 따로 받으므로, 일부 편지의 실패가 이미 전송된 다른 편지를 재시도하게 만들지 않는다.
+        sent = letterService.send_letters([job.letter for job in sendable], group_by)
+        for job, (_, exception) in zip(sendable, sent):
+            if exception is None:
+                self.complete(job)
+            else:
+                self.fail(job, exception)
+            results[job.id] = exception is None
+        return [results[job.id] for job in jobs]
+
 
-letterService = LetterService()
\ No newline at end of file
+deliveryQueue = DeliveryQueue()
@@ -1,3 +1,2019 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import logging
+import os
+import sys
+import threading
+import time
+import weakref
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import brotli
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ParseError
+
+import rokaf_crawler
+from api import gpt, views
+from api.fake_completion_server import DEFAULT_CONTENT, FakeCompletionConfig, FakeCompletionServer, split_tokens
+from api.management.commands import regulardelivery, reservationscheduler
+from api.management.commands.importprofile import get_deferred_imports, get_total_time, profile_imports
+from api.models import *
+from api.pagination import LetterCursorPagination
+from api.parsers import FastJSONParser
+from api.renderers import FastJSONRenderer, astream_json_list, dumps, loads, stream_json_list
+from api.scheduler import ReservationScheduler, get_due_timestamp
+from api.services import LetterNotRecordedError, LetterService, deliveryQueue, letterService
+from rokaf_crawler.exceptions import *
+from rokaf_crawler.fake_server import LETTER_LIST_ROW, FakeServer, FakeServerConfig, get_member_seq, load_page, \
+    load_template
+
+
+def get_crawler_letter(title: str = '훈련 잘 받고 있지?', sender_name: str = '홍길동') -> rokaf_crawler.models.Letter:
+    return rokaf_crawler.models.Letter(senderZipcode='52364', senderAddr1='경상남도 진주시 금산면 송백로 46',
+                                       senderAddr2='사서함', senderName=sender_name, relationship='친구/지인',
+                                       title=title, contents='건강하게 수료하자!', password='1234')
+
+
+class FakeSiteMixin:
+    """
+    rokaf_crawler.fake_server를 띄우고 crawler가 그 주소로 요청하도록 바꾼다.
+    요청 속도 제한은 테스트 시간에 영향을 주지 않도록 크게 늘리고, 테스트마다 검색 결과 캐시와 fake 사이트 상태를 비운다.
+    """
+    fake_server_config = {}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeServer(FakeServerConfig(port=0, **cls.fake_server_config)).start()
+        cls.addClassCleanup(cls.server.stop)
+
+        http_config = rokaf_crawler.sessions.config.model_dump()
+        rokaf_crawler.sessions.configure(base_url=cls.server.url, search_base_url=cls.server.url)
+        cls.addClassCleanup(rokaf_crawler.sessions.configure, **http_config)
+        throttle_config = rokaf_crawler.throttling.config.model_dump()
+        rokaf_crawler.throttling.configure(rate=1000, burst=1000)
+        cls.addClassCleanup(rokaf_crawler.throttling.configure, **throttle_config)
+
+    def setUp(self):
+        super().setUp()
+        rokaf_crawler.cache.search_cache.clear()
+        with self.server.site.lock:
+            self.server.site.letters.clear()
+            self.server.site.request_counts.clear()
+
+    def get_sent_letters(self, member_seq: str) -> list:
+        with self.server.site.lock:
+            return list(self.server.site.letters.get(member_seq, []))
+
+
+class CrawlerSessionTest(SimpleTestCase):
+    def setUp(self):
+        http_config = rokaf_crawler.sessions.config.model_dump()
+        self.addCleanup(rokaf_crawler.sessions.configure, **http_config)
+
+    def test_configure_closes_async_clients(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        client = loop.run_until_complete(self.get_running_client())
+        rokaf_crawler.sessions.configure(read_timeout=10)
+        self.assertTrue(client.is_closed)
+        self.assertIsNot(loop.run_until_complete(self.get_running_client()), client)
+        loop.run_until_complete(rokaf_crawler.sessions.aclose())
+
+    def test_configure_closes_async_clients_on_running_loop(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+
+        client = asyncio.run_coroutine_threadsafe(self.get_running_client(), loop).result()
+        rokaf_crawler.sessions.configure(read_timeout=10)
+        # aclose()는 client를 만든 loop에서 실행된다.
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        self.assertTrue(client.is_closed)
+
+    @staticmethod
+    async def get_running_client():
+        return rokaf_crawler.sessions.get_async_client()
+
+    def test_max_connections(self):
+        config = rokaf_crawler.sessions.configure(pool_connections=2, pool_maxsize=5, max_connections=None)
+        self.assertEqual(config.total_max_connections, 10)
+        config = rokaf_crawler.sessions.configure(max_connections=50)
+        self.assertEqual(config.total_max_connections, 50)
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class SearchResultCacheTest(FakeSiteMixin, SimpleTestCase):
+    fake_server_config = {'not_found_names': ['김없음']}
+
+    def test_ttl_and_lru(self):
+        clock = FakeClock()
+        cache = rokaf_crawler.cache.TTLCache(maxsize=2, ttl=10, clock=clock)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        # 가장 오래 사용하지 않은 b가 밀려난다.
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+        clock.advance(10)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats, {'hits': 2, 'misses': 2, 'evictions': 1, 'size': 1})
+
+    def test_search_result_copy(self):
+        cache = rokaf_crawler.cache.SearchResultCache()
+        trainee = rokaf_crawler.models.Trainee(name='김진수', birthday='20020801')
+        cache.set_search_result(trainee, [{'member_seq': '1000001'}])
+        cache.get_search_result(trainee)[0]['member_seq'] = 'changed'
+        self.assertEqual(cache.get_search_result(trainee), [{'member_seq': '1000001'}])
+
+    def test_negative_ttl(self):
+        clock = FakeClock()
+        cache = rokaf_crawler.cache.SearchResultCache(ttl=600, negative_ttl=60, clock=clock)
+        trainee = rokaf_crawler.models.Trainee(name='김없음', birthday='20020801')
+        cache.set_not_found(trainee, TraineeNotFoundException())
+        with self.assertRaises(TraineeNotFoundException):
+            cache.get_search_result(trainee)
+        clock.advance(60)
+        self.assertIsNone(cache.get_search_result(trainee))
+
+    def test_search_uses_cache(self):
+        searcher = rokaf_crawler.crawlers.TraineeSearcher(
+            rokaf_crawler.models.Trainee(name='김진수', birthday='20020801')
+        )
+        self.assertEqual(searcher.search_trainee(), searcher.search_trainee())
+        not_found_searcher = rokaf_crawler.crawlers.TraineeSearcher(
+            rokaf_crawler.models.Trainee(name='김없음', birthday='20020801')
+        )
+        for _ in range(2):
+            with self.assertRaises(TraineeNotFoundException):
+                not_found_searcher.search_trainee()
+        self.assertEqual(self.server.site.request_counts['emailPicViewSameMembers.action'], 2)
+
+
+class ThrottleTest(SimpleTestCase):
+    def test_token_bucket(self):
+        clock = FakeClock()
+        bucket = rokaf_crawler.throttling.TokenBucket(rate=2, capacity=2, clock=clock)
+        self.assertEqual([bucket.reserve() for _ in range(4)], [0.0, 0.0, 0.5, 1.0])
+        clock.advance(1.5)
+        # 1.5초 동안 토큰 3개가 채워져 예약해 둔 2개를 갚고 1개가 남는다.
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertEqual(bucket.reserve(), 0.5)
+
+    def test_circuit_breaker(self):
+        clock = FakeClock()
+        breaker = rokaf_crawler.throttling.CircuitBreaker(failure_threshold=2, recovery_timeout=30, clock=clock)
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_failure()
+        with self.assertRaises(CircuitOpenException):
+            breaker.before_call()
+
+        # cool-down이 지나면 시험 요청 하나만 통과시키고, 실패하면 다시 open
+        clock.advance(30)
+        breaker.before_call()
+        with self.assertRaises(CircuitOpenException):
+            breaker.before_call()
+        breaker.record_failure()
+        with self.assertRaises(CircuitOpenException):
+            breaker.before_call()
+
+        clock.advance(30)
+        breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        breaker.before_call()
+
+
+class UpstreamFailureThrottleTest(FakeSiteMixin, SimpleTestCase):
+    fake_server_config = {'error_rate': 1.0, 'not_found_names': ['김없음']}
+
+    def setUp(self):
+        super().setUp()
+        throttle_config = rokaf_crawler.throttling.config.model_dump()
+        rokaf_crawler.throttling.configure(failure_threshold=2, recovery_timeout=60)
+        self.addCleanup(rokaf_crawler.throttling.configure, **throttle_config)
+        # 5xx 응답 재시도가 결과에 섞이지 않도록 한다.
+        http_config = rokaf_crawler.sessions.config.model_dump()
+        rokaf_crawler.sessions.configure(max_retries=0)
+        self.addCleanup(rokaf_crawler.sessions.configure, **http_config)
+
+    def test_breaker_opens_per_agency(self):
+        trainee = rokaf_crawler.models.Trainee(name='김진수', birthday='20020801')
+        for _ in range(2):
+            with self.assertRaises(requests.HTTPError):
+                rokaf_crawler.crawlers.TraineeSearcher(trainee).search_trainee()
+        with self.assertRaises(CircuitOpenException):
+            rokaf_crawler.crawlers.TraineeSearcher(trainee).search_trainee()
+        self.assertEqual(self.server.site.request_counts['emailPicViewSameMembers.action'], 2)
+
+        # 다른 교육기관은 영향을 받지 않는다.
+        other_trainee = rokaf_crawler.models.Trainee(name='김진수', birthday='20020801',
+                                                     agency_id=AgencyIndex.군수1학교.value)
+        with self.assertRaises(httpx.HTTPStatusError):
+            rokaf_crawler.async_crawlers.run(
+                rokaf_crawler.async_crawlers.AsyncTraineeSearcher(other_trainee).search_trainee()
+            )
+
+    def test_not_found_is_not_failure(self):
+        self.server.config.error_rate = 0.0
+        self.addCleanup(setattr, self.server.config, 'error_rate', 1.0)
+        trainee = rokaf_crawler.models.Trainee(name='김없음', birthday='20020801')
+        for _ in range(3):
+            rokaf_crawler.cache.search_cache.clear()
+            with self.assertRaises(TraineeNotFoundException):
+                rokaf_crawler.crawlers.TraineeSearcher(trainee).search_trainee()
+
+    def test_failure_check_does_not_import_other_client(self):
+        is_upstream_failure = rokaf_crawler.throttling.is_upstream_failure
+        request = httpx.Request('GET', self.server.url)
+
+        # sys.modules의 값이 None이면 import가 ImportError를 낸다.
+        with mock.patch.dict(sys.modules, {'httpx': None}):
+            self.assertTrue(is_upstream_failure(requests.ConnectionError()))
+            self.assertFalse(is_upstream_failure(TraineeNotFoundException()))
+        with mock.patch.dict(sys.modules, {'requests': None}):
+            self.assertTrue(is_upstream_failure(httpx.ConnectTimeout('timed out', request=request)))
+            self.assertTrue(is_upstream_failure(httpx.HTTPStatusError(
+                '503', request=request, response=httpx.Response(503, request=request))))
+            self.assertFalse(is_upstream_failure(httpx.HTTPStatusError(
+                '404', request=request, response=httpx.Response(404, request=request))))
+
+
+class ParserTest(SimpleTestCase):
+    """
+    모든 parser backend가 UTF-8, CP949 페이지를 같은 결과로 읽는지 확인한다.
+    """
+    @staticmethod
+    def get_pages(page: str):
+        # (인코딩, Content-Type, 페이지): charset을 HTTP header로만 / <meta>로만 알 수 있는 경우와 둘 다 없는 경우
+        without_meta = page.replace('<meta charset="UTF-8">', '')
+        for encoding, charset in (('utf-8', 'UTF-8'), ('cp949', 'EUC-KR')):
+            yield encoding, f'text/html; charset={charset}', without_meta.encode(encoding)
+            yield encoding, 'text/html', page.replace('UTF-8', charset).encode(encoding)
+            yield encoding, None, without_meta.encode(encoding)
+
+    def test_parse_trainees(self):
+        for name, parser in rokaf_crawler.parsers.available_parsers().items():
+            for encoding, content_type, content in self.get_pages(load_page('search_result.html')):
+                with self.subTest(parser=name, encoding=encoding, content_type=content_type):
+                    trainees = parser.parse_trainees(rokaf_crawler.parsers.decode_page(content, content_type))
+                    self.assertEqual(trainees[0], ('1023847', {'성명': '김진수', '생년월일': '2002-08-01',
+                                                               '입영일': '2024-02-26', '소속 대대': '제 1 대대',
+                                                               '소속 중대': '제 3 중대'}))
+                    self.assertEqual(len(trainees), 2)
+
+    def test_parse_letters(self):
+        # EUC-KR에는 없는 CP949 확장 글자(똠)
+        row = LETTER_LIST_ROW.substitute(number=3, title='똠방각하 훈련병에게', sender_name='홍길동',
+                                         sent_date='2024-03-01')
+        page = load_template('letter_list.html').substitute(cody_menu_seq='', site_id='last2', name='김진수', rows=row)
+        for name, parser in rokaf_crawler.parsers.available_parsers().items():
+            for encoding, content_type, content in self.get_pages(page):
+                with self.subTest(parser=name, encoding=encoding, content_type=content_type):
+                    letters = parser.parse_letters(rokaf_crawler.parsers.decode_page(content, content_type))
+                    self.assertEqual(letters, [(3, '똠방각하 훈련병에게', '홍길동', '2024-03-01')])
+
+
+    def test_incomplete_backend(self):
+        class TraineeOnlyParser(rokaf_crawler.parsers.Parser):
+            def parse_trainees(self, content):
+                return []
+
+        # 구현하지 않은 method가 있으면 처음 파싱할 때가 아니라 만들 때 실패한다.
+        with self.assertRaises(TypeError):
+            TraineeOnlyParser()
+
+
+class CP949SiteTest(FakeSiteMixin, SimpleTestCase):
+    fake_server_config = {'encoding': 'cp949'}
+
+    def test_search_trainee(self):
+        trainee = rokaf_crawler.models.Trainee(name='김진수', birthday='20020801')
+        results = [rokaf_crawler.crawlers.TraineeSearcher(trainee).search_trainee()]
+        rokaf_crawler.cache.search_cache.clear()
+        results.append(rokaf_crawler.async_crawlers.run(
+            rokaf_crawler.async_crawlers.AsyncTraineeSearcher(trainee).search_trainee()
+        ))
+        for search_result in results:
+            self.assertEqual(search_result[0]['additional_info']['성명'], '김진수')
+            self.assertEqual(search_result[0]['additional_info']['소속 대대'].split()[0], '제')
+
+
+class LetterListPaginationTest(FakeSiteMixin, SimpleTestCase):
+    fake_server_config = {'encoding': 'cp949', 'letters_per_page': 3}
+
+    def setUp(self):
+        super().setUp()
+        self.trainee = rokaf_crawler.models.Trainee(name='김진수', birthday='20020801', member_seq='1000001')
+        with self.server.site.lock:
+            self.server.site.letters['1000001'] = [{'title': f'똠방각하 {number}', 'senderName': '홍길동',
+                                                    'sent_date': '2026-10-01'} for number in range(1, 9)]
+
+    def get_letter_lists(self, since: int) -> list:
+        sync_entries = rokaf_crawler.crawlers.LetterListPageGetter(self.trainee).get_letter_list(since=since)
+        async_entries = rokaf_crawler.async_crawlers.run(
+            rokaf_crawler.async_crawlers.AsyncLetterListPageGetter(self.trainee).get_letter_list(since=since)
+        )
+        return [sync_entries, async_entries]
+
+    def test_reads_every_page(self):
+        for entries in self.get_letter_lists(since=0):
+            self.assertEqual([entry.number for entry in entries], list(range(8, 0, -1)))
+            self.assertEqual(entries[0].title, '똠방각하 8')
+            self.assertEqual(entries[-1].sender_name, '홍길동')
+        # 3 + 3 + 2, 1번 편지가 나온 페이지에서 멈춘다.
+        self.assertEqual(self.server.site.request_counts['indexSub.action:getEmailList'], 6)
+
+    def test_stops_at_watermark(self):
+        for entries in self.get_letter_lists(since=5):
+            self.assertEqual([entry.number for entry in entries], [8, 7, 6])
+        self.assertEqual(self.server.site.request_counts['indexSub.action:getEmailList'], 4)
+
+    def test_add_page_stops_on_repeated_page(self):
+        def entry(number: int) -> rokaf_crawler.models.LetterListEntry:
+            return rokaf_crawler.models.LetterListEntry(number=number, title='', sender_name='', sent_date='')
+
+        entries = []
+        add_page = rokaf_crawler.crawlers.BaseLetterListPageGetter.add_page
+        self.assertTrue(add_page(entries, [entry(6), entry(5), entry(4)], since=0))
+        self.assertFalse(add_page(entries, [entry(6), entry(5), entry(4)], since=0))
+        self.assertFalse(add_page(entries, [], since=0))
+        self.assertEqual([entry.number for entry in entries], [6, 5, 4])
+
+
+class AsyncCrawlerTest(FakeSiteMixin, SimpleTestCase):
+    fake_server_config = {'not_found_names': ['김없음']}
+
+    def test_search_trainees(self):
+        trainees = [rokaf_crawler.models.Trainee(name='김진수', birthday='20020801'),
+                    rokaf_crawler.models.Trainee(name='김없음', birthday='20020801'),
+                    rokaf_crawler.models.Trainee(name='이하늘', birthday='20030115')]
+        results = rokaf_crawler.async_crawlers.run(rokaf_crawler.async_crawlers.search_trainees(trainees))
+
+        self.assertEqual(results[0][0]['member_seq'], get_member_seq('last2', '김진수', '20020801'))
+        self.assertEqual(results[0][0]['additional_info']['성명'], '김진수')
+        self.assertIsInstance(results[1], TraineeNotFoundException)
+        self.assertEqual(results[2][0]['member_seq'], get_member_seq('last2', '이하늘', '20030115'))
+
+    def test_send_letters(self):
+        trainees = [rokaf_crawler.models.Trainee(name='김진수', birthday='20020801', member_seq='1000001'),
+                    rokaf_crawler.models.Trainee(name='이하늘', birthday='20030115', member_seq='1000002'),
+                    rokaf_crawler.models.Trainee(name='박미검', birthday='20030115')]
+        pairs = [(trainee, get_crawler_letter(title=f'{trainee.name}에게')) for trainee in trainees]
+        results = rokaf_crawler.async_crawlers.run(rokaf_crawler.async_crawlers.send_letters(pairs))
+
+        self.assertEqual(results[:2], [None, None])
+        self.assertIsInstance(results[2], TraineeNotSearchedException)
+        self.assertEqual([letter['title'] for letter in self.get_sent_letters('1000001')], ['김진수에게'])
+        self.assertEqual([letter['title'] for letter in self.get_sent_letters('1000002')], ['이하늘에게'])
+
+    def test_send_letter_outside_writing_period(self):
+        self.server.config.writing_period = False
+        self.addCleanup(setattr, self.server.config, 'writing_period', True)
+        trainee = rokaf_crawler.models.Trainee(name='김진수', birthday='20020801', member_seq='1000001')
+
+        with self.assertRaises(LetterWritingPeriodException):
+            rokaf_crawler.async_crawlers.run(
+                rokaf_crawler.async_crawlers.AsyncLetterSender(trainee, get_crawler_letter()).send_letter()
+            )
+        self.assertEqual(self.get_sent_letters('1000001'), [])
+
+
+class LetterBatchSenderTest(FakeSiteMixin, SimpleTestCase):
+    """
+    그룹마다 목록/작성 페이지는 한 번만 열고, 결과는 입력 순서대로 돌려주는지 확인한다.
+    """
+    def get_pairs(self) -> list:
+        kim = rokaf_crawler.models.Trainee(name='김진수', birthday='20020801', member_seq='1000001')
+        lee = rokaf_crawler.models.Trainee(name='이하늘', birthday='20030115', member_seq='1000002')
+        park = rokaf_crawler.models.Trainee(name='박미검', birthday='20030115')
+        return [(kim, get_crawler_letter(title='첫 번째')), (lee, get_crawler_letter(title='두 번째')),
+                (park, get_crawler_letter(title='세 번째')), (kim, get_crawler_letter(title='네 번째')),
+                (kim, get_crawler_letter(title='다섯 번째'))]
+
+    def assertSent(self, results: list) -> None:
+        self.assertEqual(results[:2], [None, None])
+        self.assertIsInstance(results[2], TraineeNotSearchedException)
+        self.assertEqual(results[3:], [None, None])
+        self.assertEqual([letter['title'] for letter in self.get_sent_letters('1000001')],
+                         ['첫 번째', '네 번째', '다섯 번째'])
+        self.assertEqual([letter['title'] for letter in self.get_sent_letters('1000002')], ['두 번째'])
+
+    def test_group_by_trainee(self):
+        results = rokaf_crawler.crawlers.LetterBatchSender(self.get_pairs()).send_letters()
+
+        self.assertSent(results)
+        counts = self.server.site.request_counts
+        self.assertEqual(counts['indexSub.action:getEmailList'], 2)
+        self.assertEqual(counts['indexSub.action:writeEmail'], 2)
+        self.assertEqual(counts['emailPicSaveEmail.action'], 4)
+
+    def test_group_by_agency(self):
+        results = rokaf_crawler.crawlers.LetterBatchSender(self.get_pairs(), group_by='agency').send_letters()
+
+        self.assertSent(results)
+        self.assertEqual(self.server.site.request_counts['indexSub.action:getEmailList'], 1)
+        self.assertEqual(self.server.site.request_counts['indexSub.action:writeEmail'], 1)
+
+    def test_async_group_by_trainee(self):
+        results = rokaf_crawler.async_crawlers.run(rokaf_crawler.async_crawlers.send_letter_batch(self.get_pairs()))
+
+        self.assertSent(results)
+        self.assertEqual(self.server.site.request_counts['indexSub.action:getEmailList'], 2)
+        self.assertEqual(self.server.site.request_counts['emailPicSaveEmail.action'], 4)
+
+    def test_expired_session_reopens_once(self):
+        site = self.server.site
+        letter_submit = site.letter_submit
+
+        def expire_after_first_submit(form, cookie_header):
+            response = letter_submit(form, cookie_header)
+            if site.request_counts['emailPicSaveEmail.action'] == 1:
+                with site.lock:
+                    site.sessions.clear()
+            return response
+
+        with mock.patch.object(site, 'letter_submit', side_effect=expire_after_first_submit):
+            pairs = [pair for pair in self.get_pairs() if pair[0].name == '김진수']
+            results = rokaf_crawler.crawlers.LetterBatchSender(pairs).send_letters()
+
+        self.assertEqual(results, [None, None, None])
+        self.assertEqual(len(self.get_sent_letters('1000001')), 3)
+        # 처음 접속 + 세션 만료 후 한 번 더
+        self.assertEqual(site.request_counts['indexSub.action:getEmailList'], 2)
+
+    def test_invalid_group_by(self):
+        with self.assertRaises(ValueError):
+            rokaf_crawler.crawlers.LetterBatchSender([], group_by='sender')
+
+
+class LetterServiceSendLettersTest(FakeSiteMixin, TestCase):
+    def test_marks_only_sent_letters(self):
+        user = User.objects.create_user(email='sender@example.com', password='password')
+        searched = Trainee.objects.create(name='김진수', birthday=date(2002, 8, 1), member_seq='1000001')
+        not_searched = Trainee.objects.create(name='박미검', birthday=date(2003, 1, 15), member_seq='')
+        letters = [Letter.objects.create(sender=user, receiver=receiver, title=title, contents='contents',
+                                         password='1234', status=LetterStatus.RESERVED.value)
+                   for receiver, title in [(searched, '하나'), (not_searched, '둘'), (searched, '셋')]]
+
+        results = letterService.send_letters(letters)
+
+        self.assertEqual([letter for letter, _ in results], letters)
+        self.assertEqual([exception is None for _, exception in results], [True, False, True])
+        statuses = [Letter.objects.get(pk=letter.pk).status for letter in letters]
+        self.assertEqual(statuses, [LetterStatus.SENDING.value, LetterStatus.RESERVED.value,
+                                    LetterStatus.SENDING.value])
+        self.assertEqual(self.server.site.request_counts['indexSub.action:getEmailList'], 1)
+
+
+class TraineeBatchSearchViewTest(FakeSiteMixin, TestCase):
+    fake_server_config = {'not_found_names': ['김없음']}
+
+    async def search(self, trainees: list):
+        return await self.async_client.post('/trainees/search/batch/', {'trainees': trainees},
+                                            content_type='application/json')
+
+    async def test_results_in_request_order(self):
+        response = await self.search([{'name': '김진수', 'birthday': '2002-08-01', 'agency_id': 0},
+                                      {'name': '김없음', 'birthday': '2002-08-01', 'agency_id': 0},
+                                      {'name': '이하늘', 'birthday': 'not a date', 'agency_id': 0},
+                                      {'name': '이하늘', 'birthday': '2003-01-15', 'agency_id': 1}])
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual([result['index'] for result in results], [0, 1, 2, 3])
+        self.assertEqual(results[0]['result'][0]['member_seq'], get_member_seq('last2', '김진수', '20020801'))
+        self.assertIn('error', results[1])
+        self.assertIn('birthday', results[2]['error'])
+        self.assertEqual(results[3]['result'][0]['member_seq'],
+                         get_member_seq(rokaf_crawler.models.agencies[1].site_id, '이하늘', '20030115'))
+        # 형식이 잘못된 항목은 upstream에 요청하지 않는다.
+        self.assertEqual(self.server.site.request_counts['emailPicViewSameMembers.action'], 3)
+
+    async def test_upstream_error_is_reported_per_entry(self):
+        http_config = rokaf_crawler.sessions.config.model_dump()
+        rokaf_crawler.sessions.configure(max_retries=0)
+        self.addCleanup(rokaf_crawler.sessions.configure, **http_config)
+        self.server.config.error_rate = 1.0
+        self.addCleanup(setattr, self.server.config, 'error_rate', 0.0)
+
+        response = await self.search([{'name': '김진수', 'birthday': '2002-08-01', 'agency_id': 0}])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{'index': 0, 'error': '인편 사이트에 접속할 수 없습니다.'}])
+
+    @override_settings(TRAINEE_BATCH_SEARCH_CONCURRENCY=2)
+    async def test_concurrency_is_bounded(self):
+        in_flight, peak = 0, 0
+        get_page = rokaf_crawler.async_crawlers.AsyncTraineeSearcher.get_page
+
+        async def counting_get_page(searcher, url):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            try:
+                await asyncio.sleep(0.05)
+                return await get_page(searcher, url)
+            finally:
+                in_flight -= 1
+
+        with mock.patch.object(rokaf_crawler.async_crawlers.AsyncTraineeSearcher, 'get_page', counting_get_page):
+            response = await self.search([{'name': f'훈련병{index}', 'birthday': '2002-08-01', 'agency_id': 0}
+                                          for index in range(6)])
+
+        self.assertTrue(all('result' in result for result in response.json()))
+        self.assertEqual(peak, 2)
+
+    async def test_invalid_request(self):
+        self.assertEqual((await self.search([])).status_code, 400)
+        response = await self.async_client.post('/trainees/search/batch/', '{', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class RegularDeliveryCommandTest(FakeSiteMixin, TransactionTestCase):
+    """
+    여러 thread가 DB를 쓰므로 TransactionTestCase를 사용한다.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='sender@example.com', password='password')
+        self.kim = Trainee.objects.create(name='김진수', birthday=date(2002, 8, 1), member_seq='1000001')
+        self.lee = Trainee.objects.create(name='이하늘', birthday=date(2003, 1, 15), member_seq='1000002',
+                                          agency_id=AgencyIndex.군수1학교.value)
+        self.park = Trainee.objects.create(name='박미검', birthday=date(2003, 1, 15), member_seq='')
+
+    def create_letter(self, receiver: Trainee, title: str, sent_date: date = None) -> Letter:
+        return Letter.objects.create(sender=self.user, receiver=receiver, title=title, contents='contents',
+                                     password='1234', status=LetterStatus.RESERVED.value,
+                                     sent_date=sent_date or date.today())
+
+    def call(self, *args) -> tuple:
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('regulardelivery', *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_parallel_delivery(self):
+        letters = [self.create_letter(self.kim, f'김진수 {index}') for index in range(4)]
+        letters.append(self.create_letter(self.lee, '이하늘'))
+        failed = self.create_letter(self.park, '박미검')
+        future = self.create_letter(self.kim, '다음 주', sent_date=date.today() + timedelta(days=7))
+
+        stdout, stderr = self.call('--workers', '4', '--agency-concurrency', '2', '--chunk-size', '2')
+
+        for letter in letters:
+            letter.refresh_from_db()
+            self.assertEqual(letter.status, LetterStatus.SENDING.value)
+        failed.refresh_from_db()
+        future.refresh_from_db()
+        self.assertEqual(failed.status, LetterStatus.RESERVED.value)
+        self.assertEqual(future.status, LetterStatus.RESERVED.value)
+        self.assertEqual(sorted(letter['title'] for letter in self.get_sent_letters('1000001')),
+                         [f'김진수 {index}' for index in range(4)])
+        self.assertEqual(len(self.get_sent_letters('1000002')), 1)
+
+        self.assertIn('sent: 5, failed: 1', stdout)
+        self.assertIn('failure - TraineeNotSearchedException: 1', stdout)
+        self.assertIn(f'id={failed.id}', stderr)
+
+    def test_enqueue(self):
+        letter = self.create_letter(self.kim, '김진수')
+
+        stdout, _ = self.call('--enqueue')
+
+        self.assertIn('counts: 1', stdout)
+        self.assertEqual(DeliveryJob.objects.get(letter=letter).status, DeliveryJobStatus.PENDING.value)
+        self.assertEqual(self.get_sent_letters('1000001'), [])
+
+    def test_invalid_options(self):
+        with self.assertRaises(CommandError):
+            self.call('--workers', '0')
+
+
+class RegularDeliveryDispatchTest(SimpleTestCase):
+    @staticmethod
+    def get_letter(agency_id: str, index: int):
+        return SimpleNamespace(id=index, receiver=SimpleNamespace(agency_id=agency_id))
+
+    def test_saturated_agency_does_not_block_others(self):
+        command = regulardelivery.Command()
+        other_started = threading.Event()
+        lock = threading.Lock()
+        running = Counter()
+        max_running = Counter()
+
+        def send_letter(letter):
+            agency_id = letter.receiver.agency_id
+            with lock:
+                running[agency_id] += 1
+                max_running[agency_id] = max(max_running[agency_id], running[agency_id])
+            if agency_id == 'other':
+                other_started.set()
+            # 교육기관 A의 첫 편지는 다른 교육기관 편지가 전송을 시작해야 끝난다.
+            elif letter.id == 0:
+                self.assertTrue(other_started.wait(5))
+            with lock:
+                running[agency_id] -= 1
+            return 0.0, None
+
+        letters = [self.get_letter('busy', index) for index in range(4)] + [self.get_letter('other', 4)]
+        with mock.patch.object(command, 'send_letter', side_effect=send_letter):
+            results = command.send_letters(iter([letters[:2], letters[2:]]), workers=2, agency_concurrency=1,
+                                           chunk_size=len(letters))
+
+        self.assertEqual(len(results), 5)
+        self.assertEqual(max_running, {'busy': 1, 'other': 1})
+
+
+class DeliveryQueueTestMixin(FakeSiteMixin):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='sender@example.com', password='password')
+        self.kim = Trainee.objects.create(name='김진수', birthday=date(2002, 8, 1), member_seq='1000001')
+
+    def create_letter(self, title: str = '잘 지내?', status: LetterStatus = LetterStatus.RESERVED) -> Letter:
+        return Letter.objects.create(sender=self.user, receiver=self.kim, title=title, contents='contents',
+                                     senderName='홍길동', password='1234', status=status.value,
+                                     sent_date=date.today())
+
+    @staticmethod
+    def send_upstream(letter: Letter) -> None:
+        """
+        이전 시도의 전송 요청이 upstream에 도달한 상황을 만든다.
+        """
+        rokaf_crawler.crawlers.LetterSender(letterService.to_crawler_trainee(letter),
+                                            letterService.to_crawler_letter(letter)).send_letter()
+
+    def create_failed_job(self, letter: Letter) -> DeliveryJob:
+        """
+        한 번 실패하고 다시 가져갈 수 있게 된 작업
+        """
+        job = deliveryQueue.enqueue(letter)
+        self.assertTrue(deliveryQueue.claim_job(job))
+        deliveryQueue.fail(job, httpx.ReadTimeout('timed out'))
+        DeliveryJob.objects.filter(id=job.id).update(available_at=timezone.now())
+        return job
+
+
+class DeliveryQueueTest(DeliveryQueueTestMixin, TestCase):
+    def test_claim_is_exclusive(self):
+        jobs = [deliveryQueue.enqueue(self.create_letter(f'편지 {index}')) for index in range(3)]
+
+        claimed = deliveryQueue.claim(batch_size=2)
+        self.assertEqual([job.id for job in claimed], [job.id for job in jobs[:2]])
+        self.assertTrue(all(job.status == DeliveryJobStatus.RUNNING.value and job.attempts == 1 for job in claimed))
+        self.assertEqual([job.id for job in deliveryQueue.claim(batch_size=10)], [jobs[2].id])
+        self.assertEqual(deliveryQueue.claim(batch_size=10), [])
+
+    def test_fail_backs_off_then_dies(self):
+        job = deliveryQueue.enqueue(self.create_letter())
+        [job] = deliveryQueue.claim()
+        deliveryQueue.fail(job, LetterWritingPeriodException())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, DeliveryJobStatus.PENDING.value)
+        self.assertGreater(job.available_at, timezone.now() + deliveryQueue.BACKOFF_BASE * 0.7)
+        self.assertIn('LetterWritingPeriodException', job.last_error)
+        self.assertEqual(deliveryQueue.claim(), [])
+
+        job.attempts = job.max_attempts
+        deliveryQueue.fail(job, LetterWritingPeriodException())
+        job.refresh_from_db()
+        self.assertEqual(job.status, DeliveryJobStatus.DEAD.value)
+
+    def test_permanent_error_is_dead(self):
+        job = deliveryQueue.enqueue(self.create_letter())
+        [job] = deliveryQueue.claim()
+        deliveryQueue.fail(job, TraineeNotSearchedException())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, DeliveryJobStatus.DEAD.value)
+
+    def test_requeue_stale(self):
+        stale_time = timezone.now() - deliveryQueue.LOCK_TIMEOUT - timedelta(minutes=1)
+        reserved_job = deliveryQueue.enqueue(self.create_letter('예약'))
+        sent_job = deliveryQueue.enqueue(self.create_letter('전송됨', status=LetterStatus.SENDING))
+        running_job = deliveryQueue.enqueue(self.create_letter('전송 중'))
+        DeliveryJob.objects.update(status=DeliveryJobStatus.RUNNING.value, locked_by='worker', locked_at=stale_time)
+        DeliveryJob.objects.filter(id=running_job.id).update(locked_at=timezone.now())
+
+        self.assertEqual(deliveryQueue.requeue_stale(), 1)
+
+        for job in (reserved_job, sent_job, running_job):
+            job.refresh_from_db()
+        self.assertEqual(reserved_job.status, DeliveryJobStatus.PENDING.value)
+        self.assertEqual(reserved_job.last_error, deliveryQueue.STALE_ERROR)
+        self.assertEqual(sent_job.status, DeliveryJobStatus.DONE.value)
+        self.assertEqual(running_job.status, DeliveryJobStatus.RUNNING.value)
+
+    def test_retry_does_not_resend_delivered_letter(self):
+        letter = self.create_letter()
+        self.send_upstream(letter)
+        self.create_failed_job(letter)
+
+        [job] = deliveryQueue.claim()
+        self.assertTrue(deliveryQueue.process(job))
+
+        self.assertEqual(len(self.get_sent_letters('1000001')), 1)
+        letter.refresh_from_db()
+        self.assertEqual(letter.status, LetterStatus.SENDING.value)
+        job.refresh_from_db()
+        self.assertEqual(job.status, DeliveryJobStatus.DONE.value)
+
+    def test_retry_sends_undelivered_letter(self):
+        # 같은 제목의 편지가 이미 전송되어 목록에 있어도, 그 편지 몫을 빼고 비교한다.
+        self.send_upstream(self.create_letter(status=LetterStatus.SENDING))
+        letter = self.create_letter()
+        self.create_failed_job(letter)
+
+        [job] = deliveryQueue.claim()
+        self.assertTrue(deliveryQueue.process(job))
+
+        self.assertEqual(len(self.get_sent_letters('1000001')), 2)
+        self.assertEqual(self.server.site.request_counts['emailPicSaveEmail.action'], 2)
+
+    def test_process_batch_verifies_retries(self):
+        retried = self.create_letter('재시도')
+        self.send_upstream(retried)
+        self.create_failed_job(retried)
+        deliveryQueue.enqueue(self.create_letter('처음'))
+
+        jobs = deliveryQueue.claim(batch_size=10)
+        self.assertEqual(deliveryQueue.process_batch(jobs), [True, True])
+
+        self.assertEqual([letter['title'] for letter in self.get_sent_letters('1000001')], ['재시도', '처음'])
+
+    async def test_aprocess_verifies_retries(self):
+        letter = await sync_to_async(self.create_letter)()
+        await sync_to_async(self.send_upstream)(letter)
+        await sync_to_async(self.create_failed_job)(letter)
+
+        [job] = await sync_to_async(deliveryQueue.claim)()
+        self.assertTrue(await deliveryQueue.aprocess(job))
+
+        self.assertEqual(len(self.get_sent_letters('1000001')), 1)
+        await letter.arefresh_from_db()
+        self.assertEqual(letter.status, LetterStatus.SENDING.value)
+
+
+    async def test_cancelled_aprocess_fails_job(self):
+        # client가 연결을 끊어 view가 취소되어도 작업이 RUNNING으로 남지 않는다.
+        letter = await sync_to_async(self.create_letter)()
+        await sync_to_async(deliveryQueue.enqueue)(letter)
+        [job] = await sync_to_async(deliveryQueue.claim)()
+
+        with mock.patch.object(letterService, 'asend_letter', side_effect=asyncio.CancelledError):
+            with self.assertRaises(asyncio.CancelledError):
+                await deliveryQueue.aprocess(job)
+
+        await job.arefresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (DeliveryJobStatus.PENDING.value, ''))
+        self.assertIn('CancelledError', job.last_error)
+
+
+class DeliveryWorkerCommandTest(DeliveryQueueTestMixin, TransactionTestCase):
+    def test_requeues_stale_job_without_resending(self):
+        letter = self.create_letter()
+        self.send_upstream(letter)
+        job = deliveryQueue.enqueue(letter)
+        DeliveryJob.objects.filter(id=job.id).update(
+            status=DeliveryJobStatus.RUNNING.value, attempts=1, locked_by='dead-worker',
+            locked_at=timezone.now() - deliveryQueue.LOCK_TIMEOUT - timedelta(minutes=1)
+        )
+        pending = deliveryQueue.enqueue(self.create_letter('새 편지'))
+
+        stdout = io.StringIO()
+        call_command('deliveryworker', '--once', '--workers', '2', stdout=stdout, stderr=io.StringIO())
+
+        self.assertIn('requeued stale jobs - counts: 1', stdout.getvalue())
+        self.assertIn('succeeded: 2, failed: 0', stdout.getvalue())
+        for job in (job, pending):
+            job.refresh_from_db()
+            self.assertEqual(job.status, DeliveryJobStatus.DONE.value)
+        self.assertEqual([letter['title'] for letter in self.get_sent_letters('1000001')], ['잘 지내?', '새 편지'])
+
+
+class ReservationSchedulerTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='sender@example.com', password='password')
+        self.trainee = Trainee.objects.create(name='김진수', birthday=date(2002, 8, 1), member_seq='1000001')
+        self.today = date.today()
+        # 오늘 0시 1초 전
+        self.clock = FakeClock(get_due_timestamp(self.today) - 1)
+        self.dispatched = []
+        self.scheduler = ReservationScheduler(self.dispatched.extend, refresh_interval=5.0, retry_delay=60.0,
+                                              clock=self.clock)
+
+    def create_letter(self, sent_date: date, status: LetterStatus = LetterStatus.RESERVED) -> Letter:
+        return Letter.objects.create(sender=self.user, receiver=self.trainee, title='title', contents='contents',
+                                     password='1234', status=status.value, sent_date=sent_date)
+
+    def test_pops_letters_when_due(self):
+        tomorrow = self.create_letter(self.today + timedelta(days=1))
+        today = self.create_letter(self.today)
+        self.create_letter(self.today, status=LetterStatus.EDITING)
+
+        self.assertEqual(self.scheduler.refresh(), 2)
+        self.assertEqual(len(self.scheduler), 2)
+        self.assertEqual(self.scheduler.pop_due(), [])
+        self.assertEqual(self.scheduler.get_timeout(), 1)
+
+        self.clock.advance(1)
+        self.assertEqual(self.scheduler.pop_due(), [today.id])
+        self.clock.advance(24 * 60 * 60)
+        self.assertEqual(self.scheduler.pop_due(), [tomorrow.id])
+        self.assertEqual(self.scheduler.pop_due(), [])
+
+    def test_refresh_picks_up_changes(self):
+        moved = self.create_letter(self.today)
+        cancelled = self.create_letter(self.today)
+        self.scheduler.refresh()
+
+        moved.sent_date = self.today + timedelta(days=1)
+        moved.save()
+        cancelled.status = LetterStatus.EDITING.value
+        cancelled.save()
+        added = self.create_letter(self.today)
+        self.scheduler.refresh()
+
+        self.clock.advance(1)
+        self.assertEqual(self.scheduler.pop_due(), [added.id])
+        self.clock.advance(24 * 60 * 60)
+        self.assertEqual(self.scheduler.pop_due(), [moved.id])
+
+    def test_failed_letter_is_retried_after_delay(self):
+        letter = self.create_letter(self.today)
+        self.scheduler.refresh()
+        self.clock.advance(1)
+        self.assertEqual(self.scheduler.pop_due(), [letter.id])
+
+        # 전송 중인 편지는 refresh로 다시 들어오지 않는다.
+        letter.save()
+        self.scheduler.refresh()
+        self.assertEqual(len(self.scheduler), 0)
+
+        self.scheduler.complete(letter.id, False)
+        self.clock.advance(59)
+        self.assertEqual(self.scheduler.pop_due(), [])
+        self.clock.advance(1)
+        self.assertEqual(self.scheduler.pop_due(), [letter.id])
+
+        self.scheduler.complete(letter.id, True)
+        self.clock.advance(60)
+        self.assertEqual(self.scheduler.pop_due(), [])
+
+    def test_unschedule(self):
+        letter = self.create_letter(self.today)
+        self.scheduler.refresh()
+        self.scheduler.unschedule(letter.id)
+
+        self.clock.advance(1)
+        self.assertEqual(self.scheduler.pop_due(), [])
+
+    def test_run_dispatches_due_letters(self):
+        letter = self.create_letter(self.today)
+        self.clock.advance(1)
+
+        def dispatch(letter_ids):
+            self.dispatched.extend(letter_ids)
+            self.scheduler.stop()
+
+        self.scheduler.dispatch = dispatch
+        self.scheduler.run()
+        self.assertEqual(self.dispatched, [letter.id])
+
+
+class ReservationSchedulerCommandTest(DeliveryQueueTestMixin, TransactionTestCase):
+    """
+    예약 편지도 전송 작업을 가져온(claim) 뒤에만 보내는지 확인한다.
+    """
+    def setUp(self):
+        super().setUp()
+        self.stdout, self.stderr = io.StringIO(), io.StringIO()
+        self.command = reservationscheduler.Command(stdout=self.stdout, stderr=self.stderr)
+        self.command.enqueue = False
+        self.command.executor = ThreadPoolExecutor(max_workers=2)
+        self.command.scheduler = mock.Mock()
+
+    def dispatch(self, letters: list) -> None:
+        self.command.dispatch([letter.id for letter in letters])
+        self.command.executor.shutdown(wait=True)
+
+    def test_sends_through_delivery_queue(self):
+        letter = self.create_letter()
+
+        self.dispatch([letter])
+
+        self.assertEqual(len(self.get_sent_letters('1000001')), 1)
+        self.assertEqual(DeliveryJob.objects.get(letter=letter).status, DeliveryJobStatus.DONE.value)
+        letter.refresh_from_db()
+        self.assertEqual(letter.status, LetterStatus.SENDING.value)
+        self.command.scheduler.complete.assert_called_once_with(letter.id, True)
+
+    def test_skips_job_claimed_by_other_worker(self):
+        letter = self.create_letter()
+        job = deliveryQueue.enqueue(letter)
+        self.assertTrue(deliveryQueue.claim_job(job, worker_id='deliveryworker'))
+
+        self.dispatch([letter])
+
+        self.assertEqual(self.get_sent_letters('1000001'), [])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (DeliveryJobStatus.RUNNING.value, 'deliveryworker'))
+        self.command.scheduler.complete.assert_called_once_with(letter.id, True)
+
+    def test_failure_is_recorded_on_job(self):
+        letter = self.create_letter()
+
+        with mock.patch.object(self.server.site.config, 'writing_period', False):
+            self.dispatch([letter])
+
+        job = DeliveryJob.objects.get(letter=letter)
+        self.assertIn('LetterWritingPeriodException', job.last_error)
+        self.command.scheduler.complete.assert_called_once_with(letter.id, False)
+        # scheduler가 다시 보낼 때도 작업의 시도 횟수를 이어서 센다.
+        self.command.scheduler.reset_mock()
+        self.command.executor = ThreadPoolExecutor(max_workers=2)
+        self.dispatch([letter])
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(len(self.get_sent_letters('1000001')), 1)
+
+    def test_enqueue_only(self):
+        letter = self.create_letter()
+        self.command.enqueue = True
+
+        self.dispatch([letter])
+
+        self.assertEqual(DeliveryJob.objects.get(letter=letter).status, DeliveryJobStatus.PENDING.value)
+        self.assertEqual(self.get_sent_letters('1000001'), [])
+
+
+class LetterSendViewTest(FakeSiteMixin, TestCase):
+    """
+    항상 202로 작업만 돌려주고, ASGI(AsyncClient)에서는 응답 뒤 background task로 전송하는지 확인한다.
+    """
+    @staticmethod
+    async def wait_background_sends():
+        await asyncio.gather(*views.background_sends)
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='sender@example.com', password='password')
+        self.other = User.objects.create_user(email='other@example.com', password='password')
+        self.headers = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+        trainee = Trainee.objects.create(name='김진수', birthday=date(2002, 8, 1), member_seq='1000001')
+        self.letter = Letter.objects.create(sender=self.user, receiver=trainee, title='title', contents='contents',
+                                            password='1234')
+        self.other_letter = Letter.objects.create(sender=self.other, receiver=trainee, title='title',
+                                                  contents='contents', password='1234')
+
+    def test_wsgi_send_only_enqueues(self):
+        response = self.client.post(f'/letters/{self.letter.id}/send/', headers=self.headers)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(response['Location'].endswith(f'/letters/{self.letter.id}/send/status/'))
+        self.assertEqual(response.json()['status'], DeliveryJobStatus.PENDING.name)
+        self.assertEqual(DeliveryJob.objects.get(letter=self.letter).attempts, 0)
+        self.assertEqual(self.get_sent_letters('1000001'), [])
+
+    async def test_asgi_send_in_background(self):
+        response = await self.async_client.post(f'/letters/{self.letter.id}/send/', headers=self.headers)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(response['Location'].endswith(f'/letters/{self.letter.id}/send/status/'))
+        self.assertEqual(response.json()['status'], DeliveryJobStatus.PENDING.name)
+        await self.wait_background_sends()
+        self.assertEqual(len(self.get_sent_letters('1000001')), 1)
+        response = await self.async_client.get(f'/letters/{self.letter.id}/send/status/', headers=self.headers)
+        self.assertEqual(response.json()['status'], DeliveryJobStatus.DONE.name)
+
+    async def test_asgi_send_skips_claimed_job(self):
+        # deliveryworker가 먼저 가져간 작업은 background task가 다시 보내지 않는다.
+        with mock.patch.object(deliveryQueue, 'claim_job', return_value=False):
+            response = await self.async_client.post(f'/letters/{self.letter.id}/send/', headers=self.headers)
+            await self.wait_background_sends()
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.get_sent_letters('1000001'), [])
+
+    async def test_asgi_resend_after_dead_job(self):
+        # 예전 작업이 남아 있으면 enqueue가 letter를 불러오지 않은 작업을 돌려준다.
+        job = await sync_to_async(deliveryQueue.enqueue)(self.letter)
+        await DeliveryJob.objects.filter(id=job.id).aupdate(status=DeliveryJobStatus.DEAD.value, attempts=3,
+                                                            last_error='ReadTimeout: timed out')
+
+        response = await self.async_client.post(f'/letters/{self.letter.id}/send/', headers=self.headers)
+        await self.wait_background_sends()
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(self.get_sent_letters('1000001')), 1)
+        await job.arefresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.last_error), (DeliveryJobStatus.DONE.value, 1, ''))
+
+    async def test_asgi_resend_does_not_duplicate_delivered_letter(self):
+        job = await sync_to_async(deliveryQueue.enqueue)(self.letter)
+        await DeliveryJob.objects.filter(id=job.id).aupdate(status=DeliveryJobStatus.DEAD.value,
+                                                            last_error='ReadTimeout: timed out')
+        await sync_to_async(DeliveryQueueTestMixin.send_upstream)(
+            await Letter.objects.select_related('receiver').aget(id=self.letter.id))
+
+        response = await self.async_client.post(f'/letters/{self.letter.id}/send/', headers=self.headers)
+        await self.wait_background_sends()
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(self.get_sent_letters('1000001')), 1)
+        await self.letter.arefresh_from_db()
+        self.assertEqual(self.letter.status, LetterStatus.SENDING.value)
+
+    async def test_asgi_send_errors(self):
+        for letter_id in (self.other_letter.id, 0):
+            response = await self.async_client.post(f'/letters/{letter_id}/send/', headers=self.headers)
+            self.assertEqual(response.status_code, 404)
+        response = await self.async_client.post(f'/letters/{self.letter.id}/send/')
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.post(f'/letters/{self.letter.id}/send/',
+                                                headers={'Authorization': 'Token invalid'})
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(await DeliveryJob.objects.aexists())
+
+    async def test_asgi_send_failure_is_queued(self):
+        with mock.patch.object(self.server.site.config, 'error_rate', 1.0):
+            response = await self.async_client.post(f'/letters/{self.letter.id}/send/', headers=self.headers)
+            await self.wait_background_sends()
+
+        self.assertEqual(response.status_code, 202)
+        job = await DeliveryJob.objects.aget(letter=self.letter)
+        self.assertEqual((job.status, job.locked_by), (DeliveryJobStatus.PENDING.value, ''))
+        self.assertTrue(job.last_error)
+
+        response = await self.async_client.get(f'/letters/{self.letter.id}/send/status/', headers=self.headers)
+        self.assertEqual(response.json()['status'], DeliveryJobStatus.PENDING.name)
+        self.assertEqual(response['Retry-After'], str(settings.DELIVERY_JOB_RETRY_AFTER))
+
+    def test_send_other_users_letter(self):
+        for letter_id in (self.other_letter.id, 0):
+            response = self.client.post(f'/letters/{letter_id}/send/', headers=self.headers)
+            self.assertEqual(response.status_code, 404)
+        self.assertFalse(DeliveryJob.objects.exists())
+
+    def test_send_requires_token(self):
+        self.assertEqual(self.client.post(f'/letters/{self.letter.id}/send/').status_code, 401)
+
+    def test_wsgi_status_does_not_wait(self):
+        deliveryQueue.enqueue(self.letter)
+
+        started_at = time.monotonic()
+        response = self.client.get(f'/letters/{self.letter.id}/send/status/?wait=5', headers=self.headers)
+
+        self.assertLess(time.monotonic() - started_at, 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Retry-After'], str(settings.DELIVERY_JOB_RETRY_AFTER))
+
+    @override_settings(DELIVERY_JOB_POLL_INTERVAL=0.05)
+    async def test_asgi_status_waits_for_job(self):
+        job = await sync_to_async(deliveryQueue.enqueue)(self.letter)
+
+        async def complete_later():
+            await asyncio.sleep(0.2)
+            await sync_to_async(deliveryQueue.complete)(job)
+
+        task = asyncio.create_task(complete_later())
+        response = await self.async_client.get(f'/letters/{self.letter.id}/send/status/?wait=5',
+                                               headers=self.headers)
+        await task
+
+        self.assertEqual(response.json()['status'], DeliveryJobStatus.DONE.name)
+        self.assertFalse(response.has_header('Retry-After'))
+
+    def test_status_errors(self):
+        response = self.client.get(f'/letters/{self.letter.id}/send/status/', headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+        deliveryQueue.enqueue(self.other_letter)
+        response = self.client.get(f'/letters/{self.other_letter.id}/send/status/', headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+        deliveryQueue.enqueue(self.letter)
+        response = self.client.get(f'/letters/{self.letter.id}/send/status/?wait=soon', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+
+class ReconcileLettersCommandTest(FakeSiteMixin, TransactionTestCase):
+    fake_server_config = {'encoding': 'cp949', 'letters_per_page': 2}
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='sender@example.com', password='password')
+        self.trainee = Trainee.objects.create(name='김진수', birthday=date(2002, 8, 1), member_seq='1000001')
+
+    def create_letter(self, title: str) -> Letter:
+        return Letter.objects.create(sender=self.user, receiver=self.trainee, title=title, contents='contents',
+                                     senderName='홍길동', password='1234', status=LetterStatus.SENDING.value,
+                                     sent_date=date.today())
+
+    def upload(self, *titles: str) -> None:
+        with self.server.site.lock:
+            self.server.site.letters.setdefault('1000001', []).extend(
+                {'title': title, 'senderName': '홍길동', 'sent_date': '2026-10-01'} for title in titles
+            )
+
+    def call(self) -> str:
+        stdout = io.StringIO()
+        call_command('reconcileletters', stdout=stdout, stderr=io.StringIO())
+        return stdout.getvalue()
+
+    def test_reconcile(self):
+        # 같은 제목이 두 통이면 먼저 보낸 편지부터 짝을 짓는다.
+        first, second, missing = self.create_letter('똠방각하'), self.create_letter('똠방각하'), \
+            self.create_letter('아직 안 올라감')
+        self.upload('다른 사람 편지', '똠방각하', '잘 지내?', '똠방각하', '마지막')
+
+        self.assertIn('received: 2, failed trainees: 0', self.call())
+
+        statuses = [Letter.objects.get(pk=letter.pk).status for letter in (first, second, missing)]
+        self.assertEqual(statuses, [LetterStatus.RECEIVED.value, LetterStatus.RECEIVED.value,
+                                    LetterStatus.SENDING.value])
+        self.assertEqual(LetterListWatermark.objects.get(trainee=self.trainee).last_number, 5)
+        self.assertEqual(self.server.site.request_counts['indexSub.action:getEmailList'], 3)
+
+        # 다음 실행은 watermark 이후 편지만 비교한다.
+        self.upload('아직 안 올라감')
+        self.assertIn('received: 1, failed trainees: 0', self.call())
+        self.assertEqual(Letter.objects.get(pk=missing.pk).status, LetterStatus.RECEIVED.value)
+        self.assertEqual(LetterListWatermark.objects.get(trainee=self.trainee).last_number, 6)
+
+
+class LetterListViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='sender@example.com', password='password')
+        other = User.objects.create_user(email='other@example.com', password='password')
+        cls.kim = Trainee.objects.create(name='김진수', birthday=date(2002, 8, 1), member_seq='1000001')
+        cls.lee = Trainee.objects.create(name='이하늘', birthday=date(2003, 1, 15), member_seq='1000002')
+        cls.letters = [Letter.objects.create(sender=cls.user, receiver=cls.kim if index % 2 else cls.lee,
+                                             title=f'편지 {index}', contents='가' * 300, password='1234')
+                       for index in range(25)]
+        Letter.objects.create(sender=other, receiver=cls.kim, title='다른 사람', contents='contents', password='1234')
+        cls.token = Token.objects.create(user=cls.user)
+
+    def get(self, url: str):
+        return self.client.get(url, headers={'Authorization': f'Token {self.token.key}'})
+
+    def test_default_is_full_list(self):
+        # 기존 client가 읽는 형식(본문을 포함한 배열)은 그대로 둔다.
+        letters = self.get('/letters/').json()
+
+        self.assertEqual(len(letters), len(self.letters))
+        self.assertEqual(set(letters[0]), {'id', 'title', 'contents', 'sender', 'status'})
+        self.assertEqual(letters[0]['contents'], '가' * 300)
+        self.assertEqual(len(self.get(f'/letters/sent/?receiver_id={self.kim.id}').json()), 12)
+
+    def test_cursor_pagination(self):
+        first_page = self.get('/letters/?view=summary').json()
+        self.assertIsNone(first_page['previous'])
+        self.assertEqual(len(first_page['results']), settings.LETTER_LIST_PAGE_SIZE)
+
+        second_page = self.get(first_page['next']).json()
+        self.assertIsNone(second_page['next'])
+
+        ids = [letter['id'] for letter in first_page['results'] + second_page['results']]
+        self.assertEqual(ids, [letter.id for letter in reversed(self.letters)])
+
+    def test_preview_instead_of_contents(self):
+        letter = self.get('/letters/?view=summary&page_size=1').json()['results'][0]
+
+        self.assertEqual(set(letter), {'id', 'title', 'preview', 'sender', 'receiver', 'status', 'sent_date'})
+        self.assertEqual(letter['preview'], '가' * settings.LETTER_PREVIEW_LENGTH)
+
+    def test_page_size(self):
+        self.assertEqual(len(self.get('/letters/?view=summary&page_size=5').json()['results']), 5)
+        with mock.patch.object(LetterCursorPagination, 'max_page_size', 10):
+            self.assertEqual(len(self.get('/letters/?view=summary&page_size=1000').json()['results']), 10)
+
+    def test_sent_filtered_by_receiver(self):
+        results = self.get(f'/letters/sent/?view=summary&receiver_id={self.kim.id}&page_size=100').json()['results']
+
+        self.assertEqual([letter['id'] for letter in results],
+                         [letter.id for letter in reversed(self.letters) if letter.receiver_id == self.kim.id])
+
+    def test_stream(self):
+        response = self.get('/letters/?view=summary&stream=true')
+
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.is_async)
+        letters = loads(b''.join(response.streaming_content))
+        self.assertEqual([letter['id'] for letter in letters], [letter.id for letter in reversed(self.letters)])
+        self.assertEqual(letters[0]['preview'], '가' * settings.LETTER_PREVIEW_LENGTH)
+
+    @mock.patch.object(settings, 'LETTER_LIST_STREAM_CHUNK_SIZE', 10)
+    async def test_async_stream(self):
+        response = await self.async_client.get('/letters/?view=summary&stream=true',
+                                               headers={'Authorization': f'Token {self.token.key}'})
+
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        # 여는 괄호, 10개씩 3 chunk, 닫는 괄호
+        self.assertEqual(len(chunks), 5)
+        letters = loads(b''.join(chunks))
+        self.assertEqual([letter['id'] for letter in letters], [letter.id for letter in reversed(self.letters)])
+
+    async def test_async_stream_brotli(self):
+        response = await self.async_client.get('/letters/?view=summary&stream=true', headers={
+            'Authorization': f'Token {self.token.key}', 'Accept-Encoding': 'gzip, br',
+        })
+
+        self.assertEqual(response['Content-Encoding'], 'br')
+        content = brotli.decompress(b''.join([chunk async for chunk in response.streaming_content]))
+        self.assertEqual(len(loads(content)), len(self.letters))
+
+    def test_default_stream(self):
+        letters = loads(b''.join(self.get('/letters/?stream=true').streaming_content))
+
+        self.assertEqual([letter['id'] for letter in letters], [letter.id for letter in reversed(self.letters)])
+        self.assertEqual(letters[0]['contents'], '가' * 300)
+
+    def test_query_count_is_constant(self):
+        # 인증(token cache)을 먼저 채워 두고, 페이지마다 목록 query 하나만 나가는지 확인한다.
+        self.get('/letters/?view=summary&page_size=1')
+        for page_size in (1, 20):
+            with self.assertNumQueries(1):
+                self.get(f'/letters/?view=summary&page_size={page_size}')
+
+
+class LetterNotRecordedTest(DeliveryQueueTestMixin, TestCase):
+    """
+    전송은 됐지만 DB에 기록하지 못한 편지를 다시 보내지 않는지 확인한다.
+    """
+    def patch_mark_sent(self, *failing_titles: str, failures: int = 2):
+        mark_sent = LetterService.mark_sent
+        calls = Counter()
+
+        def fail_mark_sent(letter):
+            calls[letter.id] += 1
+            if letter.title in failing_titles and calls[letter.id] <= failures:
+                raise DatabaseError('connection lost')
+            return mark_sent(letter)
+
+        return mock.patch.object(LetterService, 'mark_sent', side_effect=fail_mark_sent)
+
+    def test_record_sent_retries_once(self):
+        letter = self.create_letter('실패')
+        with self.patch_mark_sent('실패', failures=1):
+            letterService.record_sent(letter)
+        self.assertEqual(Letter.objects.get(pk=letter.pk).status, LetterStatus.SENDING.value)
+
+        with self.patch_mark_sent('실패'), self.assertRaises(LetterNotRecordedError):
+            letterService.record_sent(self.create_letter('실패'))
+
+    def test_send_letters_reports_per_letter(self):
+        letters = [self.create_letter('첫 번째'), self.create_letter('실패'), self.create_letter('세 번째')]
+        with self.patch_mark_sent('실패'):
+            results = letterService.send_letters(letters)
+
+        self.assertIsNone(results[0][1])
+        self.assertIsInstance(results[1][1], LetterNotRecordedError)
+        self.assertIsNone(results[2][1])
+        self.assertEqual(len(self.get_sent_letters('1000001')), 3)
+
+    def test_process_batch_does_not_resend(self):
+        jobs = [deliveryQueue.enqueue(self.create_letter(title)) for title in ('첫 번째', '실패', '세 번째')]
+        claimed = deliveryQueue.claim(batch_size=10)
+        with self.patch_mark_sent('실패'):
+            self.assertEqual(deliveryQueue.process_batch(claimed), [True, False, True])
+
+        statuses = [DeliveryJob.objects.get(pk=job.pk).status for job in jobs]
+        self.assertEqual(statuses, [DeliveryJobStatus.DONE.value, DeliveryJobStatus.DEAD.value,
+                                    DeliveryJobStatus.DONE.value])
+        self.assertIn('LetterNotRecordedError', DeliveryJob.objects.get(pk=jobs[1].pk).last_error)
+        self.assertEqual(deliveryQueue.claim(batch_size=10), [])
+        self.assertEqual(len(self.get_sent_letters('1000001')), 3)
+
+    def test_process_does_not_resend(self):
+        job = deliveryQueue.enqueue(self.create_letter('실패'))
+        [job] = deliveryQueue.claim()
+        with self.patch_mark_sent('실패'):
+            self.assertFalse(deliveryQueue.process(job))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, DeliveryJobStatus.DEAD.value)
+        self.assertEqual(len(self.get_sent_letters('1000001')), 1)
+
+
+class LetterBroadcastTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='sender@example.com', password='password', name='홍길동')
+        cls.trainees = [Trainee.objects.create(name=f'훈련병{index}', birthday=date(2002, 8, 1),
+                                               member_seq=str(1000001 + index)) for index in range(3)]
+        for trainee in cls.trainees[:2]:
+            TraineeToUser.objects.create(user=cls.user, trainee=trainee, relationship='가족')
+        cls.token = Token.objects.create(user=cls.user)
+
+    def broadcast(self, **data):
+        # 빈 문자열인 보내는 사람 정보와 관계는 사용자 정보와 TraineeToUser로 채운다.
+        data = {'title': '잘 지내?', 'contents': '건강하게 수료하자!', 'password': '1234', 'senderName': '',
+                'relationship': '', **data}
+        return self.client.post('/letters/broadcast/', data, content_type='application/json',
+                                headers={'Authorization': f'Token {self.token.key}'})
+
+    def test_creates_one_letter_per_receiver(self):
+        receivers = [trainee.id for trainee in self.trainees[:2]]
+        response = self.broadcast(receivers=receivers + receivers[:1])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([letter['receiver'] for letter in response.json()], receivers)
+        letters = Letter.objects.filter(sender=self.user).order_by('id')
+        self.assertEqual([letter.receiver_id for letter in letters], receivers)
+        self.assertTrue(all(letter.relationship == '가족' and letter.senderName == '홍길동' for letter in letters))
+        self.assertFalse(DeliveryJob.objects.exists())
+
+    def test_send_now_enqueues(self):
+        response = self.broadcast(receivers=[trainee.id for trainee in self.trainees[:2]], send_now=True)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(DeliveryJob.objects.filter(status=DeliveryJobStatus.PENDING.value).count(), 2)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.broadcast(receivers=[trainee.id for trainee in self.trainees]).status_code, 400)
+        self.assertEqual(self.broadcast(receivers=[]).status_code, 400)
+        reserved = {'status': LetterStatus.RESERVED.value, 'sent_date': str(date.today() + timedelta(days=1))}
+        self.assertEqual(self.broadcast(receivers=[self.trainees[0].id], send_now=True, **reserved).status_code,
+                         400)
+        self.assertEqual(self.broadcast(receivers=[self.trainees[0].id], status=LetterStatus.RESERVED.value,
+                                        sent_date=str(date.today())).status_code, 400)
+        self.assertFalse(Letter.objects.exists())
+
+
+class MergeDuplicateTraineesMigrationTest(TransactionTestCase):
+    """
+    api/migrations/0007_merge_duplicate_trainees.py
+    """
+    migrate_from = [('api', '0006_letterlistwatermark')]
+    migrate_to = [('api', '0007_merge_duplicate_trainees')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+        super().tearDown()
+
+    def test_merge(self):
+        apps = self.migrate(self.migrate_from)
+        OldTrainee = apps.get_model('api', 'Trainee')
+        OldUser = apps.get_model('api', 'User')
+        OldLetter = apps.get_model('api', 'Letter')
+        OldTraineeToUser = apps.get_model('api', 'TraineeToUser')
+
+        identity = {'name': '김진수', 'birthday': date(2002, 8, 1), 'member_seq': '1000001', 'agency_id': 0}
+        keep, first_duplicate, second_duplicate = [OldTrainee.objects.create(**identity) for _ in range(3)]
+        sender = OldUser.objects.create(email='sender@example.com', username='sender')
+        # 중복 행마다 훈련병 계정이 하나씩 연결되어 있다. 남길 행(keep)에는 연결된 계정이 없다.
+        trainee_users = [OldUser.objects.create(email=f'trainee{index}@example.com', username=f'trainee{index}',
+                                                is_trainee=True, as_trainee=trainee)
+                         for index, trainee in enumerate([second_duplicate, first_duplicate])]
+        OldTraineeToUser.objects.create(user=sender, trainee=keep, relationship='가족')
+        OldTraineeToUser.objects.create(user=sender, trainee=first_duplicate, relationship='친구/지인')
+        letter = OldLetter.objects.create(sender=sender, receiver=second_duplicate, title='title',
+                                          contents='contents', password='1234')
+
+        apps = self.migrate(self.migrate_to)
+        NewTrainee = apps.get_model('api', 'Trainee')
+        NewUser = apps.get_model('api', 'User')
+
+        self.assertEqual(list(NewTrainee.objects.values_list('id', flat=True)), [keep.id])
+        self.assertEqual(apps.get_model('api', 'Letter').objects.get(id=letter.id).receiver_id, keep.id)
+        self.assertEqual(list(apps.get_model('api', 'TraineeToUser').objects.values_list('trainee_id', 'relationship')),
+                         [(keep.id, '가족')])
+        # 남길 행에 연결된 계정이 없으면 id가 가장 작은 계정을 남긴다.
+        kept_user, detached_user = [NewUser.objects.get(id=user.id) for user in trainee_users]
+        self.assertEqual((kept_user.as_trainee_id, kept_user.is_trainee), (keep.id, True))
+        self.assertEqual((detached_user.as_trainee_id, detached_user.is_trainee), (None, False))
+
+
+class FastJSONTest(SimpleTestCase):
+    def test_dumps_utf8_without_escape(self):
+        data = {'title': '잘 지내?', 'sent_date': date(2026, 10, 18), 1: None}
+
+        content = dumps(data)
+        self.assertIn('잘 지내?'.encode('utf-8'), content)
+        self.assertEqual(loads(content), {'title': '잘 지내?', 'sent_date': '2026-10-18', '1': None})
+
+    def test_renderer(self):
+        renderer = FastJSONRenderer()
+        self.assertEqual(renderer.render(None), b'')
+        self.assertEqual(renderer.render({'title': '편지'}), '{"title":"편지"}'.encode('utf-8'))
+        # browsable API처럼 indent를 요청하면 기본 renderer를 사용한다.
+        self.assertIn(b'\n', renderer.render({'title': '편지'}, 'application/json; indent=2'))
+
+    def test_parser(self):
+        parser = FastJSONParser()
+        self.assertEqual(parser.parse(io.BytesIO('{"title": "편지"}'.encode('utf-8'))), {'title': '편지'})
+        self.assertEqual(parser.parse(io.BytesIO('{"title": "편지"}'.encode('cp949')),
+                                      parser_context={'encoding': 'cp949'}), {'title': '편지'})
+        with self.assertRaises(ParseError):
+            parser.parse(io.BytesIO(b'{'))
+
+    def test_stream_json_list(self):
+        class NumberSerializer(serializers.Serializer):
+            number = serializers.IntegerField()
+
+        items = [{'number': number} for number in range(5)]
+        self.assertEqual(b''.join(stream_json_list(items, NumberSerializer, chunk_size=2)),
+                         dumps(items))
+        self.assertEqual(b''.join(stream_json_list([], NumberSerializer)), b'[]')
+
+        async def aiter(values):
+            for value in values:
+                yield value
+
+        async def collect(values):
+            return b''.join([chunk async for chunk in astream_json_list(aiter(values), NumberSerializer,
+                                                                        chunk_size=2)])
+
+        self.assertEqual(asyncio.run(collect(items)), dumps(items))
+        self.assertEqual(asyncio.run(collect([])), b'[]')
+
+
+class CompressionMiddlewareTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(email='sender@example.com', password='password')
+        trainee = Trainee.objects.create(name='김진수', birthday=date(2002, 8, 1), member_seq='1000001')
+        Letter.objects.bulk_create([Letter(sender=user, receiver=trainee, title=f'편지 {index}',
+                                           contents='건강하게 수료하자! ' * 20, password='1234')
+                                    for index in range(20)])
+        cls.token = Token.objects.create(user=user)
+
+    def get(self, url: str = '/letters/', accept_encoding: str = 'gzip, deflate, br', **kwargs):
+        return self.client.get(url, headers={'Authorization': f'Token {self.token.key}',
+                                             'Accept-Encoding': accept_encoding}, **kwargs)
+
+    def test_brotli(self):
+        response = self.get()
+
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(len(loads(brotli.decompress(response.content))), 20)
+
+    def test_gzip_only_client(self):
+        response = self.get(accept_encoding='gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(loads(gzip.decompress(response.content))), 20)
+
+    def test_cookie_requests_use_gzip(self):
+        # session/CSRF cookie가 있는 요청은 Heal-The-BREACH가 적용되는 gzip으로 압축한다.
+        for cookie in (settings.SESSION_COOKIE_NAME, settings.CSRF_COOKIE_NAME):
+            self.client.cookies.clear()
+            self.client.cookies[cookie] = 'x' * 32
+            response = self.get()
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_streaming_brotli(self):
+        response = self.get('/letters/?stream=true')
+
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(len(loads(brotli.decompress(b''.join(response.streaming_content)))), 20)
+
+
+class CrawlerMetricsTest(FakeSiteMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(email='admin@example.com', password='password')
+        cls.user = User.objects.create_user(email='user@example.com', password='password')
+
+    def get_metrics(self, user: User):
+        token = Token.objects.create(user=user)
+        return self.client.get('/metrics/crawler/', HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_search_is_exported(self):
+        trainee = rokaf_crawler.models.Trainee(name='김진수', birthday='20020801')
+        rokaf_crawler.crawlers.TraineeSearcher(trainee).search_trainee()
+
+        response = self.get_metrics(self.admin)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], rokaf_crawler.instrumentation.PrometheusSink.CONTENT_TYPE)
+        content = response.content.decode()
+        self.assertIn('# TYPE rokaf_crawler_step_duration_seconds histogram', content)
+        self.assertIn('step="search_fetch"', content)
+
+    def test_admin_only(self):
+        self.assertEqual(self.get_metrics(self.user).status_code, 403)
+
+
+class InstrumentationTest(SimpleTestCase):
+    def test_logging_levels(self):
+        # 기본 sink의 log와 섞이지 않도록 따로 logger를 준다.
+        logger_name = f'{__name__}.crawler'
+        sink = rokaf_crawler.instrumentation.LoggingSink(logging.getLogger(logger_name), level=logging.DEBUG)
+
+        def measure(exception):
+            with self.assertRaises(type(exception)):
+                with rokaf_crawler.instrumentation.measure(rokaf_crawler.instrumentation.SEARCH_FETCH, 'last2') \
+                        as event:
+                    raise exception
+            return event
+
+        with self.assertLogs(logger_name, level=logging.DEBUG) as logs:
+            # 훈련병이 없거나 작성 기간이 아닌 경우는 정상 결과이므로 설정한 level로 남긴다.
+            sink.emit(measure(TraineeNotFoundException()))
+            sink.emit(measure(LetterWritingPeriodException()))
+            sink.emit(measure(WrongAccessException()))
+        self.assertEqual([record.levelno for record in logs.records],
+                         [logging.DEBUG, logging.DEBUG, logging.WARNING])
+        self.assertIn('outcome=TraineeNotFoundException', logs.output[0])
+
+    def test_incomplete_sink(self):
+        class NoopSink(rokaf_crawler.instrumentation.Sink):
+            pass
+
+        with self.assertRaises(TypeError):
+            NoopSink()
+
+
+@skipUnless(connection.vendor in ('postgresql', 'sqlite'), 'EXPLAIN 출력 형식을 아는 DB에서만 확인한다.')
+class HotQueryPlanTest(TestCase):
+    """
+    자주 쓰는 조회가 index를 타는지 확인한다. (api/migrations/0008_hot_query_indexes.py)
+    테이블이 작으면 planner가 sequential scan을 고를 수 있으므로 PostgreSQL에서는 enable_seqscan을 끄고,
+    그래도 sequential scan이 남아 있으면 사용할 index가 없는 것으로 본다.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='sender@example.com', password='password')
+        cls.trainee = Trainee.objects.create(name='홍길동', birthday=date(2002, 8, 1), member_seq='1000')
+        TraineeToUser.objects.create(user=cls.user, trainee=cls.trainee)
+        Letter.objects.create(sender=cls.user, receiver=cls.trainee, title='title', contents='contents',
+                              password='1234')
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+    def assertNoSeqScan(self, queryset):
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            self.assertNotIn('Seq Scan', plan)
+        elif connection.vendor == 'sqlite':
+            # SQLite는 index를 쓰면 SEARCH, 테이블(또는 index) 전체를 읽으면 SCAN으로 표시한다.
+            self.assertFalse([line for line in plan.splitlines() if ' SCAN ' in f' {line} '], plan)
+
+    def test_letters_by_sender_and_receiver(self):
+        self.assertNoSeqScan(Letter.objects.filter(sender=self.user, receiver=self.trainee))
+
+    def test_letters_by_receiver_and_status(self):
+        self.assertNoSeqScan(Letter.objects.filter(receiver=self.trainee, status=LetterStatus.SENDING.value))
+
+    def test_due_reserved_letters(self):
+        self.assertNoSeqScan(Letter.objects.filter(status=LetterStatus.RESERVED.value, sent_date__lte=date.today()))
+
+    def test_trainee_to_user_lookup(self):
+        self.assertNoSeqScan(TraineeToUser.objects.filter(user=self.user, trainee=self.trainee))
+
+    def test_trainee_identity_lookup(self):
+        self.assertNoSeqScan(Trainee.objects.filter(name='홍길동', birthday=date(2002, 8, 1), member_seq='1000',
+                                                    agency_id=AgencyIndex.기본군사훈련단.value))
+
+
+class FakeCompletionMixin:
+    """
+    api.fake_completion_server를 띄우고 OpenAI client가 그 주소로 요청하도록 바꾼다.
+    OPENAI_API_KEY가 없는 환경에서도 client를 만들 수 있도록 임시 key를 넣는다.
+    테스트마다 응답 캐시와 요청 수를 비운다.
+    """
+    fake_completion_config = {}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.completion_server = FakeCompletionServer(FakeCompletionConfig(
+            port=0, first_token_latency=0, token_latency=0, **cls.fake_completion_config)).start()
+        cls.addClassCleanup(cls.completion_server.stop)
+        cls.enterClassContext(override_settings(OPENAI_API_KEY='test-key', OPENAI_BASE_URL=cls.completion_server.url))
+
+    def setUp(self):
+        super().setUp()
+        # 만들어 둔 client는 이전 설정(key, 주소)을 쓰므로 fake 서버 설정으로 새로 만들게 한다.
+        for patcher in (mock.patch.object(gpt, '_client', None),
+                        mock.patch.object(gpt, '_async_clients', weakref.WeakKeyDictionary())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        gpt.draft_cache.clear()
+        with self.completion_server.lock:
+            self.completion_server.request_count = 0
+
+    @property
+    def completion_request_count(self) -> int:
+        with self.completion_server.lock:
+            return self.completion_server.request_count
+
+
+def get_events(content: bytes) -> list:
+    """
+    server-sent events 응답을 [(event, data), ...]로 나눈다. event가 없으면 None
+    """
+    events = []
+    for block in content.decode('utf-8').split('\n\n'):
+        if not block:
+            continue
+        event = None
+        for line in block.split('\n'):
+            field, _, value = line.partition(': ')
+            if field == 'event':
+                event = value
+            elif field == 'data':
+                events.append((event, loads(value)))
+    return events
+
+
+class DraftCacheTest(SimpleTestCase):
+    def test_key_normalizes_whitespace(self):
+        key = gpt.DraftCache.get_key('gpt-3.5-turbo', '인편지기', '편지를 적어줘!')
+
+        self.assertEqual(gpt.DraftCache.get_key('gpt-3.5-turbo', ' 인편지기\n', '편지를  적어줘!'), key)
+        self.assertNotEqual(gpt.DraftCache.get_key('gpt-4', '인편지기', '편지를 적어줘!'), key)
+        self.assertNotEqual(gpt.DraftCache.get_key('gpt-3.5-turbo', '인편지기', '편지를적어줘!'), key)
+
+    def test_variants(self):
+        cache = gpt.DraftCache(variants=2)
+
+        cache.add_drafts('key', ['첫 번째'])
+        # variant가 다 모이기 전에는 캐시된 응답을 쓰지 않는다.
+        self.assertIsNone(cache.get_draft('key'))
+        cache.add_drafts('key', ['두 번째', '세 번째'])
+        self.assertEqual(cache.get('key'), ['첫 번째', '두 번째'])
+        self.assertIn(cache.get_draft('key'), ['첫 번째', '두 번째'])
+
+    def test_ttl_and_lru(self):
+        clock = FakeClock()
+        cache = gpt.DraftCache(maxsize=2, ttl=60, clock=clock)
+
+        cache.add_drafts('a', ['가'])
+        cache.add_drafts('b', ['나'])
+        cache.get_draft('a')
+        cache.add_drafts('c', ['다'])
+        self.assertIsNone(cache.get_draft('b'))
+        self.assertEqual(cache.get_draft('a'), '가')
+
+        clock.advance(61)
+        self.assertIsNone(cache.get_draft('a'))
+        # 만료된 variant는 새 응답과 합치지 않는다.
+        cache.add_drafts('a', ['라'])
+        self.assertEqual(cache.get('a'), ['라'])
+
+    def test_configure(self):
+        cache = gpt.DraftCache()
+        cache.add_drafts('a', ['가'])
+
+        cache.configure(maxsize=10, ttl=30, variants=3)
+        self.assertEqual((cache.maxsize, cache.ttl, cache.variants), (10, 30, 3))
+        self.assertEqual(len(cache), 0)
+
+
+class SingleFlightTest(SimpleTestCase):
+    def run_concurrently(self, single_flight, fn, count: int = 5) -> list:
+        results = [None] * count
+
+        def run(index):
+            try:
+                results[index] = single_flight.do('key', fn)
+            except Exception as e:
+                results[index] = e
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_calls_share_one_call(self):
+        single_flight = gpt.SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def fn():
+            calls.append(1)
+            release.wait(5)
+            return '초안'
+
+        # 먼저 들어온 호출이 끝나기 전에 나머지 호출이 모두 들어오도록 조금 기다렸다가 풀어준다.
+        threading.Timer(0.2, release.set).start()
+        self.assertEqual(self.run_concurrently(single_flight, fn), ['초안'] * 5)
+        self.assertEqual(len(calls), 1)
+        # 끝난 호출은 남겨 두지 않는다.
+        self.assertEqual(single_flight.do('key', lambda: '새 초안'), '새 초안')
+
+    def test_exception_is_shared(self):
+        single_flight = gpt.SingleFlight()
+        release = threading.Event()
+
+        def fn():
+            release.wait(5)
+            raise ValueError('실패')
+
+        threading.Timer(0.2, release.set).start()
+        results = self.run_concurrently(single_flight, fn)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertEqual(single_flight.do('key', lambda: '재시도'), '재시도')
+
+
+class AsyncSingleFlightTest(SimpleTestCase):
+    async def test_async_calls_share_one_call(self):
+        single_flight = gpt.SingleFlight()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return '초안'
+
+        results = await asyncio.gather(*(single_flight.ado('key', fn) for _ in range(5)))
+        self.assertEqual(results, ['초안'] * 5)
+        self.assertEqual(len(calls), 1)
+
+    async def test_sync_and_async_calls_share_key(self):
+        single_flight = gpt.SingleFlight()
+        release = threading.Event()
+
+        def fn():
+            release.wait(5)
+            return '초안'
+
+        # 다른 thread의 sync 호출이 먼저 들어가 있으면 async 호출은 그 결과를 기다린다.
+        leader = asyncio.get_running_loop().run_in_executor(None, single_flight.do, 'key', fn)
+        while not single_flight._calls:
+            await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(single_flight.ado('key', mock.AsyncMock(return_value='다른 초안')))
+        await asyncio.sleep(0.05)
+        release.set()
+
+        self.assertEqual(await asyncio.gather(leader, follower), ['초안', '초안'])
+
+
+class GptTestViewTest(FakeCompletionMixin, SimpleTestCase):
+    def post(self, data: dict = None):
+        return self.client.post('/gpt/test/', data or {}, content_type='application/json')
+
+    def test_variants_are_requested_at_once(self):
+        with mock.patch.object(gpt.draft_cache, 'variants', 3):
+            response = self.post()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), {'content': DEFAULT_CONTENT})
+            # 첫 요청에서 n=3으로 variant를 모두 받아 두므로 이후에는 upstream에 요청하지 않는다.
+            for _ in range(3):
+                self.assertEqual(self.post().json(), {'content': DEFAULT_CONTENT})
+        self.assertEqual(self.completion_request_count, 1)
+
+    def test_concurrent_identical_prompts(self):
+        responses = []
+
+        def post():
+            responses.append(self.post({'role': '인편지기', 'query_text': '편지를 적어줘!'}))
+
+        with mock.patch.object(self.completion_server.config, 'first_token_latency', 0.3):
+            threads = [threading.Thread(target=post) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual([response.status_code for response in responses], [200] * 5)
+        self.assertEqual(self.completion_request_count, 1)
+
+    async def test_concurrent_async_prompts(self):
+        async def post():
+            return await self.async_client.post('/gpt/test/', {'role': '인편지기', 'query_text': '편지를 적어줘!'},
+                                                content_type='application/json')
+
+        with mock.patch.object(self.completion_server.config, 'first_token_latency', 0.3):
+            responses = await asyncio.gather(*(post() for _ in range(5)))
+
+        self.assertEqual([response.json() for response in responses], [{'content': DEFAULT_CONTENT}] * 5)
+        self.assertEqual(self.completion_request_count, 1)
+
+    def test_bad_request(self):
+        self.assertEqual(self.post({'role': ''}).status_code, 400)
+        self.assertEqual(self.completion_request_count, 0)
+
+    def test_different_prompts(self):
+        self.post({'query_text': '첫 번째 편지'})
+        self.post({'query_text': '두 번째 편지'})
+        self.assertEqual(self.completion_request_count, 2)
+
+
+class GptBatchDraftViewTest(FakeCompletionMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='sender@example.com', password='password', name='홍길동')
+        cls.trainees = [Trainee.objects.create(name=f'훈련병{index}', birthday=date(2002, 8, 1),
+                                               member_seq=str(1000001 + index)) for index in range(3)]
+        TraineeToUser.objects.create(user=cls.user, trainee=cls.trainees[0], relationship='가족')
+        TraineeToUser.objects.create(user=cls.user, trainee=cls.trainees[1], relationship='')
+        cls.token = Token.objects.create(user=cls.user)
+
+    def post(self, **data):
+        return self.client.post('/gpt/draft/batch/', data, content_type='application/json',
+                                headers={'Authorization': f'Token {self.token.key}'})
+
+    def test_drafts_for_like_trainees(self):
+        with mock.patch.object(gpt, 'create_drafts', wraps=gpt.create_drafts) as create_drafts:
+            response = self.post(query_text='편지를 적어줘!')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{'receiver': trainee.id, 'content': DEFAULT_CONTENT}
+                                           for trainee in self.trainees[:2]])
+        self.assertEqual(self.completion_request_count, 2)
+        # 훈련병 이름과 관계로 prompt를 바꾼다. 관계가 비어 있으면 친구/지인으로 쓴다.
+        queries = create_drafts.call_args.args[1]
+        self.assertEqual(queries, [gpt.get_personalized_query('편지를 적어줘!', '훈련병0', '가족'),
+                                   gpt.get_personalized_query('편지를 적어줘!', '훈련병1', '')])
+        self.assertIn('훈련병0 훈련병', queries[0])
+        self.assertIn('친구/지인', queries[1])
+        self.assertFalse(Letter.objects.exists())
+
+    def test_save(self):
+        response = self.post(receivers=[self.trainees[1].id], save=True, password='1234')
+
+        self.assertEqual(response.status_code, 201)
+        letter = Letter.objects.get(id=response.json()[0]['letter'])
+        self.assertEqual(letter.receiver_id, self.trainees[1].id)
+        self.assertEqual(letter.status, LetterStatus.EDITING.value)
+        self.assertEqual(letter.title, '훈련병1 훈련병에게')
+        self.assertEqual((letter.senderName, letter.relationship), ('홍길동', '친구/지인'))
+        self.assertEqual(letter.contents, DEFAULT_CONTENT)
+
+    async def test_async_save(self):
+        response = await self.async_client.post('/gpt/draft/batch/', {'save': True, 'password': '1234'},
+                                                content_type='application/json',
+                                                headers={'Authorization': f'Token {self.token.key}'})
+
+        self.assertEqual(response.status_code, 201)
+        letter_ids = [item['letter'] for item in response.json()]
+        self.assertEqual(await Letter.objects.filter(id__in=letter_ids, status=LetterStatus.EDITING.value).acount(),
+                         2)
+
+    def test_errors_are_reported_per_receiver(self):
+        with mock.patch.object(self.completion_server.config, 'error_rate', 1.0):
+            response = self.post(save=True, password='1234')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([set(item) for item in response.json()], [{'receiver', 'error'}] * 2)
+        self.assertFalse(Letter.objects.exists())
+
+    def test_invalid_requests(self):
+        # 내가 추가하지 않은 훈련병
+        self.assertEqual(self.post(receivers=[self.trainees[0].id, self.trainees[2].id]).status_code, 400)
+        self.assertEqual(self.post(save=True).status_code, 400)
+        self.assertEqual(self.client.post('/gpt/draft/batch/', {}, content_type='application/json').status_code,
+                         401)
+        self.assertEqual(self.completion_request_count, 0)
+
+
+class DraftRateLimitTest(SimpleTestCase):
+    @staticmethod
+    def get_rate_limit_error(retry_after: str = None):
+        from openai import RateLimitError
+
+        headers = {'retry-after': retry_after} if retry_after is not None else {}
+        response = httpx.Response(429, headers=headers, request=httpx.Request('POST', 'http://testserver/v1'))
+        return RateLimitError('rate limited', response=response, body=None)
+
+    def test_retry_after(self):
+        self.assertEqual(gpt.get_retry_after(self.get_rate_limit_error('3'), 0), 3.0)
+        self.assertEqual(gpt.get_retry_after(self.get_rate_limit_error('3600'), 0), gpt.RATE_LIMIT_BACKOFF_MAX)
+        # Retry-After가 없으면 지수 backoff
+        self.assertEqual(gpt.get_retry_after(self.get_rate_limit_error(), 2), gpt.RATE_LIMIT_BACKOFF_BASE * 4)
+
+    def test_pause(self):
+        clock = FakeClock()
+        limiter = gpt.DraftRateLimiter(rate=10, burst=1, clock=clock)
+
+        limiter.pause(5)
+        limiter.pause(1)
+        # 더 짧은 pause가 앞선 pause를 줄이지 않는다.
+        self.assertEqual(limiter.resume_at, clock() + 5)
+
+    def test_create_draft_retries_rate_limit(self):
+        completion = mock.Mock(choices=[mock.Mock(message=mock.Mock(content='초안'))])
+        client = mock.Mock()
+        client.chat.completions.create = mock.AsyncMock(side_effect=[self.get_rate_limit_error('0'), completion])
+        limiter = gpt.DraftRateLimiter(rate=1000, burst=10)
+
+        self.assertEqual(asyncio.run(gpt.create_draft(client, limiter, 'role', 'query', max_retries=1)), '초안')
+        self.assertEqual(client.chat.completions.create.await_count, 2)
+
+        client.chat.completions.create = mock.AsyncMock(side_effect=self.get_rate_limit_error('0'))
+        with self.assertRaises(type(self.get_rate_limit_error())):
+            asyncio.run(gpt.create_draft(client, limiter, 'role', 'query', max_retries=0))
+
+
+class GptDraftStreamViewTest(FakeCompletionMixin, SimpleTestCase):
+    async def stream(self, data: dict = None):
+        response = await self.async_client.post('/gpt/draft/stream/', data or {}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return get_events(b''.join([chunk async for chunk in response.streaming_content]))
+
+    async def test_stream(self):
+        events = await self.stream()
+
+        self.assertEqual(events[-1], ('done', {}))
+        contents = [data['content'] for event, data in events[:-1]]
+        # token 단위로 나누어 보낸다.
+        self.assertEqual(len(contents), len(split_tokens(DEFAULT_CONTENT)))
+        self.assertEqual(''.join(contents), DEFAULT_CONTENT)
+        self.assertEqual(self.completion_request_count, 1)
+
+    async def test_cached_replay(self):
+        role, query_text = '인편지기', '편지를 적어줘!'
+        with mock.patch.object(gpt.draft_cache, 'variants', 1):
+            await self.stream({'role': role, 'query_text': query_text})
+            # 공백만 다른 prompt도 같은 응답을 재사용한다.
+            events = await self.stream({'role': f' {role} ', 'query_text': query_text.replace(' ', '  ')})
+
+        self.assertEqual(events, [(None, {'content': DEFAULT_CONTENT}), ('done', {})])
+        self.assertEqual(self.completion_request_count, 1)
+
+    async def test_variants_are_collected_before_replay(self):
+        with mock.patch.object(gpt.draft_cache, 'variants', 2):
+            for _ in range(3):
+                await self.stream()
+
+        # variant 2개가 모일 때까지는 upstream에 요청한다.
+        self.assertEqual(self.completion_request_count, 2)
+
+    async def test_error_event(self):
+        with mock.patch.object(self.completion_server.config, 'error_rate', 1.0):
+            events = await self.stream()
+
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0][0], 'error')
+        self.assertIn('error', events[0][1])
+        # 실패한 응답은 캐시하지 않는다.
+        self.assertEqual(len(gpt.draft_cache), 0)
+
+    async def test_bad_request(self):
+        response = await self.async_client.post('/gpt/draft/stream/', b'{', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        response = await self.async_client.post('/gpt/draft/stream/', {'role': ''}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('role', loads(response.content))
+
+
+class StartupImportTest(SimpleTestCase):
+    """
+    web worker, management command 시작 시간이 늘어나지 않았는지 확인한다. (manage.py importprofile)
+    openai, bs4, httpx 같은 무거운 module은 처음 사용할 때 불러와야 한다.
+    import 시간은 실행 환경에 따라 달라지므로 STARTUP_IMPORT_TIMING=1 일 때만 STARTUP_IMPORT_BUDGET과 비교한다.
+    """
+    targets = ['wsgi', 'asgi', 'urls', 'command:regulardelivery', 'command:deliveryworker']
+
+    def test_heavy_modules_are_deferred(self):
+        # 대상마다 프로세스를 띄우지 않고 한 프로세스에서 모두 불러와 확인한다.
+        self.assertEqual(get_deferred_imports(profile_imports(*self.targets)), [])
+
+    @skipUnless(os.getenv('STARTUP_IMPORT_TIMING') == '1', 'STARTUP_IMPORT_TIMING=1 일 때만 import 시간을 잰다.')
+    def test_within_budget(self):
+        for target in self.targets:
+            with self.subTest(target=target):
+                self.assertLessEqual(get_total_time(profile_imports(target)), settings.STARTUP_IMPORT_BUDGET)
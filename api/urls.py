@@ -8,6 +8,12 @@ router.register(r'letters', views.LetterViewSet, basename='letter_list')
 
 urlpatterns = [
     path('gpt/test/', views.GptTest.as_view(), name='gpt_test'),
+    path('gpt/draft/batch/', views.GptBatchDraftView.as_view(), name='gpt_batch_draft'),
+    path('gpt/draft/stream/', views.GptDraftStreamView.as_view(), name='gpt_draft_stream'),
     path('trainees/search/', views.TraineeSearchView.as_view(), name='search_trainee'),
+    path('trainees/search/batch/', views.TraineeBatchSearchView.as_view(), name='batch_search_trainee'),
+    path('letters/<int:letter_id>/send/', views.LetterSendView.as_view(), name='letter_send'),
+    path('letters/<int:letter_id>/send/status/', views.LetterSendStatusView.as_view(), name='letter_send_status'),
+    path('metrics/crawler/', views.CrawlerMetricsView.as_view(), name='crawler_metrics'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
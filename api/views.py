@@ -1,22 +1,32 @@
 from rest_framework import viewsets, mixins, status
 from rest_framework.decorators import action, permission_classes, api_view
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from accounts.authentication import CachedTokenAuthentication
 from rokaf_crawler.exceptions import *
+from .pagination import LetterCursorPagination
+from . import gpt
+from .renderers import astream_json_list, dumps, loads, stream_json_list
 from .serializers import *
 from .services import *
 
-import os
-from openai import OpenAI
-from dotenv import load_dotenv
-
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
 from django.forms.models import model_to_dict
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 
+import asyncio
 import re
-
-load_dotenv(verbose=True)
+import time
 
 """   
     + GET trainees/{trainee_id}/letters: 특정 trainee의 인편 목록 조회 (구현 중)
@@ -25,53 +35,246 @@ load_dotenv(verbose=True)
 
 # TODO: trainee 추가 시 front에서 호출할 traineeToUser 추가 api 만들기
 
-class GptTest(APIView):
-    permission_classes = [AllowAny]
-    serializer_class = GptPromptSerializer
-    client = OpenAI(
-        api_key=os.getenv('OPENAI_API_KEY')
-    )
+def is_asgi(request) -> bool:
+    """
+    ASGI로 받은 요청인지 확인한다.
+    WSGI(gunicorn sync worker 등)에서는 async view도 요청 thread에서 끝까지 실행되므로,
+    upstream을 기다리는 동안 worker가 묶이지 않게 하려면 동작을 나눠야 한다.
+    DRF Request를 넘기면 감싼 HttpRequest로 확인한다.
+    """
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAPIView(View):
+    """
+    upstream(인편 사이트, OpenAI) 응답을 기다리는 동안 thread를 잡고 있지 않는 async view (ASGI)
+    DRF APIView는 async handler를 지원하지 않으므로 요청 파싱, token 인증, JSON 응답을 여기서 처리한다.
+    """
+    authentication_required = False
+
+    async def dispatch(self, request, *args, **kwargs):
+        if self.authentication_required:
+            try:
+                user_auth = await CachedTokenAuthentication().aauthenticate(request)
+            except AuthenticationFailed as e:
+                return self.response({'detail': e.detail}, status=status.HTTP_401_UNAUTHORIZED)
+            if user_auth is None:
+                return self.response({'detail': NotAuthenticated.default_detail},
+                                     status=status.HTTP_401_UNAUTHORIZED)
+            request.user, request.auth = user_auth
+        return await super().dispatch(request, *args, **kwargs)
+
+    @staticmethod
+    def get_data(request):
+        """
+        JSON 형식이 올바르지 않으면 ValueError
+        """
+        return loads(request.body) if request.content_type == 'application/json' else request.POST
+
+    @staticmethod
+    def response(data, status: int = status.HTTP_200_OK, headers: dict = None) -> HttpResponse:
+        return HttpResponse(dumps(data), status=status, headers=headers, content_type='application/json')
 
-    def get_serializer(self, *args, **kwargs):
-        return self.serializer_class(*args, **kwargs)
+    def bad_request(self, data) -> HttpResponse:
+        return self.response(data, status=status.HTTP_400_BAD_REQUEST)
 
-    def post(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
 
-        query = self.client.chat.completions.create(
-            model='gpt-3.5-turbo',
-            messages=[
-                {'role': 'system', 'content': serializer.validated_data['role']},
-                {'role': 'user', 'content': serializer.validated_data['query_text']},
-            ],
-        )
-        choices = query.choices
-        for i, choice in enumerate(choices):
-            print(f"choice #{i}")
-            print(choice.message.content)
-        response = choices[0].message.content
+class GptDraftStreamView(AsyncAPIView):
+    """
+    GPT 편지 초안을 server-sent events로 흘려보냅니다 (ASGI 전용 async view)
+    요청: GptPromptSerializer와 같음
+    응답: token마다 "data: {"content": ...}", 끝나면 "event: done", 실패하면 "event: error"
+    """
+    async def post(self, request, *args, **kwargs):
+        try:
+            data = self.get_data(request)
+        except ValueError:
+            return self.bad_request({'error': 'JSON 형식이 올바르지 않습니다.'})
 
-        return Response({'content': response})
+        serializer = GptPromptSerializer(data=data)
+        if not serializer.is_valid():
+            return self.bad_request(serializer.errors)
 
+        response = StreamingHttpResponse(self.stream(**serializer.validated_data),
+                                         content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # nginx 등 proxy가 응답을 모아서 보내지 않도록 한다.
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
-class TraineeSearchView(APIView):
-    permission_classes = [AllowAny]
-    serializer_class = TraineeSearchSerializer
+    @staticmethod
+    def format_event(data: dict, event: str = None) -> bytes:
+        prefix = f"event: {event}\n" if event else ""
+        return prefix.encode('utf-8') + b"data: " + dumps(data) + b"\n\n"
 
-    def get_serializer(self, *args, **kwargs):
-        return self.serializer_class(*args, **kwargs)
+    async def stream(self, role: str, query_text: str):
+        from openai import OpenAIError
 
-    def post(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception = True)
+        try:
+            async for content in gpt.stream_draft(role, query_text):
+                yield self.format_event({'content': content})
+        except OpenAIError as e:
+            yield self.format_event({'error': str(e)}, event='error')
+            return
+        yield self.format_event({}, event='done')
+
+
+class GptTest(AsyncAPIView):
+    """
+    GPT 편지 초안을 생성합니다 (async view)
+    요청: GptPromptSerializer, 응답: {"content": ...}
+    """
+    async def post(self, request, *args, **kwargs):
+        try:
+            data = self.get_data(request)
+        except ValueError:
+            return self.bad_request({'error': 'JSON 형식이 올바르지 않습니다.'})
+
+        serializer = GptPromptSerializer(data=data)
+        if not serializer.is_valid():
+            return self.bad_request(serializer.errors)
+
+        # 같은 prompt의 응답은 캐시하고, 동시에 들어온 같은 prompt는 upstream 요청 하나를 공유한다. (api.gpt)
+        response = await gpt.aget_draft(serializer.validated_data['role'], serializer.validated_data['query_text'])
+
+        return self.response({'content': response})
+
+
+class GptBatchDraftView(AsyncAPIView):
+    """
+    내가 추가한 여러 훈련병에게 보낼 초안을 한 번에 생성합니다 (async view)
+    요청: role, query_text, receivers(생략하면 전체), save, title, password
+    응답: 훈련병마다 {"receiver", "content"} 또는 {"receiver", "error"}
+    save가 true면 초안을 작성 중 편지로 저장하고 "letter"(편지 id)를 함께 반환합니다.
+    """
+    authentication_required = True
+
+    async def post(self, request, *args, **kwargs):
+        from openai import OpenAIError
+
+        try:
+            data = self.get_data(request)
+        except ValueError:
+            return self.bad_request({'error': 'JSON 형식이 올바르지 않습니다.'})
+
+        serializer = GptBatchDraftSerializer(data=data)
+        if not serializer.is_valid():
+            return self.bad_request(serializer.errors)
+        data = serializer.validated_data
+        if data['save'] and not data.get('password'):
+            return self.bad_request({'error': '편지를 저장하려면 비밀번호를 입력해주세요.'})
+
+        trainee_to_users = await sync_to_async(self.get_trainee_to_users)(request.user, data.get('receivers'))
+        if 'receivers' in data and len(trainee_to_users) != len(set(data['receivers'])):
+            return self.bad_request({'error': '내가 추가한 훈련병에게만 편지를 보낼 수 있습니다.'})
+
+        queries = [gpt.get_personalized_query(data['query_text'], trainee_to_user.trainee.name,
+                                              trainee_to_user.relationship)
+                   for trainee_to_user in trainee_to_users]
+        drafts = await gpt.create_drafts(data['role'], queries)
+
+        response = []
+        letters = []
+        for trainee_to_user, draft in zip(trainee_to_users, drafts):
+            if isinstance(draft, OpenAIError):
+                response.append({'receiver': trainee_to_user.trainee_id, 'error': 'GPT 초안을 생성하지 못했습니다.'})
+                continue
+            if isinstance(draft, Exception):
+                raise draft
+            response.append({'receiver': trainee_to_user.trainee_id, 'content': draft})
+            if data['save']:
+                letters.append(self.get_letter(trainee_to_user, draft, data))
+
+        if not data['save']:
+            return self.response(response)
+
+        letters = iter(await sync_to_async(Letter.objects.bulk_create)(letters))
+        for item in response:
+            if 'content' in item:
+                item['letter'] = next(letters).id
+        return self.response(response, status=status.HTTP_201_CREATED)
+
+    @staticmethod
+    def get_trainee_to_users(user, receivers: list = None) -> list:
+        trainee_to_users = TraineeToUser.objects.filter(user=user).select_related('trainee').order_by('id')
+        if receivers is not None:
+            trainee_to_users = trainee_to_users.filter(trainee_id__in=receivers)
+        return list(trainee_to_users)
+
+    def get_letter(self, trainee_to_user: TraineeToUser, draft: str, data: dict) -> Letter:
+        letter_data = {'senderZipcode': '', 'senderAddr1': '', 'senderAddr2': '', 'senderName': '',
+                       'relationship': ''}
+        set_sender_fields(letter_data, self.request.user)
+        set_relationship(letter_data, trainee_to_user.relationship)
+        title = data.get('title') or f'{trainee_to_user.trainee.name} 훈련병에게'
+        return Letter(sender=self.request.user, receiver_id=trainee_to_user.trainee_id, title=title,
+                      contents=removeEscapedBlanks(draft), password=data['password'],
+                      status=LetterStatus.EDITING.value, **letter_data)
+
+
+class TraineeSearchView(AsyncAPIView):
+    """
+    훈련병을 검색합니다 (async view)
+    인편 사이트 응답을 기다리는 동안 thread를 점유하지 않으므로 ASGI worker 하나가 수백 건의 검색을 동시에 처리합니다.
+    """
+    async def post(self, request, *args, **kwargs):
+        try:
+            data = self.get_data(request)
+        except ValueError:
+            return self.bad_request({'error': 'JSON 형식이 올바르지 않습니다.'})
+
+        serializer = TraineeSearchSerializer(data=data)
+        if not serializer.is_valid():
+            return self.bad_request(serializer.errors)
         trainee_pydantic = rokaf_crawler.models.Trainee(**serializer.validated_data)
 
         try:
-            search_result = rokaf_crawler.crawlers.TraineeSearcher(trainee_pydantic).search_trainee()
-            return Response(search_result)
+            search_result = await rokaf_crawler.async_crawlers.AsyncTraineeSearcher(trainee_pydantic).search_trainee()
+            return self.response(search_result)
         except TraineeNotFoundException as e:
-            return Response({'error': str(e)})
+            return self.response({'error': str(e)})
+
+
+class TraineeBatchSearchView(AsyncAPIView):
+    """
+    여러 훈련병을 한 번에 검색합니다 (async view)
+    요청: {"trainees": [{"name": ..., "birthday": ..., "agency_id": ...}, ...]}
+    응답: 요청 순서대로 {"index", "result"} 또는 {"index", "error"}
+    """
+    async def post(self, request, *args, **kwargs):
+        try:
+            data = self.get_data(request)
+        except ValueError:
+            return self.bad_request({'error': 'JSON 형식이 올바르지 않습니다.'})
+
+        serializer = TraineeBatchSearchSerializer(data=data)
+        if not serializer.is_valid():
+            return self.bad_request(serializer.errors)
+
+        response = []
+        trainees = {}
+        for index, data in enumerate(serializer.validated_data['trainees']):
+            trainee_serializer = TraineeSearchSerializer(data=data)
+            if trainee_serializer.is_valid():
+                trainees[index] = rokaf_crawler.models.Trainee(**trainee_serializer.validated_data)
+                response.append({'index': index})
+            else:
+                response.append({'index': index, 'error': trainee_serializer.errors})
+
+        # 요청을 처리하는 event loop에서 바로 실행하므로 loop 공용 httpx client의 연결을 요청 간에 재사용한다.
+        search_results = await rokaf_crawler.async_crawlers.search_trainees(
+            trainees.values(), concurrency=settings.TRAINEE_BATCH_SEARCH_CONCURRENCY
+        )
+        for index, search_result in zip(trainees.keys(), search_results):
+            if isinstance(search_result, CrawlerException):
+                response[index]['error'] = str(search_result)
+            elif isinstance(search_result, Exception):
+                response[index]['error'] = '인편 사이트에 접속할 수 없습니다.'
+            else:
+                response[index]['result'] = search_result
+
+        return self.response(response)
 
 
 class TraineeViewSet(mixins.CreateModelMixin,
@@ -103,17 +306,62 @@ class TraineeViewSet(mixins.CreateModelMixin,
 
 # TODO: 내가 작성한 편지인 경우 바로 편지 수정/삭제/발송 등이 가능하도록 수정
 class LetterViewSet(viewsets.ModelViewSet):
+    """
+    목록(list, sent, received)은 기본적으로 본문을 포함한 전체 목록을 반환합니다.
+    ?view=summary 를 주면 본문 대신 앞부분(preview)만 담아 cursor pagination({next, previous, results})으로 반환합니다.
+    """
     permission_classes = [IsAuthenticated]
     serializer_class = LetterListSerializer
 
     def get_queryset(self):
         return Letter.objects.filter(sender = self.request.user)
 
+    def is_summary_view(self) -> bool:
+        return self.request.GET.get('view') == 'summary'
+
     def get_serializer_class(self):
-        if self.action == 'list':
-            return LetterListSerializer
+        if self.action in ('list', 'get_my_letters', 'get_received_letters'):
+            return LetterSummarySerializer if self.is_summary_view() else LetterListSerializer
         return LetterDetailSerializer
 
+    @property
+    def paginator(self):
+        if not self.is_summary_view():
+            return None
+        if not hasattr(self, '_paginator'):
+            self._paginator = LetterCursorPagination()
+        return self._paginator
+
+    def get_paginated_list(self, queryset) -> Response:
+        """
+        ?stream=true 이면 pagination 없이 전체 목록을 chunk 단위로 직렬화해 흘려보낸다.
+        """
+        serializer_class = self.get_serializer_class()
+        if self.is_summary_view():
+            queryset = LetterSummarySerializer.with_preview(queryset)
+        if self.request.GET.get('stream') in ('true', '1'):
+            queryset = queryset.order_by('-id')
+            chunk_size = settings.LETTER_LIST_STREAM_CHUNK_SIZE
+            # ASGI에서는 sync iterator를 다 읽은 뒤에 보내므로 async iterator로 넘긴다.
+            if is_asgi(self.request):
+                content = astream_json_list(queryset.aiterator(chunk_size=chunk_size), serializer_class,
+                                            context=self.get_serializer_context(), chunk_size=chunk_size)
+            else:
+                content = stream_json_list(queryset.iterator(chunk_size=chunk_size), serializer_class,
+                                           context=self.get_serializer_context(), chunk_size=chunk_size)
+            return StreamingHttpResponse(content, content_type='application/json')
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+    def list(self, request, *args, **kwargs):
+        return self.get_paginated_list(self.get_queryset())
+
     @action(detail=False, methods=['get'], url_path='sent')
     def get_my_letters(self, request, *args, **kwargs):
         """
@@ -126,8 +374,7 @@ class LetterViewSet(viewsets.ModelViewSet):
         if receiver_id is not None:
             queryset = queryset.filter(receiver=receiver_id)
 
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.get_paginated_list(queryset)
 
     @action(detail=False, methods=['GET'], url_path='received')
     def get_received_letters(self, request, *args, **kwargs) -> Response:
@@ -141,26 +388,31 @@ class LetterViewSet(viewsets.ModelViewSet):
 
         queryset = Letter.objects.filter(receiver=user.as_trainee.id)
 
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.get_paginated_list(queryset)
 
-    @action(detail=False, methods=['POST'], url_path=r'(?P<letter_id>\d+)/send')
-    def send(self, request, *args, **kwargs):
+    @action(detail=False, methods=['POST'], url_path='broadcast')
+    def broadcast(self, request, *args, **kwargs):
         """
-        편지를 보냅니다
+        같은 편지를 여러 훈련병에게 작성합니다
+        send_now가 true면 만든 편지를 한 번에 전송 작업 큐에 넣고 202를 반환합니다.
         """
-        letter = Letter.objects.get(pk=self.kwargs['letter_id'])
+        serializer = LetterBroadcastSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
         try:
-            ret = letterService.send_letter(letter)
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        except CrawlerException as e:
+            with transaction.atomic():
+                letters = serializer.save()
+                if serializer.validated_data['send_now']:
+                    deliveryQueue.enqueue_many(letters)
+        except AssertionError as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+        data = LetterSummarySerializer(LetterSummarySerializer.with_preview(
+            Letter.objects.filter(id__in=[letter.id for letter in letters]).order_by('id')
+        ), many=True).data
+        if serializer.validated_data['send_now']:
+            return Response(data, status=status.HTTP_202_ACCEPTED)
+        return Response(data, status=status.HTTP_201_CREATED)
+
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -169,4 +421,90 @@ class LetterViewSet(viewsets.ModelViewSet):
         except AssertionError as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         headers = self.get_success_headers(serializer.data)
-        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
\ No newline at end of file
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+
+# LetterSendView가 ASGI event loop에서 실행 중인 전송 (task가 끝나기 전에 GC되지 않도록 잡아 둔다.)
+background_sends = set()
+
+
+class LetterSendView(AsyncAPIView):
+    """
+    편지를 전송합니다 (async view)
+    전송 작업을 만들고 바로 202와 작업 정보, Location(letters/{letter_id}/send/status/)을 반환합니다.
+    ASGI에서는 응답을 보낸 뒤 같은 event loop에서 바로 작업을 가져와(claim) async crawler로 전송하고,
+    WSGI에서는 deliveryworker가 전송합니다. 실패한 작업은 큐에 남아 다시 시도됩니다.
+    """
+    authentication_required = True
+
+    async def post(self, request, letter_id, *args, **kwargs):
+        try:
+            letter = await Letter.objects.select_related('receiver').aget(pk=letter_id, sender=request.user)
+        except Letter.DoesNotExist:
+            return self.response({'error': '편지를 찾을 수 없습니다.'}, status=status.HTTP_404_NOT_FOUND)
+
+        job = await sync_to_async(deliveryQueue.enqueue)(letter)
+        data = DeliveryJobSerializer(job).data
+        if is_asgi(request):
+            task = asyncio.create_task(self.send(job))
+            background_sends.add(task)
+            task.add_done_callback(background_sends.discard)
+
+        headers = {'Location': request.build_absolute_uri('status/')}
+        return self.response(data, status=status.HTTP_202_ACCEPTED, headers=headers)
+
+    @staticmethod
+    async def send(job: DeliveryJob) -> None:
+        # deliveryworker가 먼저 가져간 작업은 건너뛴다.
+        if await sync_to_async(deliveryQueue.claim_job)(job):
+            await deliveryQueue.aprocess(job)
+
+
+class LetterSendStatusView(AsyncAPIView):
+    """
+    편지 전송 작업 상태를 조회합니다 (async view)
+    ASGI에서는 ?wait=N 을 주면 작업이 끝날 때까지 최대 N초(DELIVERY_JOB_LONG_POLL_TIMEOUT 이하) 기다립니다.
+    WSGI에서는 기다리는 동안 worker thread가 묶이므로 wait를 무시하고 바로 반환합니다.
+    작업이 끝나지 않았으면 Retry-After header로 다음 조회 시점을 알려 줍니다.
+    """
+    authentication_required = True
+
+    async def get(self, request, letter_id, *args, **kwargs):
+        try:
+            job = await DeliveryJob.objects.select_related('letter') \
+                .aget(letter=letter_id, letter__sender=request.user)
+        except DeliveryJob.DoesNotExist:
+            return self.response({'error': '전송 요청이 없는 편지입니다.'}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            wait = min(float(request.GET.get('wait', 0)), settings.DELIVERY_JOB_LONG_POLL_TIMEOUT)
+        except ValueError:
+            return self.bad_request({'error': 'wait는 숫자여야 합니다.'})
+        if not is_asgi(request):
+            wait = 0
+
+        deadline = time.monotonic() + wait
+        while self.is_unfinished(job) and time.monotonic() < deadline:
+            await asyncio.sleep(settings.DELIVERY_JOB_POLL_INTERVAL)
+            # 필드를 지정하지 않으면 select_related로 읽어 둔 letter가 지워진다.
+            await job.arefresh_from_db(fields=['status', 'attempts', 'available_at', 'last_error', 'updated_at'])
+            await job.letter.arefresh_from_db(fields=['status'])
+
+        headers = {'Retry-After': str(settings.DELIVERY_JOB_RETRY_AFTER)} if self.is_unfinished(job) else None
+        return self.response(DeliveryJobSerializer(job).data, headers=headers)
+
+    @staticmethod
+    def is_unfinished(job: DeliveryJob) -> bool:
+        return job.status in (DeliveryJobStatus.PENDING.value, DeliveryJobStatus.RUNNING.value)
+
+
+class CrawlerMetricsView(APIView):
+    """
+    crawler 단계별 소요 시간 histogram을 Prometheus text format으로 반환합니다 (관리자 전용)
+    값은 worker process마다 따로 쌓이므로 여러 worker로 띄운 경우 scrape한 process의 값만 보입니다.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        sink = apps.get_app_config('api').crawler_metrics
+        return HttpResponse(sink.render(), content_type=sink.CONTENT_TYPE)
@@ -21,6 +21,8 @@ if DEBUG:
     load_dotenv(Path('.env.dev'), verbose=True)
 else:
     load_dotenv(Path('.env.prod'), verbose=True)
+# 공통 환경변수(OPENAI_API_KEY 등)
+load_dotenv(verbose=True)
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -53,7 +55,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'api.middleware.AsyncWhiteNoiseMiddleware',
+    'api.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -147,8 +150,124 @@ AUTH_USER_MODEL = 'api.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'accounts.authentication.CachedTokenAuthentication',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'api.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+}
+
+# 여러 worker가 함께 쓰는 cache는 REDIS_URL을 설정하면 'shared' alias로 사용한다.
+# LocMem('default')은 프로세스마다 따로이므로 worker 사이에 공유해야 하는 값(token 인증 캐시 등)에는 쓰지 않는다.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+if os.getenv('REDIS_URL'):
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+    }
+
+# token 인증 캐시 (accounts.authentication 참고)
+# alias가 None이거나 프로세스별 cache(LocMem 등)면 공유 cache 단계 없이 프로세스 안의 LRU와 DB만 사용한다.
+TOKEN_AUTH_CACHE = {
+    'alias': 'shared' if 'shared' in CACHES else None,
+    'local_maxsize': 10000,
+    'local_ttl': 30,
+    'shared_ttl': 600,
+}
+
+# rokaf_crawler connection pool (rokaf_crawler.sessions.HttpConfig 참고)
+ROKAF_CRAWLER_HTTP = {
+    'connect_timeout': float(os.getenv('CRAWLER_CONNECT_TIMEOUT', 5)),
+    'read_timeout': float(os.getenv('CRAWLER_READ_TIMEOUT', 20)),
+    'pool_maxsize': int(os.getenv('CRAWLER_POOL_MAXSIZE', 20)),
+    # async crawler(httpx) client 전체 연결 수 상한, 0이면 pool_connections * pool_maxsize
+    'max_connections': int(os.getenv('CRAWLER_MAX_CONNECTIONS', 0)) or None,
+    'max_retries': int(os.getenv('CRAWLER_MAX_RETRIES', 2)),
+}
+# 부하 테스트용 fake 사이트(python -m rokaf_crawler.fake_server) 주소로 바꿀 때 사용
+if os.getenv('CRAWLER_BASE_URL'):
+    ROKAF_CRAWLER_HTTP['base_url'] = ROKAF_CRAWLER_HTTP['search_base_url'] = os.getenv('CRAWLER_BASE_URL')
+
+# 교육기관(site_id)별 요청 속도 제한과 circuit breaker (rokaf_crawler.throttling.ThrottleConfig 참고)
+ROKAF_CRAWLER_THROTTLE = {
+    'rate': float(os.getenv('CRAWLER_RATE', 5)),
+    'burst': int(os.getenv('CRAWLER_BURST', 10)),
+    'failure_threshold': 5,
+    'recovery_timeout': 30,
+}
+
+# 검색 결과 페이지 parser backend ('selectolax', 'lxml', 'bs4'), None이면 설치된 것 중 가장 빠른 것을 사용
+ROKAF_CRAWLER_PARSER = os.getenv('CRAWLER_PARSER')
+
+# 훈련병 검색 결과 캐시 (초 단위, 검색 결과가 없는 경우는 negative_ttl 동안 캐시)
+ROKAF_CRAWLER_SEARCH_CACHE = {
+    'maxsize': 4096,
+    'ttl': 600,
+    'negative_ttl': 60,
+}
+
+# trainees/search/batch/ 에서 동시에 검색할 최대 훈련병 수
+TRAINEE_BATCH_SEARCH_CONCURRENCY = 20
+
+# 편지 목록 ?view=summary (api.pagination.LetterCursorPagination, LetterSummarySerializer.preview)
+LETTER_LIST_PAGE_SIZE = 20
+LETTER_LIST_MAX_PAGE_SIZE = 100
+LETTER_PREVIEW_LENGTH = 100
+# ?stream=true 로 전체 목록을 받을 때 한 번에 읽어 직렬화할 편지 수
+LETTER_LIST_STREAM_CHUNK_SIZE = 500
+
+# GPT 편지 초안 (api.gpt)
+# 부하 테스트에서는 OPENAI_BASE_URL을 fake 서버(python -m api.fake_completion_server) 주소로 바꾼다.
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+GPT_MODEL = os.getenv('GPT_MODEL', 'gpt-3.5-turbo')
+GPT_TIMEOUT = float(os.getenv('GPT_TIMEOUT', 60))
+# 같은 prompt의 응답 캐시 (api.gpt.DraftCache), variants: prompt마다 모아 둘 서로 다른 응답 수
+GPT_DRAFT_CACHE = {
+    'maxsize': 256,
+    'ttl': 3600,
+    'variants': 3,
+}
+# 여러 훈련병 초안 한 번에 생성 (gpt/draft/batch/): 동시 요청 수, 초당 요청 수, 순간 최대 요청 수, 429 재시도 횟수
+GPT_BATCH_DRAFT_CONCURRENCY = 8
+GPT_BATCH_DRAFT_RATE = 3.0
+GPT_BATCH_DRAFT_BURST = 8
+GPT_RATE_LIMIT_RETRIES = 3
+
+# 시작 시 import 시간 예산(초) (manage.py importprofile, api.tests.StartupImportTest)
+STARTUP_IMPORT_BUDGET = float(os.getenv('STARTUP_IMPORT_BUDGET', 1.5))
+
+# 편지 전송 작업 상태 long-poll (letters/{id}/send/status?wait=N, ASGI에서만)
+# 작업이 끝나지 않았으면 Retry-After(초)로 다음 조회 시점을 알려 준다.
+DELIVERY_JOB_LONG_POLL_TIMEOUT = 20
+DELIVERY_JOB_POLL_INTERVAL = 0.5
+DELIVERY_JOB_RETRY_AFTER = 2
+
+# crawler 단계별 timing event 로그 (rokaf_crawler.instrumentation.LoggingSink, DEBUG로 설정하면 모든 단계 출력)
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'rokaf_crawler': {
+            'handlers': ['console'],
+            'level': os.getenv('CRAWLER_LOG_LEVEL', 'INFO'),
+        },
+    },
 }
 
 # CORS variables
@@ -1,3 +1,17 @@
-from . import crawlers, exceptions, models, utils
+import importlib
 
-__all__ = [crawlers, exceptions, models, utils]
\ No newline at end of file
+# submodule은 처음 사용할 때 import한다. (rokaf_crawler.crawlers 등)
+# Django 시작 시 api.models가 rokaf_crawler.models만 필요로 하므로 bs4, requests, httpx는 실제로 crawling할 때 불러온다.
+
+__all__ = ['async_crawlers', 'cache', 'crawlers', 'exceptions', 'instrumentation', 'models', 'parsers', 'sessions',
+           'throttling', 'utils']
+
+
+def __getattr__(name: str):
+    if name in __all__:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,219 @@
+import asyncio
+from typing import Iterable, List, Optional, Tuple
+
+import httpx
+from rokaf_crawler.crawlers import BaseTraineeSearcher, BaseLetterListPageGetter, BaseLetterSender, \
+    BaseLetterBatchSender
+from rokaf_crawler.exceptions import *
+from rokaf_crawler.instrumentation import *
+from rokaf_crawler.models import *
+from rokaf_crawler import sessions
+from rokaf_crawler.sessions import get_async_client
+from rokaf_crawler.throttling import throttle
+
+# 하나의 event loop 위에서 수백 건의 검색/전송을 동시에 처리하기 위한 asyncio 버전 crawler
+# url 생성, 파싱, 에러 판별은 sync crawler(crawlers.py)와 같은 Base 클래스를 사용한다.
+
+DEFAULT_CONCURRENCY = 100
+
+
+def get_cookie_header(response: httpx.Response) -> dict:
+    cookies = "; ".join(f"{name}={value}" for name, value in response.cookies.items())
+    return {"Cookie": cookies} if cookies else {}
+
+
+class _ClientMixin:
+    def __init__(self, *args, client: Optional[httpx.AsyncClient] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # client를 지정하지 않으면 event loop 공용 client(sessions.get_async_client)를 사용한다.
+        self.client = client
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        client = self.client or get_async_client()
+        response = await client.request(method, url, **kwargs)
+        response.raise_for_status()
+        return response
+
+
+# 1. 정보 불러오기
+class AsyncTraineeSearcher(_ClientMixin, BaseTraineeSearcher):
+    async def get_page(self, url: str) -> httpx.Response:
+        return await self._request("GET", url)
+
+    async def search_trainee(self) -> List:
+        cached_search_result = self.get_cached_search_result()
+        if cached_search_result is not None:
+            return cached_search_result
+
+        url = self.get_trainee_list_url()
+        async with throttle(self.agency.site_id):
+            with measure(SEARCH_FETCH, self.agency.site_id) as event:
+                response = await self.get_page(url)
+                event.response_size = len(response.content)
+            with measure(SEARCH_PARSE, self.agency.site_id, response_size=len(response.content)):
+                return self.parse_search_result(response.content, response.headers.get('Content-Type'))
+
+# 2. 편지 보내기
+## 편지 목록 페이지 접속
+class AsyncLetterListPageGetter(_ClientMixin, BaseLetterListPageGetter):
+    async def get_letter_list_page(self, page: int = 1) -> httpx.Response:
+        self.check_member_seq()
+
+        url = self.get_letter_list_page_url(page)
+        async with throttle(self.agency.site_id):
+            with measure(LETTER_LIST_PAGE, self.agency.site_id) as event:
+                response = await self._request("GET", url)
+                event.response_size = len(response.content)
+
+                self.check_letter_list_page(response.content)
+        return response
+
+    async def get_letter_list(self, since: int = 0) -> List[LetterListEntry]:
+        entries = []
+        for page in range(1, self.MAX_PAGES + 1):
+            response = await self.get_letter_list_page(page)
+            page_entries = self.parse_letter_list(response.content, content_type=response.headers.get('Content-Type'))
+            if not self.add_page(entries, page_entries, since):
+                break
+        return entries
+
+## 편지 작성 후 전송
+class AsyncLetterSender(_ClientMixin, BaseLetterSender):
+    async def get_letter_write_page(self, letter_list_page_url: str,
+                                    prev_response: httpx.Response) -> httpx.Response:
+        additional_headers = {
+            "Referer": letter_list_page_url,
+            **get_cookie_header(prev_response),
+        }
+        letter_write_page_url = self.get_letter_write_page_url()
+        async with throttle(self.agency.site_id):
+            with measure(LETTER_WRITE_PAGE, self.agency.site_id) as event:
+                letter_write_page_response = await self._request("GET", letter_write_page_url,
+                                                                 headers=additional_headers)
+                event.response_size = len(letter_write_page_response.content)
+        # 목록 페이지에서 받은 세션 쿠키를 전송 요청까지 이어서 넘긴다.
+        for name, value in prev_response.cookies.items():
+            if name not in letter_write_page_response.cookies:
+                letter_write_page_response.cookies.set(name, value)
+        return letter_write_page_response
+
+    async def submit_letter(self, data, prev_response: httpx.Response) -> None:
+        additional_headers = {
+            "Referer": self.get_letter_write_page_url(),
+            **get_cookie_header(prev_response),
+        }
+        async with throttle(self.agency.site_id):
+            with measure(LETTER_SUBMIT, self.agency.site_id) as event:
+                response = await self._request("POST", self.get_letter_submit_page_url(), data=data,
+                                               headers=additional_headers)
+                event.response_size = len(response.content)
+
+                self.check_letter_submit_page(response.content)
+
+    async def open_letter_write_page(self) -> httpx.Response:
+        letter_list_page_getter = AsyncLetterListPageGetter(self.trainee, client=self.client)
+        # 편지 목록 페이지 접속
+        letter_list_page_url = letter_list_page_getter.get_letter_list_page_url()
+        letter_list_page_response = await letter_list_page_getter.get_letter_list_page()
+
+        # 편지 작성 페이지 접속
+        return await self.get_letter_write_page(letter_list_page_url, prev_response=letter_list_page_response)
+
+    async def send_letter(self) -> None:
+        letter_write_page_response = await self.open_letter_write_page()
+        # 편지 request form에 맞게 구성
+        http_request_body = self.create_request_form_data()
+        # 편지 전송
+        await self.submit_letter(http_request_body, letter_write_page_response)
+
+## 여러 편지를 한 번에 전송
+class AsyncLetterBatchSender(_ClientMixin, BaseLetterBatchSender):
+    async def send_group(self, group: List[Tuple[int, Trainee, Letter]], results: List) -> None:
+        letter_write_page_response = None
+        for index, trainee, letter in group:
+            sender = AsyncLetterSender(trainee, letter, client=self.client)
+            http_request_body = sender.create_request_form_data()
+            if not trainee.member_seq:
+                results[index] = TraineeNotSearchedException()
+                continue
+            try:
+                if letter_write_page_response is None:
+                    letter_write_page_response = await sender.open_letter_write_page()
+                    await sender.submit_letter(http_request_body, letter_write_page_response)
+                else:
+                    try:
+                        await sender.submit_letter(http_request_body, letter_write_page_response)
+                    except WrongAccessException:
+                        letter_write_page_response = await sender.open_letter_write_page()
+                        await sender.submit_letter(http_request_body, letter_write_page_response)
+                results[index] = None
+            except Exception as e:
+                # 다음 편지는 새로 접속해서 보낸다.
+                letter_write_page_response = None
+                results[index] = e
+
+    async def send_letters(self, concurrency: int = DEFAULT_CONCURRENCY) -> List:
+        """
+        그룹끼리는 동시에, 그룹 안의 편지는 같은 세션으로 차례대로 전송한다.
+        결과는 입력 순서대로 None(성공) 또는 발생한 예외(CrawlerException 등)이다.
+        """
+        results = [None] * len(self.pairs)
+        factories = [lambda group=group: self.send_group(group, results) for group in self.get_groups()]
+        await _gather_limited(factories, concurrency)
+        return results
+
+
+# 3. 여러 건 동시 처리
+async def _gather_limited(coroutine_factories, concurrency: int) -> List:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(factory):
+        async with semaphore:
+            return await factory()
+
+    # 한 건의 실패가 나머지 작업을 중단시키지 않도록 예외도 결과로 반환한다.
+    return await asyncio.gather(*(run(factory) for factory in coroutine_factories), return_exceptions=True)
+
+
+async def search_trainees(trainees: Iterable[Trainee], concurrency: int = DEFAULT_CONCURRENCY,
+                          client: Optional[httpx.AsyncClient] = None) -> List:
+    """
+    여러 훈련병을 동시에 검색한다.
+    결과는 입력 순서대로 검색 결과(list) 또는 발생한 예외(CrawlerException 등)이다.
+    """
+    factories = [AsyncTraineeSearcher(trainee, client=client).search_trainee for trainee in trainees]
+    return await _gather_limited(factories, concurrency)
+
+
+async def send_letters(pairs: Iterable[Tuple[Trainee, Letter]], concurrency: int = DEFAULT_CONCURRENCY,
+                       client: Optional[httpx.AsyncClient] = None) -> List:
+    """
+    여러 편지를 동시에 전송한다.
+    결과는 입력 순서대로 None(성공) 또는 발생한 예외(CrawlerException 등)이다.
+    """
+    factories = [AsyncLetterSender(trainee, letter, client=client).send_letter for trainee, letter in pairs]
+    return await _gather_limited(factories, concurrency)
+
+
+async def send_letter_batch(pairs: Iterable[Tuple[Trainee, Letter]], group_by: str = 'trainee',
+                            concurrency: int = DEFAULT_CONCURRENCY,
+                            client: Optional[httpx.AsyncClient] = None) -> List:
+    """
+    같은 훈련병(또는 교육기관)에게 가는 편지는 목록/작성 페이지 접속을 한 번만 하고 전송한다.
+    결과는 입력 순서대로 None(성공) 또는 발생한 예외(CrawlerException 등)이다.
+    """
+    return await AsyncLetterBatchSender(pairs, group_by, client=client).send_letters(concurrency)
+
+
+def run(coroutine):
+    """
+    sync 코드(Django view, management command)에서 coroutine 실행
+    실행이 끝나면 이번 event loop에서 만든 공용 client를 닫는다.
+    """
+    async def run_and_close():
+        try:
+            return await coroutine
+        finally:
+            await sessions.aclose()
+
+    return asyncio.run(run_and_close())
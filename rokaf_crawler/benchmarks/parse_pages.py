@@ -0,0 +1,46 @@
+"""
+검색 결과 페이지 파싱 microbenchmark
+
+저장된 검색 결과 페이지를 backend별로 반복 파싱해 페이지당 파싱 시간을 출력한다.
+    python -m rokaf_crawler.benchmarks.parse_pages [-n 2000] [page.html ...]
+페이지를 지정하지 않으면 rokaf_crawler/fixtures의 검색 결과 페이지를 사용한다.
+"""
+import argparse
+import timeit
+from pathlib import Path
+
+from rokaf_crawler import parsers
+from rokaf_crawler.exceptions import CrawlerException
+
+FIXTURES_DIR = Path(__file__).resolve().parent.parent / 'fixtures'
+DEFAULT_PAGES = ['search_result.html', 'trainee_not_found.html']
+
+
+def parse_page(parser: parsers.Parser, content: bytes) -> None:
+    try:
+        parsers.check_search_page(content)
+    except CrawlerException:
+        return
+    parser.parse_trainees(parsers.decode_page(content))
+
+
+def run(pages, number: int) -> None:
+    contents = {page.name: page.read_bytes() for page in pages}
+    for name, parser in parsers.available_parsers().items():
+        for page_name, content in contents.items():
+            elapsed = min(timeit.repeat(lambda: parse_page(parser, content), number=number, repeat=3))
+            print(f"{name:<12}{page_name:<28}{elapsed / number * 1e6:10.1f} us/page")
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('pages', nargs='*', type=Path)
+    arg_parser.add_argument('-n', '--number', type=int, default=2000)
+    args = arg_parser.parse_args()
+
+    pages = args.pages or [FIXTURES_DIR / page for page in DEFAULT_PAGES]
+    run(pages, args.number)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, List, Optional
+
+from rokaf_crawler.exceptions import TraineeNotFoundException
+from rokaf_crawler.models import Trainee
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    TTL + LRU 캐시 (thread-safe)
+    maxsize를 넘으면 가장 오래 사용되지 않은 항목부터 제거한다.
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                expires_at, value = item
+                if expires_at > self.clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (self.clock() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self._data)}
+
+
+class SearchResultCache(TTLCache):
+    """
+    훈련병 검색 결과 캐시
+    key는 (agency_id, name, birthday)이고, 검색 결과가 없는 경우(TraineeNotFoundException)도
+    negative_ttl 동안 캐시한다.
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = 600.0, negative_ttl: float = 60.0, **kwargs):
+        super().__init__(maxsize=maxsize, ttl=ttl, **kwargs)
+        self.negative_ttl = negative_ttl
+        self.negative_hits = 0
+
+    def configure(self, maxsize: int = None, ttl: float = None, negative_ttl: float = None) -> None:
+        if maxsize is not None:
+            self.maxsize = maxsize
+        if ttl is not None:
+            self.ttl = ttl
+        if negative_ttl is not None:
+            self.negative_ttl = negative_ttl
+        self.clear()
+
+    @staticmethod
+    def get_key(trainee: Trainee) -> tuple:
+        return trainee.agency_id, trainee.name, trainee.birthday
+
+    def get_search_result(self, trainee: Trainee) -> Optional[List]:
+        """
+        캐시된 검색 결과를 반환한다. 캐시에 없으면 None
+        검색 결과가 없다고 캐시된 경우 TraineeNotFoundException을 발생시킨다.
+        """
+        value = self.get(self.get_key(trainee), _MISSING)
+        if value is _MISSING:
+            return None
+        if isinstance(value, TraineeNotFoundException):
+            self.negative_hits += 1
+            raise TraineeNotFoundException(value.message)
+        return copy.deepcopy(value)
+
+    def set_search_result(self, trainee: Trainee, search_result: List) -> None:
+        self.set(self.get_key(trainee), copy.deepcopy(search_result))
+
+    def set_not_found(self, trainee: Trainee, exception: TraineeNotFoundException) -> None:
+        self.set(self.get_key(trainee), exception, ttl=self.negative_ttl)
+
+    def clear(self) -> None:
+        super().clear()
+        self.negative_hits = 0
+
+    @property
+    def stats(self) -> dict:
+        return {**super().stats, 'negative_hits': self.negative_hits}
+
+
+search_cache = SearchResultCache()
@@ -1,109 +1,165 @@
+import logging
 import re
 from dataclasses import dataclass
 from enum import Enum
-from typing import List
+from typing import Iterable, List, Optional, Tuple
 from urllib import parse
 
-import bs4
 import requests
-from bs4 import BeautifulSoup
+from rokaf_crawler import parsers
+from rokaf_crawler.cache import search_cache
+from rokaf_crawler.instrumentation import *
 from rokaf_crawler.exceptions import *
 from rokaf_crawler.models import *
+from rokaf_crawler import sessions
+from rokaf_crawler.sessions import get_session
+from rokaf_crawler.throttling import throttle
+
+logger = logging.getLogger(__name__)
+
+# sync/async crawler가 공유하는 url 생성, 페이지 파싱 로직
+# 실제 통신은 하위 클래스(TraineeSearcher, async_crawlers.AsyncTraineeSearcher 등)에서 담당한다.
 
 # 1. 정보 불러오기
-class TraineeSearcher:
+class BaseTraineeSearcher:
     def __init__(self, trainee: Trainee):
         self.trainee = trainee
         self.agency = agencies[self.trainee.agency_id]
 
-    @staticmethod
-    def get_soup(url: str) -> BeautifulSoup:
-        response = requests.get(url)
-        response.raise_for_status()
-        return BeautifulSoup(response.text, 'html.parser')
-
-    @staticmethod
-    def parse_member_seq(trainee_tag: bs4.element.Tag) -> str:
-        onclick_func = trainee_tag.input['onclick']
-        int_pattern = re.compile('\d+')
-        member_seq = int_pattern.findall(onclick_func)[0]
-        return member_seq
-
-    @staticmethod
-    def parse_additional_info(trainee_tag: bs4.element.Tag) -> dict:
-        additional_info = {}
-        info_dl_list = trainee_tag.find(class_='info').select('dl')
-        for info_dl in info_dl_list:
-            key = " ".join(info_dl.dt.text.split())
-            value = " ".join(info_dl.dd.text.split()[1:])
-            additional_info[key] = value
-        return additional_info
+    # bs4 tag 단위 파싱 (parsers.Bs4Parser 참고)
+    parse_member_seq = staticmethod(parsers.Bs4Parser.parse_member_seq)
+    parse_additional_info = staticmethod(parsers.Bs4Parser.parse_additional_info)
 
     def get_trainee_list_url(self) -> str:
-        return f"http://airforce.mil.kr:8081/user/emailPicViewSameMembers.action?" \
+        return f"{sessions.config.search_base_url}/user/emailPicViewSameMembers.action?" \
                f"siteId={self.agency.site_id}" \
                f"&searchName={self.trainee.name}&searchBirth={self.trainee.birthday}"
 
-    def search_trainee(self) -> List:
-        url = self.get_trainee_list_url()
-        soup = self.get_soup(url)
+    def get_cached_search_result(self) -> Optional[List]:
+        # 캐시에 검색 결과가 없으면 None, 검색 결과가 없다고 캐시된 경우 TraineeNotFoundException
+        return search_cache.get_search_result(self.trainee)
 
-        if "잘못된 접근입니다." in soup.text:
-            raise WrongAccessException()
-        elif "교육생이 없습니다." in soup.text:
-            raise TraineeNotFoundException()
+    def parse_search_result(self, content: bytes, content_type: Optional[str] = None) -> List:
+        # 트리를 만들기 전에 bytes 상태에서 에러 문구를 먼저 확인한다.
+        try:
+            parsers.check_search_page(content)
+        except TraineeNotFoundException as e:
+            search_cache.set_not_found(self.trainee, e)
+            raise
 
-        trainee_tags = soup.body.select('li')
         search_result = []
-        for trainee_tag in trainee_tags:
-            member_seq = self.parse_member_seq(trainee_tag)
-            additional_info = self.parse_additional_info(trainee_tag)
+        page = parsers.decode_page(content, content_type)
+        for member_seq, additional_info in parsers.get_parser().parse_trainees(page):
             searched_trainee = TraineeSearchResult(name = self.trainee.name, birthday = self.trainee.birthday,
                                                    member_seq = member_seq, additional_info = additional_info)
             search_result.append(searched_trainee.dict())
 
-        # DEBUG CODE
-        print(f"{AgencyIndex(self.trainee.agency_id).name} {self.trainee.name} 훈련병(교육생)이 확인되었습니다")
-        print(f"검색 결과: {len(search_result)}명")
-        print(search_result)
+        logger.debug("%s %s 훈련병(교육생) 검색 결과: %d명", AgencyIndex(self.trainee.agency_id).name,
+                     self.trainee.name, len(search_result))
+        search_cache.set_search_result(self.trainee, search_result)
         return search_result
 
+
+class TraineeSearcher(BaseTraineeSearcher):
+    @staticmethod
+    def get_page(url: str) -> requests.Response:
+        response = get_session().get(url)
+        response.raise_for_status()
+        return response
+
+    def search_trainee(self) -> List:
+        cached_search_result = self.get_cached_search_result()
+        if cached_search_result is not None:
+            return cached_search_result
+
+        url = self.get_trainee_list_url()
+        with throttle(self.agency.site_id):
+            with measure(SEARCH_FETCH, self.agency.site_id) as event:
+                response = self.get_page(url)
+                event.response_size = len(response.content)
+            with measure(SEARCH_PARSE, self.agency.site_id, response_size=len(response.content)):
+                return self.parse_search_result(response.content, response.headers.get('Content-Type'))
+
 # 2. 편지 보내기
 ## 편지 목록 페이지 접속
-class LetterListPageGetter:
+class BaseLetterListPageGetter:
+    """
+    편지 목록은 최신 편지부터 번호 역순으로 page 단위(&page=N)로 나뉘어 있다.
+    get_letter_list는 since보다 새 편지가 더 있을 수 있는 동안 다음 페이지를 읽되 MAX_PAGES까지만 읽는다.
+    """
+    MAX_PAGES = 50
+
     def __init__(self, trainee: Trainee):
         self.trainee = trainee
         self.agency = agencies[self.trainee.agency_id]
 
-    def get_letter_list_page_url(self) -> str:
-        return f"http://www.airforce.mil.kr:8081/user/indexSub.action?" \
+    def get_letter_list_page_url(self, page: int = 1) -> str:
+        return f"{sessions.config.base_url}/user/indexSub.action?" \
               f"codyMenuSeq={self.agency.cody_menu_seq}" \
               f"&siteId={self.agency.site_id}" \
               f"&menuUIType=sub&dum=dum&command2=getEmailList" \
               f"&searchName={parse.quote(self.trainee.name)}" \
               f"&searchBirth={self.trainee.birthday}" \
-              f"&memberSeq={self.trainee.member_seq}"
+              f"&memberSeq={self.trainee.member_seq}" \
+              f"&page={page}"
 
-    def get_letter_list_page(self) -> requests.Response:
+    def check_member_seq(self) -> None:
         if not self.trainee.member_seq:
             raise TraineeNotSearchedException()
 
-        url = self.get_letter_list_page_url()
-        response = requests.get(url)
-        response.raise_for_status()
+    @staticmethod
+    def check_letter_list_page(content: bytes) -> None:
+        parsers.check_letter_list_page(content)
 
-        # DEBUG CODE
-        print("인편 목록 페이지에 접속했습니다.\n url:", url)
+    @staticmethod
+    def parse_letter_list(content: bytes, since: int = 0,
+                          content_type: Optional[str] = None) -> List[LetterListEntry]:
+        page = parsers.decode_page(content, content_type)
+        return [LetterListEntry(number=number, title=title, sender_name=sender_name, sent_date=sent_date)
+                for number, title, sender_name, sent_date in parsers.get_parser().parse_letters(page)
+                if number > since]
 
-        if "잘못된 접근입니다." in response.text:
-            raise WrongAccessException()
-        elif "인터넷 편지 작성 기간이 아닙니다." in response.text:
-            raise LetterWritingPeriodException()
+    @staticmethod
+    def add_page(entries: List[LetterListEntry], page_entries: List[LetterListEntry], since: int) -> bool:
+        """
+        page_entries 중 since보다 새 편지를 entries에 더하고, 다음 페이지를 읽어야 하면 True
+        빈 페이지, 이미 읽은 번호가 다시 나온 페이지(마지막 페이지 뒤에서 첫 페이지를 다시 주는 경우),
+        since 이하 번호나 1번 편지가 나온 페이지에서 멈춘다.
+        """
+        seen = {entry.number for entry in entries}
+        if not page_entries or any(entry.number in seen for entry in page_entries):
+            return False
+        entries.extend(entry for entry in page_entries if entry.number > since)
+        return min(entry.number for entry in page_entries) > max(since, 1)
+
+
+class LetterListPageGetter(BaseLetterListPageGetter):
+    def get_letter_list_page(self, page: int = 1) -> requests.Response:
+        self.check_member_seq()
 
+        url = self.get_letter_list_page_url(page)
+        with throttle(self.agency.site_id), measure(LETTER_LIST_PAGE, self.agency.site_id) as event:
+            response = get_session().get(url)
+            response.raise_for_status()
+            event.response_size = len(response.content)
+
+            self.check_letter_list_page(response.content)
         return response
 
+    def get_letter_list(self, since: int = 0) -> List[LetterListEntry]:
+        """
+        편지 목록 페이지에 올라온 편지 중 번호가 since보다 큰 것만 반환한다.
+        """
+        entries = []
+        for page in range(1, self.MAX_PAGES + 1):
+            response = self.get_letter_list_page(page)
+            page_entries = self.parse_letter_list(response.content, content_type=response.headers.get('Content-Type'))
+            if not self.add_page(entries, page_entries, since):
+                break
+        return entries
+
 ## 편지 작성 후 전송
-class LetterSender:
+class BaseLetterSender:
     def __init__(self, trainee: Trainee, letter: Letter) -> None:
         self.trainee = trainee
         self.agency = agencies[self.trainee.agency_id]
@@ -118,22 +174,35 @@ class LetterSender:
         }
 
     def get_letter_write_page_url(self) -> str:
-        return f"http://www.airforce.mil.kr:8081/user/indexSub.action?" \
+        return f"{sessions.config.base_url}/user/indexSub.action?" \
                f"codyMenuSeq={self.agency.cody_menu_seq}&siteId={self.agency.site_id}" \
                f"&menuUIType=sub&dum=dum&command2=writeEmail&searchCate=&searchVal=&page=1"
 
+    @staticmethod
+    def get_letter_submit_page_url() -> str:
+        return f"{sessions.config.base_url}/user/emailPicSaveEmail.action"
+
+    @staticmethod
+    def check_letter_submit_page(content: bytes) -> None:
+        parsers.check_letter_submit_page(content)
+
+
+class LetterSender(BaseLetterSender):
     def get_letter_write_page(self, letter_list_page_url: str, prev_response: requests.Response,
                               session: requests.Session) -> requests.Response :
         additional_headers = {
             "Referer": letter_list_page_url
         }
         letter_write_page_url = self.get_letter_write_page_url()
-        letter_write_page_response = session.get(letter_write_page_url, cookies=prev_response.cookies,
-                                                 headers=additional_headers)
-        letter_write_page_response.raise_for_status()
-
-        # DEBUG CODE
-        print("인편 작성 페이지에 접속했습니다.\n url:", letter_write_page_url)
+        with throttle(self.agency.site_id), measure(LETTER_WRITE_PAGE, self.agency.site_id) as event:
+            letter_write_page_response = session.get(letter_write_page_url, cookies=prev_response.cookies,
+                                                     headers=additional_headers)
+            letter_write_page_response.raise_for_status()
+            event.response_size = len(letter_write_page_response.content)
+        # 목록 페이지에서 받은 세션 쿠키를 전송 요청까지 이어서 넘긴다.
+        for name, value in prev_response.cookies.items():
+            if name not in letter_write_page_response.cookies:
+                letter_write_page_response.cookies.set(name, value)
         return letter_write_page_response
 
     def submit_letter(self, data, prev_response: requests.Response,
@@ -141,26 +210,98 @@ class LetterSender:
         additional_headers = {
             "Referer": self.get_letter_write_page_url()
         }
-        letter_submit_page_url = "http://www.airforce.mil.kr:8081/user/emailPicSaveEmail.action"
-        letter_submit_page_response = session.post(letter_submit_page_url, cookies=prev_response.cookies, data=data,
-                                                   headers=additional_headers)
-        letter_submit_page_response.raise_for_status()
+        with throttle(self.agency.site_id), measure(LETTER_SUBMIT, self.agency.site_id) as event:
+            letter_submit_page_response = session.post(self.get_letter_submit_page_url(),
+                                                       cookies=prev_response.cookies, data=data,
+                                                       headers=additional_headers)
+            letter_submit_page_response.raise_for_status()
+            event.response_size = len(letter_submit_page_response.content)
 
-        # DEBUG CODE
-        print("인편을 성공적으로 전송했습니다.")
+            self.check_letter_submit_page(letter_submit_page_response.content)
 
-    def send_letter(self) -> None:
+    def open_letter_write_page(self, session: requests.Session) -> requests.Response:
+        """
+        편지 목록 페이지 -> 편지 작성 페이지 순서로 접속해 전송에 사용할 세션 쿠키를 받는다.
+        """
         letter_list_page_getter = LetterListPageGetter(self.trainee)
-        with requests.Session() as s:
-            # 편지 목록 페이지 접속
-            letter_list_page_url = letter_list_page_getter.get_letter_list_page_url()
-            letter_list_page_response = letter_list_page_getter.get_letter_list_page()
-
-            # 편지 작성 페이지 접속
-            letter_write_page_response = self.get_letter_write_page(letter_list_page_url,
-                                                               prev_response = letter_list_page_response,
-                                                               session = s)
-            # 편지 request form에 맞게 구성
-            http_request_body = self.create_request_form_data()
-            # 편지 전송
-            self.submit_letter(http_request_body, letter_write_page_response, session=s)
+        # 편지 목록 페이지 접속
+        letter_list_page_url = letter_list_page_getter.get_letter_list_page_url()
+        letter_list_page_response = letter_list_page_getter.get_letter_list_page()
+
+        # 편지 작성 페이지 접속
+        return self.get_letter_write_page(letter_list_page_url, prev_response = letter_list_page_response,
+                                          session = session)
+
+    def send_letter(self) -> None:
+        s = get_session()
+        letter_write_page_response = self.open_letter_write_page(s)
+        # 편지 request form에 맞게 구성
+        http_request_body = self.create_request_form_data()
+        # 편지 전송
+        self.submit_letter(http_request_body, letter_write_page_response, session=s)
+
+## 여러 편지를 한 번에 전송
+class BaseLetterBatchSender:
+    """
+    (Trainee, Letter) 목록을 훈련병(group_by='trainee') 또는 교육기관(group_by='agency')별로 묶어
+    그룹마다 목록/작성 페이지 접속은 한 번만 하고, 받은 세션 쿠키로 여러 편지를 전송한다.
+    세션이 만료되어 전송이 거부되면(WrongAccessException) 한 번 다시 접속한 뒤 재전송한다.
+    """
+    GROUP_BY_TRAINEE = 'trainee'
+    GROUP_BY_AGENCY = 'agency'
+
+    def __init__(self, pairs: Iterable[Tuple[Trainee, Letter]], group_by: str = GROUP_BY_TRAINEE) -> None:
+        if group_by not in (self.GROUP_BY_TRAINEE, self.GROUP_BY_AGENCY):
+            raise ValueError(f"group_by는 '{self.GROUP_BY_TRAINEE}' 또는 '{self.GROUP_BY_AGENCY}'이어야 합니다.")
+        self.pairs = list(pairs)
+        self.group_by = group_by
+
+    def get_group_key(self, trainee: Trainee) -> tuple:
+        if self.group_by == self.GROUP_BY_AGENCY:
+            return (trainee.agency_id,)
+        return trainee.agency_id, trainee.member_seq
+
+    def get_groups(self) -> List[List[Tuple[int, Trainee, Letter]]]:
+        """
+        결과를 입력 순서대로 돌려줄 수 있도록 (입력 index, Trainee, Letter)로 묶는다.
+        """
+        groups = {}
+        for index, (trainee, letter) in enumerate(self.pairs):
+            groups.setdefault(self.get_group_key(trainee), []).append((index, trainee, letter))
+        return list(groups.values())
+
+
+class LetterBatchSender(BaseLetterBatchSender):
+    def send_group(self, group: List[Tuple[int, Trainee, Letter]], results: List) -> None:
+        s = get_session()
+        letter_write_page_response = None
+        for index, trainee, letter in group:
+            sender = LetterSender(trainee, letter)
+            http_request_body = sender.create_request_form_data()
+            if not trainee.member_seq:
+                results[index] = TraineeNotSearchedException()
+                continue
+            try:
+                if letter_write_page_response is None:
+                    letter_write_page_response = sender.open_letter_write_page(s)
+                    sender.submit_letter(http_request_body, letter_write_page_response, session=s)
+                else:
+                    try:
+                        sender.submit_letter(http_request_body, letter_write_page_response, session=s)
+                    except WrongAccessException:
+                        letter_write_page_response = sender.open_letter_write_page(s)
+                        sender.submit_letter(http_request_body, letter_write_page_response, session=s)
+                results[index] = None
+            except Exception as e:
+                # 다음 편지는 새로 접속해서 보낸다.
+                letter_write_page_response = None
+                results[index] = e
+
+    def send_letters(self) -> List:
+        """
+        결과는 입력 순서대로 None(성공) 또는 발생한 예외(CrawlerException 등)이다.
+        """
+        results = [None] * len(self.pairs)
+        for group in self.get_groups():
+            self.send_group(group, results)
+        return results
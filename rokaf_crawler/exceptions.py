@@ -21,6 +21,11 @@ class TraineeNotSearchedException(CrawlerException):
         self.message = message
         super().__init__(self.message)
 
+class CircuitOpenException(CrawlerException):
+    def __init__(self, message="인편 사이트 응답이 불안정합니다. 잠시 후 다시 시도해주세요."):
+        self.message = message
+        super().__init__(self.message)
+
 TRAINEE_NOT_FOUND = "교육생이 없습니다."
 WRONG_ACCESS = "잘못된 접근입니다."
 LETTER_WRITING_PERIOD = "인터넷 편지 작성 기간이 아닙니다."
@@ -0,0 +1,333 @@
+"""
+공군 인편 사이트(airforce.mil.kr:8081)를 흉내 내는 로컬 서버
+
+실제 사이트에 부하 테스트를 할 수 없으므로 crawler가 사용하는 endpoint를 같은 형태의 HTML로 응답한다.
+    - emailPicViewSameMembers.action: 훈련병 검색 (검색 결과 / 교육생이 없습니다 / 잘못된 접근입니다)
+    - indexSub.action?command2=getEmailList: 편지 목록 페이지 (세션 쿠키 발급, 작성 기간 아님)
+    - indexSub.action?command2=writeEmail: 편지 작성 페이지
+    - emailPicSaveEmail.action: 편지 전송
+
+    python -m rokaf_crawler.fake_server --port 8081 --latency 0.2 --error-rate 0.01
+crawler가 이 서버를 사용하도록 하려면 rokaf_crawler.sessions.configure(base_url=..., search_base_url=...)
+(Django에서는 CRAWLER_BASE_URL 환경변수)로 주소를 바꾼다.
+"""
+import argparse
+import html
+import random
+import threading
+import time
+import uuid
+import zlib
+from datetime import date
+from http import cookies
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from string import Template
+from typing import List, Optional
+from urllib import parse
+
+from pydantic import BaseModel
+
+FIXTURES_DIR = Path(__file__).resolve().parent / 'fixtures'
+
+SEARCH_RESULT_ROW = Template("""\
+            <li>
+                <div class="choice"><input type="button" class="btn_choice" value="선택" onclick="fn_viewMember('$member_seq');"></div>
+                <div class="info">
+                    <dl><dt>성명</dt><dd>: $name</dd></dl>
+                    <dl><dt>생년월일</dt><dd>: $birthday</dd></dl>
+                    <dl><dt>소속 대대</dt><dd>: 제 $battalion 대대</dd></dl>
+                    <dl><dt>소속 중대</dt><dd>: 제 $company 중대</dd></dl>
+                </div>
+            </li>""")
+
+LETTER_LIST_ROW = Template("""\
+            <tr><td>$number</td><td class="subject">$title</td><td>$sender_name</td><td>$sent_date</td></tr>""")
+
+SESSION_COOKIE = 'JSESSIONID'
+
+
+class FakeServerConfig(BaseModel):
+    host: str = '127.0.0.1'
+    port: int = 8081
+    # 응답 지연(초)과 지연 편차
+    latency: float = 0.0
+    latency_jitter: float = 0.0
+    # 503 응답 비율과 "잘못된 접근입니다." 응답 비율
+    error_rate: float = 0.0
+    wrong_access_rate: float = 0.0
+    # 검색 결과가 없는 이름, 또는 검색 결과가 없는 비율
+    not_found_names: List[str] = []
+    not_found_rate: float = 0.0
+    # 검색 1건당 나오는 동명이인 수
+    trainees_per_search: int = 1
+    # 편지 목록 한 페이지(&page=N)에 나오는 편지 수
+    letters_per_page: int = 10
+    # False면 편지 목록 페이지가 "인터넷 편지 작성 기간이 아닙니다."를 응답한다.
+    writing_period: bool = True
+    # True면 작성/전송 요청에 목록 페이지에서 발급한 세션 쿠키가 있어야 한다.
+    require_cookie: bool = True
+    # 응답 페이지 인코딩 (Content-Type의 charset과 <meta charset>에도 사용)
+    encoding: str = 'utf-8'
+    seed: Optional[int] = None
+
+    class Config:
+        extra = "forbid"
+
+
+def load_template(name: str) -> Template:
+    return Template((FIXTURES_DIR / name).read_text(encoding='utf-8'))
+
+
+def load_page(name: str) -> str:
+    return (FIXTURES_DIR / name).read_text(encoding='utf-8')
+
+
+def get_member_seq(site_id: str, name: str, birthday: str, index: int = 0) -> str:
+    return str(1000000 + (zlib.crc32(f"{site_id}:{name}:{birthday}".encode()) + index) % 9000000)
+
+
+class FakeSite:
+    """
+    fake 사이트의 상태(발급한 세션, 전송된 편지)와 endpoint별 응답 생성
+    """
+    def __init__(self, config: FakeServerConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.sessions = set()
+        # member_seq -> 전송된 편지(form data) 목록
+        self.letters = {}
+        self.request_counts = {}
+
+        self.search_result_template = load_template('search_result_template.html')
+        self.letter_list_template = load_template('letter_list.html')
+        self.letter_write_template = load_template('letter_write.html')
+        self.letter_submit_template = load_template('letter_submit.html')
+        self.trainee_not_found_page = load_page('trainee_not_found.html')
+        self.wrong_access_page = load_page('wrong_access.html')
+        self.letter_writing_period_page = load_page('letter_writing_period.html')
+
+    def chance(self, rate: float) -> bool:
+        with self.lock:
+            return rate > 0 and self.random.random() < rate
+
+    def sleep(self) -> None:
+        latency = self.config.latency
+        if self.config.latency_jitter:
+            with self.lock:
+                latency += self.random.uniform(-self.config.latency_jitter, self.config.latency_jitter)
+        if latency > 0:
+            time.sleep(latency)
+
+    def has_session(self, cookie_header: Optional[str]) -> bool:
+        if not self.config.require_cookie:
+            return True
+        cookie = cookies.SimpleCookie(cookie_header or '')
+        return SESSION_COOKIE in cookie and cookie[SESSION_COOKIE].value in self.sessions
+
+    def encode_page(self, content: str) -> bytes:
+        content = content.replace('<meta charset="UTF-8">', f'<meta charset="{self.config.encoding}">')
+        return content.encode(self.config.encoding)
+
+    def handle(self, method: str, path: str, headers, body: bytes) -> tuple:
+        """
+        (status, 추가 header dict, body)를 반환한다. body가 str이면 respond에서 config.encoding으로 인코딩한다.
+        """
+        url = parse.urlsplit(path)
+        query = {key: values[0] for key, values in parse.parse_qs(url.query, keep_blank_values=True).items()}
+        endpoint = url.path.rsplit('/', 1)[-1]
+        if endpoint == 'indexSub.action':
+            endpoint = f"{endpoint}:{query.get('command2', '')}"
+        with self.lock:
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+
+        self.sleep()
+        if self.chance(self.config.error_rate):
+            return 503, {}, b'Service Unavailable'
+        if self.chance(self.config.wrong_access_rate):
+            return 200, {}, self.wrong_access_page
+
+        if method == 'GET' and endpoint == 'emailPicViewSameMembers.action':
+            return self.search(query)
+        if method == 'GET' and endpoint == 'indexSub.action:getEmailList':
+            return self.letter_list(query)
+        if method == 'GET' and endpoint == 'indexSub.action:writeEmail':
+            return self.letter_write(query, headers.get('Cookie'))
+        if method == 'POST' and endpoint == 'emailPicSaveEmail.action':
+            form = {key: values[0] for key, values in parse.parse_qs(body.decode('utf-8'),
+                                                                     keep_blank_values=True).items()}
+            return self.letter_submit(form, headers.get('Cookie'))
+        return 404, {}, b'Not Found'
+
+    def search(self, query: dict) -> tuple:
+        site_id, name, birthday = query.get('siteId', ''), query.get('searchName', ''), query.get('searchBirth', '')
+        if not (site_id and name and birthday):
+            return 200, {}, self.wrong_access_page
+        if name in self.config.not_found_names or self.chance(self.config.not_found_rate):
+            return 200, {}, self.trainee_not_found_page
+
+        rows = []
+        for index in range(self.config.trainees_per_search):
+            member_seq = get_member_seq(site_id, name, birthday, index)
+            rows.append(SEARCH_RESULT_ROW.substitute(member_seq=member_seq, name=html.escape(name),
+                                                     birthday=f"{birthday[:4]}-{birthday[4:6]}-{birthday[6:]}",
+                                                     battalion=int(member_seq) % 3 + 1,
+                                                     company=int(member_seq) % 9 + 1))
+        return 200, {}, self.search_result_template.substitute(rows="\n".join(rows))
+
+    def letter_list(self, query: dict) -> tuple:
+        member_seq = query.get('memberSeq', '')
+        if not member_seq:
+            return 200, {}, self.wrong_access_page
+        if not self.config.writing_period:
+            return 200, {}, self.letter_writing_period_page
+
+        with self.lock:
+            letters = list(self.letters.get(member_seq, []))
+        # 최신 편지부터 letters_per_page개씩 나누고, 마지막 페이지 뒤는 빈 목록을 준다.
+        try:
+            page = max(int(query.get('page') or 1), 1)
+        except ValueError:
+            page = 1
+        per_page = self.config.letters_per_page
+        numbered = list(reversed(list(enumerate(letters, start=1))))[(page - 1) * per_page:page * per_page]
+        rows = [LETTER_LIST_ROW.substitute(number=number, title=html.escape(letter.get('title', '')),
+                                           sender_name=html.escape(letter.get('senderName', '')),
+                                           sent_date=letter['sent_date'])
+                for number, letter in numbered]
+        content = self.letter_list_template.substitute(cody_menu_seq=query.get('codyMenuSeq', ''),
+                                                       site_id=query.get('siteId', ''),
+                                                       name=html.escape(query.get('searchName', '')),
+                                                       rows="\n".join(rows))
+
+        headers = {}
+        if self.config.require_cookie:
+            session_id = uuid.uuid4().hex.upper()
+            with self.lock:
+                self.sessions.add(session_id)
+            headers['Set-Cookie'] = f"{SESSION_COOKIE}={session_id}; Path=/"
+        return 200, headers, content
+
+    def letter_write(self, query: dict, cookie_header: Optional[str]) -> tuple:
+        if not self.has_session(cookie_header):
+            return 200, {}, self.wrong_access_page
+        return 200, {}, self.letter_write_template.substitute(site_id=query.get('siteId', ''))
+
+    def letter_submit(self, form: dict, cookie_header: Optional[str]) -> tuple:
+        member_seq = form.get('memberSeqVal', '')
+        if not member_seq or not self.has_session(cookie_header):
+            return 200, {}, self.wrong_access_page
+        if not self.config.writing_period:
+            return 200, {}, self.letter_writing_period_page
+
+        letter = {**form, 'sent_date': date.today().isoformat()}
+        with self.lock:
+            self.letters.setdefault(member_seq, []).append(letter)
+        return 200, {}, self.letter_submit_template.substitute(cody_menu_seq='', site_id=form.get('siteId', ''),
+                                                               member_seq=member_seq)
+
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    # keep-alive 연결을 유지해야 crawler의 connection pool 동작을 그대로 확인할 수 있다.
+    protocol_version = 'HTTP/1.1'
+
+    def respond(self, method: str) -> None:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        site = self.server.site
+        status, headers, content = site.handle(method, self.path, self.headers, body)
+        if isinstance(content, str):
+            content = site.encode_page(content)
+
+        self.send_response(status)
+        self.send_header('Content-Type', f'text/html; charset={site.config.encoding}')
+        self.send_header('Content-Length', str(len(content)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self) -> None:
+        self.respond('GET')
+
+    def do_POST(self) -> None:
+        self.respond('POST')
+
+    def log_message(self, format, *args) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class FakeServer(ThreadingHTTPServer):
+    """
+    테스트/벤치마크 코드 안에서 사용할 때:
+        with FakeServer(FakeServerConfig(port=0, latency=0.05)) as server:
+            sessions.configure(base_url=server.url, search_base_url=server.url)
+            ...
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, config: Optional[FakeServerConfig] = None, verbose: bool = False):
+        self.config = config or FakeServerConfig()
+        self.site = FakeSite(self.config)
+        self.verbose = verbose
+        self.thread = None
+        super().__init__((self.config.host, self.config.port), FakeRequestHandler)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'FakeServer':
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> 'FakeServer':
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8081)
+    arg_parser.add_argument('--latency', type=float, default=0.0)
+    arg_parser.add_argument('--latency-jitter', type=float, default=0.0)
+    arg_parser.add_argument('--error-rate', type=float, default=0.0)
+    arg_parser.add_argument('--wrong-access-rate', type=float, default=0.0)
+    arg_parser.add_argument('--not-found-rate', type=float, default=0.0)
+    arg_parser.add_argument('--not-found-name', dest='not_found_names', action='append', default=[])
+    arg_parser.add_argument('--trainees-per-search', type=int, default=1)
+    arg_parser.add_argument('--letters-per-page', type=int, default=10)
+    arg_parser.add_argument('--closed', dest='writing_period', action='store_false',
+                            help='편지 작성 기간이 아닌 상태로 응답')
+    arg_parser.add_argument('--no-cookie', dest='require_cookie', action='store_false',
+                            help='세션 쿠키 없이도 작성/전송 허용')
+    arg_parser.add_argument('--encoding', default='utf-8', help='응답 페이지 인코딩 (예: cp949)')
+    arg_parser.add_argument('--seed', type=int)
+    arg_parser.add_argument('-v', '--verbose', action='store_true')
+    args = vars(arg_parser.parse_args())
+    verbose = args.pop('verbose')
+
+    server = FakeServer(FakeServerConfig(**args), verbose=verbose)
+    print(f"fake 인편 사이트: {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Dict, List
+
+from pydantic import BaseModel
+
+from rokaf_crawler.throttling import is_upstream_failure
+
+# crawler 단계별 시간 측정
+# 각 단계(검색 요청/파싱, 목록 페이지, 작성 페이지, 전송)가 끝날 때마다 CrawlerEvent를 만들어 등록된 sink로 보낸다.
+
+__all__ = ['SEARCH_FETCH', 'SEARCH_PARSE', 'LETTER_LIST_PAGE', 'LETTER_WRITE_PAGE', 'LETTER_SUBMIT', 'STEPS', 'OK',
+           'CrawlerEvent', 'Sink', 'LoggingSink', 'HistogramSink', 'PrometheusSink', 'add_sink', 'remove_sink',
+           'emit', 'measure']
+
+logger = logging.getLogger(__name__)
+
+SEARCH_FETCH = 'search_fetch'
+SEARCH_PARSE = 'search_parse'
+LETTER_LIST_PAGE = 'letter_list_page'
+LETTER_WRITE_PAGE = 'letter_write_page'
+LETTER_SUBMIT = 'letter_submit'
+STEPS = (SEARCH_FETCH, SEARCH_PARSE, LETTER_LIST_PAGE, LETTER_WRITE_PAGE, LETTER_SUBMIT)
+
+OK = 'ok'
+
+
+class CrawlerEvent(BaseModel):
+    step: str
+    agency: str
+    # 초 단위
+    duration: float = 0.0
+    response_size: int = 0
+    # 성공하면 'ok', 실패하면 예외 클래스 이름
+    outcome: str = OK
+    # 사이트 상태 문제로 실패했는지 (훈련병이 없는 경우처럼 정상 응답에서 나온 예외는 False)
+    upstream_failure: bool = False
+
+
+class Sink(ABC):
+    @abstractmethod
+    def emit(self, event: CrawlerEvent) -> None:
+        pass
+
+
+class LoggingSink(Sink):
+    def __init__(self, logger: logging.Logger = logger, level: int = logging.DEBUG):
+        self.logger = logger
+        self.level = level
+
+    def emit(self, event: CrawlerEvent) -> None:
+        level = max(self.level, logging.WARNING) if event.upstream_failure else self.level
+        self.logger.log(level, "step=%s agency=%s duration_ms=%.1f size=%d outcome=%s",
+                        event.step, event.agency, event.duration * 1000, event.response_size, event.outcome,
+                        extra={'crawler_event': event.model_dump()})
+
+
+class HistogramSink(Sink):
+    """
+    단계별 소요 시간을 메모리에 모아 두고 percentile 요약을 제공한다.
+    """
+    def __init__(self, maxlen: int = 10000):
+        self._lock = threading.Lock()
+        self._durations = defaultdict(lambda: deque(maxlen=maxlen))
+        self._outcomes = defaultdict(lambda: defaultdict(int))
+        self._response_sizes = defaultdict(int)
+
+    def emit(self, event: CrawlerEvent) -> None:
+        with self._lock:
+            self._durations[event.step].append(event.duration)
+            self._outcomes[event.step][event.outcome] += 1
+            self._response_sizes[event.step] += event.response_size
+
+    @staticmethod
+    def percentile(sorted_values: List[float], p: float) -> float:
+        index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+        return sorted_values[index]
+
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            result = {}
+            for step, durations in self._durations.items():
+                values = sorted(durations)
+                count = sum(self._outcomes[step].values())
+                result[step] = {
+                    'count': count,
+                    'mean': sum(values) / len(values),
+                    'p50': self.percentile(values, 50),
+                    'p95': self.percentile(values, 95),
+                    'p99': self.percentile(values, 99),
+                    'max': values[-1],
+                    'response_bytes': self._response_sizes[step],
+                    'outcomes': dict(self._outcomes[step]),
+                }
+            return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._durations.clear()
+            self._outcomes.clear()
+            self._response_sizes.clear()
+
+
+class PrometheusSink(Sink):
+    """
+    Prometheus text exposition format으로 내보낼 수 있는 histogram
+    Django에서는 api.apps.ApiConfig.ready에서 등록하고 metrics/crawler/ 로 내보낸다.
+    """
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, prefix: str = 'rokaf_crawler', buckets: tuple = BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def emit(self, event: CrawlerEvent) -> None:
+        labels = (event.step, event.agency, event.outcome)
+        with self._lock:
+            series = self._series.setdefault(labels, {'buckets': [0] * len(self.buckets), 'sum': 0.0,
+                                                      'count': 0, 'bytes': 0})
+            for i, bound in enumerate(self.buckets):
+                if event.duration <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += event.duration
+            series['count'] += 1
+            series['bytes'] += event.response_size
+
+    def render(self) -> str:
+        name = f"{self.prefix}_step_duration_seconds"
+        bytes_name = f"{self.prefix}_response_bytes_total"
+        lines = [f"# HELP {name} Duration of upstream crawler steps.", f"# TYPE {name} histogram"]
+        byte_lines = [f"# HELP {bytes_name} Response bytes received per crawler step.",
+                      f"# TYPE {bytes_name} counter"]
+        with self._lock:
+            for (step, agency, outcome), series in sorted(self._series.items()):
+                labels = f'step="{step}",agency="{agency}",outcome="{outcome}"'
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {series["count"]}')
+                lines.append(f'{name}_sum{{{labels}}} {series["sum"]}')
+                lines.append(f'{name}_count{{{labels}}} {series["count"]}')
+                byte_lines.append(f'{bytes_name}{{{labels}}} {series["bytes"]}')
+        return "\n".join(lines + byte_lines) + "\n"
+
+
+_sinks: List[Sink] = [LoggingSink()]
+
+
+def add_sink(sink: Sink) -> Sink:
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink: Sink) -> None:
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+def emit(event: CrawlerEvent) -> None:
+    for sink in list(_sinks):
+        try:
+            sink.emit(event)
+        except Exception:
+            # 측정 실패가 편지 전송을 막으면 안 된다.
+            logger.exception("crawler event sink failed: %r", sink)
+
+
+@contextmanager
+def measure(step: str, agency: str, response_size: int = 0):
+    """
+        with measure(LETTER_SUBMIT, site_id) as event:
+            response = ...
+            event.response_size = len(response.content)
+    블록이 끝나면 소요 시간과 결과(예외 이름)를 채워 emit한다.
+    """
+    event = CrawlerEvent(step=step, agency=agency, response_size=response_size)
+    started_at = time.perf_counter()
+    try:
+        yield event
+    except BaseException as e:
+        event.outcome = type(e).__name__
+        event.upstream_failure = is_upstream_failure(e)
+        raise
+    finally:
+        event.duration = time.perf_counter() - started_at
+        emit(event)
@@ -29,6 +29,14 @@ class TraineeSearchResult(BaseModel):
     additional_info: dict
 
 
+class LetterListEntry(BaseModel):
+    # 편지 목록 페이지의 한 행
+    number: int
+    title: str
+    sender_name: str
+    sent_date: str
+
+
 class Trainee(BaseModel):
     name: str
     birthday: str
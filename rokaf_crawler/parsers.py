@@ -0,0 +1,258 @@
+import codecs
+import importlib.util
+import re
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from rokaf_crawler.exceptions import *
+
+# 공군 인편 페이지 파서
+# 페이지에서 필요한 정보는 li 태그의 onclick 속 member_seq와 dl(dt/dd) 쌍뿐이므로
+# BeautifulSoup 전체 트리 대신 lxml/selectolax를 우선 사용하고, 둘 다 없으면 bs4로 파싱한다.
+# backend는 설치 여부만 먼저 확인하고, 실제로 파싱할 때 import한다.
+# backend마다 bytes의 인코딩을 추측하는 방식이 달라(lxml은 <meta charset>이 없으면 latin-1, selectolax는 utf-8)
+# 페이지는 decode_page로 응답의 charset에 맞게 먼저 디코딩하고 str로 넘긴다.
+
+
+def is_installed(module_name: str) -> bool:
+    try:
+        return importlib.util.find_spec(module_name) is not None
+    except ModuleNotFoundError:
+        return False
+
+
+@lru_cache(maxsize=None)
+def get_selectolax_parser():
+    if is_installed('selectolax.lexbor'):
+        from selectolax.lexbor import LexborHTMLParser
+        return LexborHTMLParser
+    from selectolax.parser import HTMLParser
+    return HTMLParser
+
+INT_PATTERN = re.compile(r'\d+')
+
+# 사이트 인코딩에 관계없이 bytes 상태에서 바로 에러 문구를 찾을 수 있도록 미리 인코딩해 둔다.
+ENCODINGS = ('utf-8', 'cp949')
+
+
+def encode_marker(marker: str) -> Tuple[bytes, ...]:
+    return tuple(marker.encode(encoding) for encoding in ENCODINGS)
+
+
+WRONG_ACCESS_MARKERS = encode_marker(WRONG_ACCESS)
+TRAINEE_NOT_FOUND_MARKERS = encode_marker(TRAINEE_NOT_FOUND)
+LETTER_WRITING_PERIOD_MARKERS = encode_marker(LETTER_WRITING_PERIOD)
+
+
+CHARSET_PATTERN = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.I)
+META_CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?([\w.:-]+)', re.I)
+# EUC-KR로 선언한 페이지도 CP949 확장 글자(똠, 햏 등)를 쓰는 경우가 많으므로 CP949로 디코딩한다.
+ENCODING_ALIASES = {'euc-kr': 'cp949', 'euc_kr': 'cp949', 'ks_c_5601-1987': 'cp949', 'windows-949': 'cp949'}
+
+
+def get_charset(content_type: Optional[str]) -> Optional[str]:
+    """
+    "text/html; charset=EUC-KR" -> "EUC-KR"
+    """
+    match = CHARSET_PATTERN.search(content_type or '')
+    return match.group(1) if match else None
+
+
+def get_encoding(charset: Optional[str]) -> Optional[str]:
+    if not charset:
+        return None
+    charset = charset.strip().lower()
+    try:
+        return codecs.lookup(ENCODING_ALIASES.get(charset, charset)).name
+    except LookupError:
+        return None
+
+
+def decode_page(content: bytes, content_type: Optional[str] = None) -> str:
+    """
+    BOM -> HTTP Content-Type의 charset -> 페이지의 <meta charset> 순서로 인코딩을 정해 디코딩한다.
+    셋 다 없으면 utf-8로, utf-8이 아니면 cp949로 디코딩한다.
+    """
+    if content.startswith(codecs.BOM_UTF8):
+        return content.decode('utf-8-sig', errors='replace')
+
+    meta_match = META_CHARSET_PATTERN.search(content, 0, 2048)
+    for charset in (get_charset(content_type), meta_match and meta_match.group(1).decode('ascii')):
+        encoding = get_encoding(charset)
+        if encoding is not None:
+            return content.decode(encoding, errors='replace')
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        return content.decode('cp949', errors='replace')
+
+
+def contains_marker(content: bytes, markers: Tuple[bytes, ...]) -> bool:
+    return any(marker in content for marker in markers)
+
+
+def check_search_page(content: bytes) -> None:
+    if contains_marker(content, WRONG_ACCESS_MARKERS):
+        raise WrongAccessException()
+    elif contains_marker(content, TRAINEE_NOT_FOUND_MARKERS):
+        raise TraineeNotFoundException()
+
+
+def check_letter_list_page(content: bytes) -> None:
+    if contains_marker(content, WRONG_ACCESS_MARKERS):
+        raise WrongAccessException()
+    elif contains_marker(content, LETTER_WRITING_PERIOD_MARKERS):
+        raise LetterWritingPeriodException()
+
+
+def check_letter_submit_page(content: bytes) -> None:
+    # 세션이 만료되었거나 작성 기간이 끝난 경우 전송 응답으로 에러 페이지가 온다.
+    check_letter_list_page(content)
+
+
+def normalize_info(dt_text: str, dd_text: str) -> Tuple[str, str]:
+    # dd는 ": 값" 형태이므로 첫 토큰을 버린다.
+    return " ".join(dt_text.split()), " ".join(dd_text.split()[1:])
+
+
+def normalize_letter_row(cells: List[str]) -> Optional[Tuple[int, str, str, str]]:
+    # 번호, 제목, 작성자, 작성일 순서. "등록된 편지가 없습니다" 같은 행은 번호가 없으므로 건너뛴다.
+    cells = [" ".join(cell.split()) for cell in cells]
+    if len(cells) < 4 or not cells[0].isdigit():
+        return None
+    return int(cells[0]), cells[1], cells[2], cells[3]
+
+
+class Parser(ABC):
+    """
+    검색 결과 / 편지 목록 페이지 파서 (content는 decode_page로 디코딩한 페이지)
+    parse_trainees는 (member_seq, additional_info) 목록을,
+    parse_letters는 (번호, 제목, 작성자, 작성일) 목록을 반환한다.
+    """
+    name = None
+
+    @abstractmethod
+    def parse_trainees(self, content: str) -> List[Tuple[str, Dict[str, str]]]:
+        pass
+
+    @abstractmethod
+    def parse_letters(self, content: str) -> List[Tuple[int, str, str, str]]:
+        pass
+
+
+class Bs4Parser(Parser):
+    name = 'bs4'
+
+    @staticmethod
+    def parse_member_seq(trainee_tag) -> str:
+        return INT_PATTERN.findall(trainee_tag.input['onclick'])[0]
+
+    @staticmethod
+    def parse_additional_info(trainee_tag) -> dict:
+        additional_info = {}
+        for info_dl in trainee_tag.find(class_='info').select('dl'):
+            key, value = normalize_info(info_dl.dt.text, info_dl.dd.text)
+            additional_info[key] = value
+        return additional_info
+
+    def parse_trainees(self, content: str) -> List[Tuple[str, Dict[str, str]]]:
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(content, 'html.parser')
+        return [(self.parse_member_seq(trainee_tag), self.parse_additional_info(trainee_tag))
+                for trainee_tag in soup.body.select('li')]
+
+    def parse_letters(self, content: str) -> List[Tuple[int, str, str, str]]:
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(content, 'html.parser')
+        rows = [normalize_letter_row([td.text for td in row_tag.select('td')])
+                for row_tag in soup.select('table.board_list tbody tr')]
+        return [row for row in rows if row is not None]
+
+
+class LxmlParser(Parser):
+    name = 'lxml'
+
+    def parse_trainees(self, content: str) -> List[Tuple[str, Dict[str, str]]]:
+        import lxml.html
+        document = lxml.html.fromstring(content)
+        trainees = []
+        for trainee_tag in document.body.iter('li'):
+            onclick_func = next(trainee_tag.iter('input')).get('onclick')
+            additional_info = {}
+            info_tag = trainee_tag.find_class('info')[0]
+            for info_dl in info_tag.iter('dl'):
+                key, value = normalize_info(next(info_dl.iter('dt')).text_content(),
+                                            next(info_dl.iter('dd')).text_content())
+                additional_info[key] = value
+            trainees.append((INT_PATTERN.findall(onclick_func)[0], additional_info))
+        return trainees
+
+    def parse_letters(self, content: str) -> List[Tuple[int, str, str, str]]:
+        import lxml.html
+        document = lxml.html.fromstring(content)
+        rows = []
+        for table_tag in document.find_class('board_list'):
+            for tbody_tag in table_tag.iter('tbody'):
+                for row_tag in tbody_tag.iter('tr'):
+                    rows.append(normalize_letter_row([td.text_content() for td in row_tag.iter('td')]))
+        return [row for row in rows if row is not None]
+
+
+class SelectolaxParser(Parser):
+    name = 'selectolax'
+
+    def parse_trainees(self, content: str) -> List[Tuple[str, Dict[str, str]]]:
+        tree = get_selectolax_parser()(content)
+        trainees = []
+        for trainee_tag in tree.body.css('li'):
+            onclick_func = trainee_tag.css_first('input').attributes['onclick']
+            additional_info = {}
+            for info_dl in trainee_tag.css_first('.info').css('dl'):
+                key, value = normalize_info(info_dl.css_first('dt').text(), info_dl.css_first('dd').text())
+                additional_info[key] = value
+            trainees.append((INT_PATTERN.findall(onclick_func)[0], additional_info))
+        return trainees
+
+    def parse_letters(self, content: str) -> List[Tuple[int, str, str, str]]:
+        tree = get_selectolax_parser()(content)
+        rows = [normalize_letter_row([td.text() for td in row_tag.css('td')])
+                for row_tag in tree.css('table.board_list tbody tr')]
+        return [row for row in rows if row is not None]
+
+
+def available_parsers() -> Dict[str, Parser]:
+    parsers = {}
+    if is_installed('selectolax'):
+        parsers[SelectolaxParser.name] = SelectolaxParser()
+    if is_installed('lxml'):
+        parsers[LxmlParser.name] = LxmlParser()
+    parsers[Bs4Parser.name] = Bs4Parser()
+    return parsers
+
+
+_parser = None
+
+
+def get_parser() -> Parser:
+    global _parser
+    if _parser is None:
+        # 설치된 backend 중 가장 빠른 것을 사용한다. (selectolax > lxml > bs4)
+        _parser = next(iter(available_parsers().values()))
+    return _parser
+
+
+def set_parser(name: Optional[str] = None) -> Parser:
+    """
+    사용할 backend 지정 ('selectolax', 'lxml', 'bs4'). None이면 자동 선택
+    """
+    global _parser
+    if name is None:
+        _parser = None
+        return get_parser()
+
+    parsers = available_parsers()
+    if name not in parsers:
+        raise ValueError(f"사용할 수 없는 parser입니다: {name} (사용 가능: {', '.join(parsers)})")
+    _parser = parsers[name]
+    return _parser
@@ -0,0 +1,186 @@
+import asyncio
+import os
+import threading
+import weakref
+from functools import lru_cache
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import TYPE_CHECKING, Optional
+
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    import httpx
+    import requests
+
+# 모든 crawler 클래스가 공유하는 프로세스 단위 connection pool
+# 편지 여러 통을 보낼 때 매번 새 TCP 연결을 맺지 않고 keep-alive 연결을 재사용한다.
+# requests/httpx는 import 비용이 크므로 session/client를 처음 만들 때 불러온다.
+
+
+class HttpConfig(BaseModel):
+    # 공군 인편 사이트 주소 (부하 테스트 시 rokaf_crawler.fake_server 주소로 바꿀 수 있다.)
+    search_base_url: str = "http://airforce.mil.kr:8081"
+    base_url: str = "http://www.airforce.mil.kr:8081"
+
+    connect_timeout: float = 5.0
+    read_timeout: float = 20.0
+    # requests: pool_connections개 host의 pool을 유지하고, host마다 최대 pool_maxsize개의 연결을 재사용한다.
+    pool_connections: int = 10
+    pool_maxsize: int = 20
+    # httpx.AsyncClient는 host별이 아니라 client 전체(모든 host 합계)의 연결 수만 제한할 수 있다.
+    # None이면 requests pool 전체와 같은 pool_connections * pool_maxsize
+    max_connections: Optional[int] = None
+    keepalive_expiry: float = 30.0
+    # 연결 실패/일시적인 5xx 응답에 대한 재시도 (POST는 중복 전송을 막기 위해 연결 실패만 재시도)
+    max_retries: int = 2
+    backoff_factor: float = 0.3
+    status_forcelist: tuple = (502, 503, 504)
+
+    class Config:
+        extra = "forbid"
+
+    @property
+    def timeout(self) -> tuple:
+        return self.connect_timeout, self.read_timeout
+
+    @property
+    def total_max_connections(self) -> int:
+        return self.max_connections or self.pool_connections * self.pool_maxsize
+
+
+config = HttpConfig()
+
+_lock = threading.Lock()
+_session = None
+_session_pid = None
+_async_clients = weakref.WeakKeyDictionary()
+# configure()에서 닫는 중인 client (aclose task가 끝나기 전에 GC되지 않도록 잡아 둔다.)
+_closing = set()
+
+
+def no_cookie_jar() -> CookieJar:
+    """
+    공유 session/client에는 쿠키를 저장하지 않는다.
+    동시에 보내는 편지끼리 세션 쿠키가 섞이지 않도록 쿠키는 이전 응답에서 꺼내 요청마다 직접 넘긴다.
+    """
+    return CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))
+
+
+@lru_cache(maxsize=None)
+def get_session_class() -> type:
+    """
+    timeout 기본값이 있는 requests.Session 하위 클래스
+    requests를 처음 사용할 때 한 번만 만든다.
+    """
+    import requests
+
+    class CrawlerSession(requests.Session):
+        def request(self, method, url, **kwargs):
+            kwargs.setdefault('timeout', config.timeout)
+            return super().request(method, url, **kwargs)
+
+    return CrawlerSession
+
+
+def create_session() -> 'requests.Session':
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = get_session_class()()
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+    retry = Retry(total=config.max_retries, backoff_factor=config.backoff_factor,
+                  status_forcelist=config.status_forcelist, allowed_methods=frozenset(['GET']),
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=config.pool_connections, pool_maxsize=config.pool_maxsize,
+                          max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def create_async_client(**kwargs) -> 'httpx.AsyncClient':
+    import httpx
+
+    # 두 값 모두 client 전체 기준이다.
+    limits = httpx.Limits(max_connections=config.total_max_connections,
+                          max_keepalive_connections=config.pool_maxsize,
+                          keepalive_expiry=config.keepalive_expiry)
+    kwargs.setdefault('timeout', httpx.Timeout(config.read_timeout, connect=config.connect_timeout))
+    kwargs.setdefault('transport', httpx.AsyncHTTPTransport(retries=config.max_retries, limits=limits))
+    kwargs.setdefault('cookies', no_cookie_jar())
+    return httpx.AsyncClient(**kwargs)
+
+
+def get_session() -> 'requests.Session':
+    """
+    프로세스 공용 requests.Session
+    gunicorn worker처럼 fork된 프로세스에서는 부모의 연결을 공유하지 않도록 새로 만든다.
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _lock:
+            if _session is None or _session_pid != os.getpid():
+                _session = create_session()
+                _session_pid = os.getpid()
+    return _session
+
+
+def get_async_client() -> 'httpx.AsyncClient':
+    """
+    event loop별 공용 httpx.AsyncClient
+    AsyncClient의 연결은 생성된 event loop에 묶이므로 loop마다 하나씩 유지한다.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = create_async_client()
+        _async_clients[loop] = client
+    return client
+
+
+def close_async_client(loop: asyncio.AbstractEventLoop, client: 'httpx.AsyncClient') -> None:
+    """
+    client의 연결은 client를 만든 event loop에 묶여 있으므로 그 loop에서 aclose()를 실행한다.
+    loop가 이미 닫혔으면 연결을 정리할 loop가 없으므로 GC에 맡긴다. (async_crawlers.run은 loop를 닫기 전에 aclose한다.)
+    """
+    if client.is_closed or loop.is_closed():
+        return
+    if not loop.is_running():
+        loop.run_until_complete(client.aclose())
+        return
+
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is loop:
+        task = loop.create_task(client.aclose())
+        _closing.add(task)
+        task.add_done_callback(_closing.discard)
+    else:
+        asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+
+
+def configure(**kwargs) -> HttpConfig:
+    """
+    timeout, pool 크기, 재시도 설정 변경
+    이미 만들어진 session/client는 닫고 다음 요청부터 새 설정으로 만든다.
+    """
+    global config, _session
+    with _lock:
+        config = HttpConfig(**{**config.model_dump(), **kwargs})
+        if _session is not None:
+            _session.close()
+            _session = None
+        async_clients = list(_async_clients.items())
+        _async_clients.clear()
+    for loop, client in async_clients:
+        close_async_client(loop, client)
+    return config
+
+
+async def aclose() -> None:
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,178 @@
+import asyncio
+import sys
+import threading
+import time
+from typing import Dict
+
+from pydantic import BaseModel
+from rokaf_crawler.exceptions import *
+
+# 교육기관(site_id)별 요청 속도 제한(token bucket)과 circuit breaker
+# 검색, 편지 목록 페이지, 편지 작성/전송 요청이 모두 같은 교육기관의 limiter/breaker를 공유한다.
+
+
+class ThrottleConfig(BaseModel):
+    # 교육기관별 초당 요청 수와 순간적으로 허용할 최대 요청 수
+    rate: float = 5.0
+    burst: int = 10
+    # 연속으로 failure_threshold번 실패하면 recovery_timeout초 동안 요청을 보내지 않는다.
+    failure_threshold: int = 5
+    recovery_timeout: float = 30.0
+
+    class Config:
+        extra = "forbid"
+
+
+config = ThrottleConfig()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated_at = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        토큰 하나를 예약하고, 토큰이 생길 때까지 기다려야 하는 시간(초)을 반환한다.
+        """
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self) -> None:
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int, recovery_timeout: float, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """
+        open 상태면 바로 CircuitOpenException을 발생시킨다.
+        cool-down이 지나면 half-open 상태로 바꾸고 시험 요청 하나만 통과시킨다.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.recovery_timeout:
+                self.state = self.HALF_OPEN
+                return
+            raise CircuitOpenException()
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+
+
+def is_upstream_failure(exception: BaseException) -> bool:
+    """
+    사이트 상태 문제로 보는 예외인지 판단한다.
+    훈련병이 없거나 작성 기간이 아닌 경우처럼 정상 응답에서 나온 예외는 실패로 세지 않는다.
+    """
+    if isinstance(exception, WrongAccessException):
+        return True
+
+    # 예외를 낸 HTTP client는 이미 import되어 있다. 다른 client를 새로 불러오지 않도록 불러온 module만 확인한다.
+    requests = sys.modules.get('requests')
+    if requests is not None:
+        if isinstance(exception, (requests.ConnectionError, requests.Timeout)):
+            return True
+        if isinstance(exception, requests.HTTPError) and exception.response is not None:
+            return exception.response.status_code >= 500
+
+    httpx = sys.modules.get('httpx')
+    if httpx is not None:
+        if isinstance(exception, httpx.TransportError):
+            return True
+        if isinstance(exception, httpx.HTTPStatusError):
+            return exception.response.status_code >= 500
+    return False
+
+
+class AgencyThrottle:
+    """
+    교육기관 하나에 대한 limiter + breaker
+        with throttle(site_id): ...
+        async with throttle(site_id): ...
+    """
+    def __init__(self, site_id: str):
+        self.site_id = site_id
+        self.bucket = TokenBucket(config.rate, config.burst)
+        self.breaker = CircuitBreaker(config.failure_threshold, config.recovery_timeout)
+
+    def _exit(self, exception) -> None:
+        if exception is not None and is_upstream_failure(exception):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def __enter__(self):
+        self.breaker.before_call()
+        self.bucket.acquire()
+        return self
+
+    def __exit__(self, exc_type, exception, traceback) -> None:
+        self._exit(exception)
+
+    async def __aenter__(self):
+        self.breaker.before_call()
+        await self.bucket.acquire_async()
+        return self
+
+    async def __aexit__(self, exc_type, exception, traceback) -> None:
+        self._exit(exception)
+
+
+_lock = threading.Lock()
+_throttles: Dict[str, AgencyThrottle] = {}
+
+
+def throttle(site_id: str) -> AgencyThrottle:
+    agency_throttle = _throttles.get(site_id)
+    if agency_throttle is None:
+        with _lock:
+            agency_throttle = _throttles.setdefault(site_id, AgencyThrottle(site_id))
+    return agency_throttle
+
+
+def configure(**kwargs) -> ThrottleConfig:
+    global config
+    with _lock:
+        config = ThrottleConfig(**{**config.model_dump(), **kwargs})
+        _throttles.clear()
+    return config